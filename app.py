@@ -24,45 +24,40 @@ import os
 import sys
 import logging
 import io
+import hmac
 from datetime import datetime, timedelta
 from functools import wraps
 
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, session
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, session, abort, send_file
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
-from flask_mail import Mail, Message
-from flask_session import Session
+from flask_mail import Mail
+from flask_migrate import Migrate
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask_caching import Cache
+from markupsafe import Markup
 
-# Set up logging
-log_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'logs')
-os.makedirs(log_dir, exist_ok=True)
-log_file = os.path.join(log_dir, 'app.log')
-
-logging.basicConfig(
-    level=logging.DEBUG,
-    format='%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]',
-    handlers=[
-        logging.FileHandler(log_file),
-        logging.StreamHandler()
-    ]
-)
+# Set up logging: records are queued and written by a background thread
+# (levels, format, rotation and sampling come from LOG_* environment variables)
+from utils.logging_config import configure_logging
+configure_logging(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'logs', 'app.log'))
+
+from utils.database import database_url, engine_options
 
 logger = logging.getLogger(__name__)
 
 # Initialize Flask app with security and configuration settings
 app = Flask(__name__, 
-    static_url_path='',
+    static_url_path='/static',  # served by nginx in production (see build_static.py)
     static_folder='static',
     template_folder='templates'
 )
 
 # Core application configuration
 app.config['SECRET_KEY'] = os.getenv('SECRET_KEY') or os.urandom(24)
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///church.db'
+app.config['SQLALCHEMY_DATABASE_URI'] = database_url()  # DATABASE_URL, or the SQLite file
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['SQLALCHEMY_POOL_TIMEOUT'] = 30  # Database connection timeout
-app.config['SQLALCHEMY_POOL_RECYCLE'] = 3600  # Recycle connections after an hour
+# Pool timeout/recycle, plus a sized pool with pre-ping on PostgreSQL
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config['SQLALCHEMY_DATABASE_URI'])
 app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(hours=24)  # Session expires after 24 hours of inactivity
 app.config['SESSION_COOKIE_SECURE'] = False  # Allow cookies over HTTP for local development
 app.config['SESSION_COOKIE_HTTPONLY'] = True  # Prevent client-side access to cookies
@@ -77,15 +72,106 @@ app.config['REMEMBER_COOKIE_NAME'] = 'church_remember'
 if app.debug:
     app.config['SEND_FILE_MAX_AGE_DEFAULT'] = 0  # Disable caching for development
 
-# Session configuration
-app.config['SESSION_TYPE'] = 'filesystem'
-app.config['SESSION_FILE_DIR'] = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'flask_session')
-os.makedirs(app.config['SESSION_FILE_DIR'], exist_ok=True)
+# Server-side session store (see utils/session_store.py)
+app.config['SESSION_STORE_PATH'] = os.getenv(
+    'SESSION_STORE_PATH',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance', 'sessions.sqlite3')
+)
+
+# Rate limiter configuration ('mmap' shares counters between workers via a
+# memory-mapped file, 'sql' falls back to the rate_limits table)
+app.config['RATE_LIMIT_BACKEND'] = os.getenv('RATE_LIMIT_BACKEND', 'mmap')
+app.config['RATE_LIMIT_FILE'] = os.getenv(
+    'RATE_LIMIT_FILE',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance', 'rate_limits.mmap')
+)
+
+# Per-worker metric snapshots, merged by /metrics (see utils/metrics.py)
+app.config['METRICS_DIR'] = os.getenv(
+    'METRICS_DIR',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance', 'metrics')
+)
+
+# Counter bumped on every user change; workers drop their cached users when it
+# moves (see utils/user_cache.py)
+app.config['USER_CACHE_VERSION_FILE'] = os.getenv(
+    'USER_CACHE_VERSION_FILE',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance', 'user_cache.version')
+)
+
+# WAL, pragmas, locked-statement retries and background checkpoints for SQLite
+# (see utils/sqlite_profile.py)
+app.config['SQLITE_PROFILE'] = os.getenv('SQLITE_PROFILE', 'True').lower() == 'true'
+
+# Opt-in SQL profiler: slow-query log, N+1 detector, per-view query budgets
+app.config['QUERY_PROFILER_ENABLED'] = os.getenv('QUERY_PROFILER', 'False').lower() == 'true'
+app.config['QUERY_PROFILER_SLOW_MS'] = float(os.getenv('QUERY_PROFILER_SLOW_MS', 100))
+
+# Email configuration (see .env.example)
+app.config['MAIL_SERVER'] = os.getenv('MAIL_SERVER', 'localhost')
+app.config['MAIL_PORT'] = int(os.getenv('MAIL_PORT', 25))
+app.config['MAIL_USE_TLS'] = os.getenv('MAIL_USE_TLS', 'False').lower() == 'true'
+app.config['MAIL_USE_SSL'] = os.getenv('MAIL_USE_SSL', 'False').lower() == 'true'
+app.config['MAIL_USERNAME'] = os.getenv('MAIL_USERNAME')
+app.config['MAIL_PASSWORD'] = os.getenv('MAIL_PASSWORD')
+app.config['MAIL_DEFAULT_SENDER'] = os.getenv('MAIL_DEFAULT_SENDER')
+
+# Background export jobs write (and cache) their files here
+if os.getenv('EXPORT_DIR'):
+    app.config['EXPORT_DIR'] = os.getenv('EXPORT_DIR')
+
+# Content-addressed signature and upload files (backup.sh saves this directory)
+app.config['BLOB_DIR'] = os.getenv(
+    'BLOB_DIR',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'uploads')
+)
+
+# Rendered dashboard fragments, kept per worker until the data they show changes
+app.config['FRAGMENT_CACHE_ENABLED'] = os.getenv('FRAGMENT_CACHE', 'True').lower() == 'true'
+app.config['FRAGMENT_CACHE_MAX_BYTES'] = int(os.getenv('FRAGMENT_CACHE_MAX_BYTES', 16 * 1024 * 1024))
+
+# 304 responses for unchanged dashboards and APIs (see utils/conditional.py)
+app.config['CONDITIONAL_GET_ENABLED'] = os.getenv('CONDITIONAL_GET', 'True').lower() == 'true'
+app.config['CONDITIONAL_GET_RELEASE'] = os.getenv('RELEASE')
 
 # Initialize extensions
-from models import db, RateLimit
+from models import db, User, FormData
+from utils.rate_limiter import RateLimiter, get_remote_address
+from utils.export_jobs import ExportJobRunner
+from utils.outbox import Outbox
+from utils.announcements import Announcer
+from utils.user_cache import UserCache
+from utils.session_store import SessionStore
+from utils.metrics import Metrics
+from utils.query_profiler import QueryProfiler
+from utils.sqlite_profile import SQLiteProfile
+from utils.blob_store import BlobStore, content_type, is_ref
+from utils.signature import RENDERERS as SIGNATURE_RENDERERS, is_signature, signature_url, store_signature
+from utils.fragment_cache import FragmentCache
+from utils.shared_cache import get_or_set as shared_get_or_set
+from utils.conditional import ConditionalGet, conditional
+from utils.static_assets import StaticAssets
+from utils.versioning import user_forms
+import utils.versioning  # registers the data-version session hooks
+import utils.registration_stats  # registers the statistics session hooks
 db.init_app(app)
-Session(app)
+# Alembic revisions in migrations/: flask db upgrade
+Migrate(app, db)
+# First, so its request timer wraps every other before_request hook
+metrics = Metrics(app)
+QueryProfiler(app)
+SQLiteProfile(app, db)
+SessionStore(app)
+mail = Mail(app)
+outbox = Outbox(app, mail)
+announcer = Announcer(app, mail)
+limiter = RateLimiter(app)
+export_jobs = ExportJobRunner(app)
+user_cache = UserCache(app)
+fragment_cache = FragmentCache(app)
+ConditionalGet(app)
+StaticAssets(app)
+blob_store = BlobStore(app)
 
 # Custom rate limiter implementation
 def rate_limit(max_requests, period):
@@ -93,7 +179,7 @@ def rate_limit(max_requests, period):
         @wraps(f)
         def wrapped(*args, **kwargs):
             key = f"{get_remote_address()}:{f.__name__}"
-            hits = RateLimit.increment(key, reset_after=period)
+            hits = limiter.hit(key, period)
             
             if hits > max_requests:
                 return jsonify({"error": "Too many requests"}), 429
@@ -101,9 +187,12 @@ def rate_limit(max_requests, period):
         return wrapped
     return decorator
 
-# Configure caching system
+# Configure caching system: one SQLite file shared by all workers on the host
+# (see utils/shared_cache.py); CACHE_TYPE=SimpleCache gives a per-process dict
 cache = Cache(app, config={
-    'CACHE_TYPE': 'simple'  # Simple cache for development, consider 'redis' for production
+    'CACHE_TYPE': os.getenv('CACHE_TYPE', 'utils.shared_cache.SQLiteCache'),
+    'CACHE_SQLITE_PATH': os.getenv('CACHE_SQLITE_PATH'),
+    'CACHE_MAX_BYTES': int(os.getenv('CACHE_MAX_BYTES', 64 * 1024 * 1024)),
 })
 
 # Initialize Flask-Login
@@ -120,7 +209,7 @@ opt_dir = '/opt/church'
 for path in [current_dir, opt_dir]:
     if path not in sys.path:
         sys.path.append(path)
-        logger.debug(f"Added {path} to Python path")
+        logger.debug("Added %s to Python path", path)
 
 # Configure secure password requirements
 PASSWORD_MIN_LENGTH = 8
@@ -135,28 +224,40 @@ PASSWORD_REQUIREMENTS = {
 @login_manager.user_loader
 def load_user(user_id):
     """
-    Load a user instance from the database based on the provided user ID.
+    Load the current user from the per-worker user cache.
+    
+    The id is ``"<user id>:<password version>"`` (see ``User.get_id``), both
+    in the session and in the remember-me cookie. Ids issued before a password
+    change are rejected, which logs out every other session and remembered
+    browser of a user whose password was changed or reset.
     
     Args:
-        user_id (int): The ID of the user to load
+        user_id (str): The id stored by Flask-Login
     
     Returns:
-        User instance if found, otherwise None
+        CachedUser if found and the session is still valid, otherwise None
     """
     try:
-        user = User.query.get(int(user_id))
-        if user:
-            logger.debug(f"Successfully loaded user: {user.email}")
-            return user
-        logger.warning(f"No user found with ID: {user_id}")
-        return None
+        user_id, _, password_version = user_id.partition(':')
+        user = user_cache.get(int(user_id))
+        if user is None:
+            logger.warning("No user found with ID: %s", user_id)
+            return None
+        if not hmac.compare_digest(password_version, user.password_version):
+            logger.info("Rejecting session for %s after password change", user.email)
+            return None
+        return user
     except Exception as e:
-        logger.error(f"Error loading user {user_id}: {str(e)}")
+        logger.error("Error loading user %s: %s", user_id, e)
         return None
 
 def send_registration_confirmation(form_data):
     """
-    Send a confirmation email to users after successful registration submission.
+    Queue a confirmation email for a registration submission.
+
+    The message is added to the email outbox in the caller's transaction, so it
+    is only sent if the registration itself is committed. Delivery happens in
+    the outbox dispatcher, never on the request thread.
     
     Args:
         form_data (FormData): Object containing all registration form fields including:
@@ -168,17 +269,12 @@ def send_registration_confirmation(form_data):
             - event details and payment status
     
     Note:
-        Email sending failures are logged but don't interrupt the registration process
-        to ensure users can still register even if email service is temporarily down.
+        Rendering failures are logged but don't interrupt the registration process,
+        and SMTP failures are retried by the outbox dispatcher.
     """
     try:
-        msg = Message(
-            subject=f"Registration Confirmation - {form_data.event_name}",
-            recipients=[current_user.email]
-        )
-        
         # Render the HTML template with the form data
-        msg.html = render_template(
+        html = render_template(
             'email/registration_confirmation.html',
             student_name=form_data.student_name,
             date_of_birth=form_data.date_of_birth,
@@ -206,10 +302,15 @@ def send_registration_confirmation(form_data):
             payment_status=form_data.payment_status
         )
         
-        mail.send(msg)
-        logger.info(f"Sent registration confirmation email for {form_data.student_name} to {current_user.email}")
+        outbox.enqueue(
+            subject=f"Registration Confirmation - {form_data.event_name}",
+            recipients=[current_user.email],
+            html=html
+        )
+        logger.info("Queued registration confirmation email for %s to %s",
+                    form_data.student_name, current_user.email)
     except Exception as e:
-        logger.error(f"Failed to send registration confirmation email: {str(e)}")
+        logger.error("Failed to queue registration confirmation email: %s", e)
         # Don't raise the exception - we don't want to break the registration process if email fails
 
 @app.after_request
@@ -281,7 +382,7 @@ def index():
     Returns:
         str: Rendered HTML for the landing page
     """
-    logger.debug(f"Index route accessed. User authenticated: {current_user.is_authenticated}")
+    logger.debug("Index route accessed. User authenticated: %s", current_user.is_authenticated)
     return render_template('index.html')
 
 @app.route('/login', methods=['GET', 'POST'])
@@ -318,7 +419,7 @@ def login():
             flash('Please provide both email and password', 'error')
             return redirect(url_for('login'))
         
-        logger.debug(f"Attempting login for email: {email}")
+        logger.debug("Attempting login for email: %s", email)
         user = User.query.filter_by(email=email).first()
         
         if user and user.check_password(password):
@@ -327,7 +428,7 @@ def login():
                 # Invalidate other sessions
                 session.clear()
             
-            logger.info(f"Successful login for user: {email}")
+            logger.info("Successful login for user: %s", email)
             session.permanent = True
             login_user(user, remember=True, duration=timedelta(days=7))
             
@@ -339,15 +440,14 @@ def login():
             session['login_time'] = datetime.utcnow().timestamp()
             
             logger.debug("User logged in successfully with remember=True")
-            logger.debug(f"Session contains: {session}")
             
             next_page = request.args.get('next')
             if not next_page or not next_page.startswith('/'):
                 next_page = url_for('dashboard')
-            logger.debug(f"Redirecting to: {next_page}")
+            logger.debug("Redirecting to: %s", next_page)
             return redirect(next_page)
         
-        logger.warning(f"Failed login attempt for email: {email}")
+        logger.warning("Failed login attempt for email: %s", email)
         flash('Invalid email or password', 'error')
         
     return render_template('login.html')
@@ -418,7 +518,7 @@ def signup():
             
         except Exception as e:
             db.session.rollback()
-            logger.error(f"Error during user registration: {str(e)}")
+            logger.error("Error during user registration: %s", e)
             flash('An error occurred during registration. Please try again.', 'error')
             return redirect(url_for('signup'))
 
@@ -426,6 +526,7 @@ def signup():
 
 @app.route('/dashboard')
 @login_required
+@conditional(lambda: user_forms(current_user.id))
 def dashboard():
     """
     Display the user's personalized dashboard.
@@ -442,8 +543,17 @@ def dashboard():
     Note:
         Requires authentication via @login_required decorator
     """
-    forms = FormData.query.filter_by(user_id=current_user.id).order_by(FormData.date_submitted.desc()).all()
-    return render_template('dashboard.html', forms=forms)
+    def build():
+        forms = (FormData.query
+                 .options(*FormData.profile('dashboard'))
+                 .filter_by(user_id=current_user.id)
+                 .order_by(FormData.date_submitted.desc())
+                 .all())
+        return Markup(render_template('dashboard_forms_partial.html', forms=forms))
+
+    forms_html = fragment_cache.get_or_build('dashboard_forms', [user_forms(current_user.id)],
+                                             current_user.id, build)
+    return render_template('dashboard.html', forms_html=forms_html)
 
 @app.route('/submit-form', methods=['GET', 'POST'])
 @login_required
@@ -492,22 +602,23 @@ def submit_form():
                 insurance_company=request.form.get('insurance_company'),
                 policy_number=request.form.get('policy_number'),
                 photo_release=bool(request.form.get('photo_release')),
-                liability_signature=request.form.get('liability_signature'),
-                photo_signature=request.form.get('photo_signature')
+                # Signature strokes go to the blob store; the row keeps a reference
+                liability_signature=store_signature(blob_store, request.form.get('liability_signature')),
+                photo_signature=store_signature(blob_store, request.form.get('photo_signature'))
             )
             
             db.session.add(form_data)
-            db.session.commit()
             
-            # Send confirmation email
+            # Queue the confirmation email in the same transaction
             send_registration_confirmation(form_data)
+            db.session.commit()
             
             flash('Form submitted successfully!', 'success')
             return redirect(url_for('dashboard'))
             
         except Exception as e:
             db.session.rollback()
-            logger.error(f"Error submitting form: {str(e)}")
+            logger.error("Error submitting form: %s", e)
             flash('An error occurred while submitting the form. Please try again.', 'error')
             return redirect(url_for('submit_form'))
     
@@ -524,7 +635,8 @@ def logout():
     Returns:
         Redirect to login page
     """
-    logger.debug(f"Logging out user: {current_user.email if current_user.is_authenticated else 'Unknown'}")
+    logger.debug("Logging out user: %s",
+                 current_user.email if current_user.is_authenticated else 'Unknown')
     logout_user()
     session.clear()
     flash('You have been logged out.', 'info')
@@ -568,19 +680,21 @@ def reset_password_request():
             reset_url = url_for('reset_password', token=token, _external=True)
             
             try:
-                msg = Message(
+                outbox.enqueue(
                     'Password Reset Request',
-                    recipients=[user.email]
+                    recipients=[user.email],
+                    html=render_template(
+                        'email/reset_password.html',
+                        reset_url=reset_url
+                    )
                 )
-                msg.html = render_template(
-                    'email/reset_password.html',
-                    reset_url=reset_url
-                )
-                mail.send(msg)
-                logger.info(f"Password reset email sent to {email}")
+                # Token and email are committed together
+                db.session.commit()
+                logger.info("Password reset email queued for %s", email)
                 flash('Check your email for instructions to reset your password')
             except Exception as e:
-                logger.error(f"Error sending password reset email to {email}: {str(e)}")
+                db.session.rollback()
+                logger.error("Error queueing password reset email to %s: %s", email, e)
                 logger.exception("Full traceback:")
                 flash('Error sending password reset email. Please try again later.')
         else:
@@ -661,6 +775,59 @@ def check_session_security():
                 flash('Your session has expired. Please login again.', 'info')
                 return redirect(url_for('login'))
 
+# Stored blobs (signatures)
+def can_read_blob(ref):
+    """Admins may read any blob, other users only those of their own registrations."""
+    if current_user.is_admin:
+        return True
+    owned = (db.session.query(FormData.id)
+             .filter(FormData.user_id == current_user.id,
+                     db.or_(FormData.liability_signature == ref, FormData.photo_signature == ref))
+             .first())
+    return owned is not None
+
+def immutable(response):
+    # A reference is the hash of the content, so it never needs revalidating
+    response.headers['Cache-Control'] = 'private, max-age=31536000, immutable'
+    return response
+
+@app.route('/blobs/<ref>')
+@login_required
+def blob(ref):
+    """
+    Serve a stored blob such as a signature.
+
+    Returns:
+        The blob, or 404 if it does not exist or is not visible to the user
+    """
+    if not is_ref(ref) or not can_read_blob(ref):
+        abort(404)
+    try:
+        blob_file = blob_store.open(ref)
+    except FileNotFoundError:
+        abort(404)
+    return immutable(send_file(blob_file, mimetype=content_type(ref), etag=ref.split('.')[0]))
+
+@app.route('/blobs/<ref>/signature.<any(svg, png):fmt>')
+@login_required
+def signature_image(ref, fmt):
+    """
+    Serve a stored signature drawn as SVG or PNG.
+
+    The image is rendered from the strokes on first request and kept in the
+    blob store, so later requests (from any worker) just send the file.
+    """
+    if not is_signature(ref) or not can_read_blob(ref):
+        abort(404)
+    mimetype, render = SIGNATURE_RENDERERS[fmt]
+    try:
+        image = blob_store.open_derived(ref, fmt, render)
+    except FileNotFoundError:
+        abort(404)
+    return immutable(send_file(image, mimetype=mimetype, etag=f"{ref.split('.')[0]}-{fmt}"))
+
+app.add_template_global(signature_url)
+
 # Debug route for static files
 @app.route('/debug-static')
 def debug_static():
@@ -707,7 +874,6 @@ def db_health():
         }), 500
 
 @app.route('/health/email')
-@cache.cached(timeout=60)
 def email_health():
     """
     Email service health check.
@@ -719,13 +885,51 @@ def email_health():
     
     Returns:
         dict: Email service status and configuration details
+    
+    Note:
+        The result is cached for a minute, and only one worker connects to
+        the mail server when it expires
     """
-    try:
-        with app.app_context():
-            mail.connect()
-        return jsonify({'status': 'healthy', 'service': 'email'})
-    except Exception as e:
-        return jsonify({'status': 'unhealthy', 'service': 'email', 'error': str(e)}), 500
+    def check():
+        try:
+            with app.app_context():
+                mail.connect()
+            return {'status': 'healthy', 'service': 'email'}, 200
+        except Exception as e:
+            return {'status': 'unhealthy', 'service': 'email', 'error': str(e)}, 500
+
+    body, status = shared_get_or_set(cache.cache, 'health:email', check, timeout=60)
+    return jsonify(body), status
+
+@app.route('/health/user-cache')
+def user_cache_health():
+    """Hit/miss counters of this worker's user cache."""
+    return jsonify(dict(user_cache.stats(), pid=os.getpid()))
+
+@app.route('/health/fragment-cache')
+def fragment_cache_health():
+    """Hit/miss/eviction counters of this worker's fragment cache."""
+    return jsonify(dict(fragment_cache.stats(), pid=os.getpid()))
+
+@app.route('/health/cache')
+def shared_cache_health():
+    """Counters of the shared cache: this worker's hits/misses, and its size and evictions."""
+    stats = cache.cache.stats() if hasattr(cache.cache, 'stats') else {}
+    return jsonify(dict(stats, backend=type(cache.cache).__name__, pid=os.getpid()))
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """
+    Request metrics of all workers in Prometheus text format.
+
+    Open to scrapers connecting to the app directly from localhost; requests
+    coming through the reverse proxy (which adds X-Forwarded-For) need an
+    admin login.
+    """
+    local = request.remote_addr in ('127.0.0.1', '::1') and 'X-Forwarded-For' not in request.headers
+    if not local and not (current_user.is_authenticated and current_user.is_admin):
+        return jsonify({'success': False, 'message': 'Forbidden'}), 403
+    return app.response_class(metrics.render(), mimetype='text/plain; version=0.0.4')
 
 # Apply rate limiting to sensitive endpoints
 @app.route('/login', methods=['POST'])
@@ -758,5 +962,14 @@ def signup_post():
 from routes.admin import admin_bp
 app.register_blueprint(admin_bp)
 
+# Make sure the registration full-text index and its triggers exist (SQLite only)
+from utils.search import ensure_search_index
+with app.app_context():
+    try:
+        with db.engine.begin() as conn:
+            ensure_search_index(conn)
+    except Exception as e:
+        logger.warning("Could not create registration search index: %s", e)
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000, debug=False)
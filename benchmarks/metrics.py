@@ -0,0 +1,103 @@
+"""
+Micro-benchmark of the per-request cost of the /metrics instrumentation.
+
+Times the request hooks of ``utils.metrics.Metrics`` directly inside a
+request context (what every request pays), the SQLAlchemy cursor events
+(what every SQL statement pays), and a full request through the test client
+with and without the extension, using a throwaway SQLite database.
+
+Usage:
+    python benchmarks/metrics.py [--requests 20000]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from sqlalchemy import text
+
+from models import db
+from utils.metrics import Metrics
+
+
+def make_app(tmp, instrumented):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+    app.config['METRICS_DIR'] = os.path.join(tmp, 'metrics')
+    app.config['METRICS_ENABLED'] = instrumented
+    db.init_app(app)
+    metrics = Metrics(app)
+
+    @app.route('/page')
+    def page():
+        db.session.execute(text('SELECT 1')).scalar()
+        return 'ok' * 100
+
+    return app, metrics
+
+
+def report(name, elapsed, count, unit='request'):
+    print(f"{name:<28} {count:>7} x  {elapsed:8.3f}s  {elapsed / count * 1e6:8.2f} us/{unit}")
+
+
+def time_client(app, requests):
+    client = app.test_client()
+    client.get('/page')
+    start = time.perf_counter()
+    for _ in range(requests):
+        client.get('/page')
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--requests', type=int, default=20000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # The plain app goes first: the cursor events are registered globally
+        plain_app, _ = make_app(tmp, instrumented=False)
+        plain = time_client(plain_app, args.requests)
+
+        app, metrics = make_app(tmp, instrumented=True)
+        response = app.response_class('ok')
+        with app.test_request_context('/page'):
+            start = time.perf_counter()
+            for _ in range(args.requests):
+                metrics._before_request()
+                metrics._after_request(response)
+            report('request hooks', time.perf_counter() - start, args.requests)
+
+        with app.app_context():
+            conn = db.engine.connect()
+            statement = text('SELECT 1')
+            for label, start in (('query, not instrumented', None),
+                                 ('query, instrumented', time.perf_counter())):
+                metrics._local.start = start
+                metrics._local.queries, metrics._local.seconds = 0, 0.0
+                start = time.perf_counter()
+                for _ in range(args.requests):
+                    conn.execute(statement).scalar()
+                report(label, time.perf_counter() - start, args.requests, 'query')
+            metrics._local.start = None
+            conn.close()
+
+        instrumented = time_client(app, args.requests)
+        report('test client, plain', plain, args.requests)
+        report('test client, instrumented', instrumented, args.requests)
+        print(f"overhead through the test client: "
+              f"{(instrumented - plain) / args.requests * 1e6:.2f} us/request")
+
+        start = time.perf_counter()
+        body = metrics.render()
+        print(f"/metrics render: {(time.perf_counter() - start) * 1e3:.2f} ms, "
+              f"{len(body.splitlines())} lines")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""
+Micro-benchmark for the rate limiter backends.
+
+Runs the same stream of checks against the legacy ORM counter (SELECT plus
+commits per hit), the SQL UPSERT backend and the shared mmap backend, using
+a throwaway SQLite database and mmap file.
+
+Usage:
+    python benchmarks/rate_limiter.py [--checks 5000] [--keys 200]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+
+from models import db, RateLimit
+from utils.rate_limiter import MmapRateLimiter, SQLRateLimiter
+
+
+def legacy_increment(key, reset_after):
+    """The per-hit ORM logic the SQL backend replaced."""
+    now = datetime.utcnow()
+    limit = RateLimit.query.filter_by(key=key).first()
+    if limit and limit.reset_time <= now:
+        limit.hits = 0
+        limit.reset_time = now + reset_after
+        db.session.commit()
+    if not limit:
+        limit = RateLimit(key=key, hits=1, reset_time=now + reset_after)
+        db.session.add(limit)
+    else:
+        limit.hits += 1
+    db.session.commit()
+    return limit.hits
+
+
+def run(name, hit, keys, checks):
+    period = timedelta(minutes=15)
+    start = time.perf_counter()
+    for i in range(checks):
+        hit(keys[i % len(keys)], period)
+    elapsed = time.perf_counter() - start
+    print(f"{name:<8} {checks:>7} checks  {elapsed:8.3f}s  "
+          f"{checks / elapsed:>10.0f} checks/sec  {elapsed / checks * 1e6:8.1f} us/check")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--checks', type=int, default=5000)
+    parser.add_argument('--keys', type=int, default=200)
+    args = parser.parse_args()
+
+    keys = [f"10.0.{i // 256}.{i % 256}:login" for i in range(args.keys)]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        app = Flask(__name__)
+        app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+        db.init_app(app)
+        with app.app_context():
+            db.create_all()
+            run('legacy', legacy_increment, keys, args.checks)
+            db.session.execute(RateLimit.__table__.delete())
+            db.session.commit()
+            run('sql', SQLRateLimiter().hit, keys, args.checks)
+        run('mmap', MmapRateLimiter(os.path.join(tmp, 'bench.mmap')).hit, keys, args.checks)
+
+
+if __name__ == '__main__':
+    main()
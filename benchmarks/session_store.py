@@ -0,0 +1,147 @@
+"""
+Benchmark of the session backends with a large number of stored sessions.
+
+Fills a throwaway directory with sessions for both the old Flask-Session
+filesystem layout (cachelib's one pickle file per session) and the SQLite
+store, then replays the same request mix against each:
+
+- read: load the session, leave it unchanged (the common page view)
+- write: load the session and change it (login, flash message)
+
+The filesystem backend rewrites the file on every request; the SQLite store
+skips unchanged sessions. The expired-session sweep is timed as well.
+
+Usage:
+    python benchmarks/session_store.py [--sessions 100000] [--requests 5000]
+"""
+
+import argparse
+import os
+import pickle
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cachelib.file import FileSystemCache
+
+from utils.session_store import SQLiteSessionStore, SessionSerializer, storage_key
+
+LIFETIME = 24 * 3600
+
+
+def login_session(i):
+    return {
+        'ip': f'10.0.{i // 256 % 256}.{i % 256}',
+        'user_id': i,
+        'email': f'user{i}@example.com',
+        'is_admin': False,
+        'login_time': 1700000000.0 + i,
+        '_user_id': f'{i}:3f2a9c0d1e4b5a6c',
+        '_fresh': True,
+        '_id': 'a' * 128,
+        '_permanent': True,
+    }
+
+
+def populate_files(cache, sids):
+    for i, sid in enumerate(sids):
+        cache.set(f'session:{sid}', login_session(i), LIFETIME)
+
+
+def populate_sqlite(store, serializer, sids):
+    now = time.time()
+    rows = []
+    for i, sid in enumerate(sids):
+        # A tenth of the sessions are already expired, for the sweep
+        expiry = now - 60 if i % 10 == 0 else now + LIFETIME
+        rows.append((storage_key(sid), serializer.dumps(login_session(i)), expiry))
+        if len(rows) == 10000:
+            store.save_many(rows)
+            rows = []
+    store.save_many(rows)
+
+
+def files_request(cache, sid, change):
+    data = cache.get(f'session:{sid}') or {}
+    if change:
+        data['_flashes'] = [('info', 'Saved')]
+    # Flask-Session saves every non-empty session on every request
+    cache.set(f'session:{sid}', data, LIFETIME)
+
+
+def sqlite_request(store, serializer, sid, change):
+    key = storage_key(sid)
+    row = store.load(key, time.time())
+    stored = row[0] if row else None
+    data = serializer.loads(stored) if stored else {}
+    if change:
+        data['_flashes'] = [('info', 'Saved')]
+    payload = serializer.dumps(data)
+    if data and payload != stored:
+        store.save(key, payload, time.time() + LIFETIME)
+
+
+def run(name, request, sids, requests, write_ratio):
+    rng = random.Random(42)
+    start = time.perf_counter()
+    for _ in range(requests):
+        request(rng.choice(sids), rng.random() < write_ratio)
+    elapsed = time.perf_counter() - start
+    print(f"{name:<24} {requests:>7} requests  {elapsed:8.3f}s  "
+          f"{elapsed / requests * 1e6:8.1f} us/request")
+
+
+def disk_usage(path):
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    total = 0
+    for entry in os.scandir(path):
+        total += entry.stat().st_blocks * 512
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--sessions', type=int, default=100000)
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--write-ratio', type=float, default=0.1)
+    args = parser.parse_args()
+
+    sids = [f'{i:032x}' for i in range(args.sessions)]
+    serializer = SessionSerializer()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        files_dir = os.path.join(tmp, 'flask_session')
+        db_path = os.path.join(tmp, 'sessions.sqlite3')
+        # threshold=0: no pruning, the directory just grows
+        cache = FileSystemCache(files_dir, threshold=0)
+        store = SQLiteSessionStore(db_path)
+
+        start = time.perf_counter()
+        populate_files(cache, sids)
+        print(f"filesystem: stored {args.sessions} sessions in {time.perf_counter() - start:.1f}s, "
+              f"{disk_usage(files_dir) / 1e6:.1f} MB on disk")
+        start = time.perf_counter()
+        populate_sqlite(store, serializer, sids)
+        print(f"sqlite:     stored {args.sessions} sessions in {time.perf_counter() - start:.1f}s, "
+              f"{disk_usage(db_path) / 1e6:.1f} MB on disk")
+        pickled = len(pickle.dumps(login_session(1)))
+        print(f"payload per login session: pickle {pickled} bytes, "
+              f"compact {len(serializer.dumps(login_session(1)))} bytes")
+
+        run('filesystem', lambda sid, change: files_request(cache, sid, change),
+            sids, args.requests, args.write_ratio)
+        run('sqlite', lambda sid, change: sqlite_request(store, serializer, sid, change),
+            sids, args.requests, args.write_ratio)
+
+        start = time.perf_counter()
+        deleted = store.sweep(time.time())
+        print(f"sqlite sweep: removed {deleted} expired sessions in "
+              f"{time.perf_counter() - start:.3f}s")
+
+
+if __name__ == '__main__':
+    main()
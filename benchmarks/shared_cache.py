@@ -0,0 +1,119 @@
+"""
+Benchmark of the Flask-Caching backends as gunicorn workers use them.
+
+Starts several worker processes that each replay the same skewed stream of
+cache lookups (a few hot keys, a long tail), computing and storing a value
+on every miss, against:
+
+- simple: cachelib's per-process dict (the old configuration)
+- filesystem: cachelib's one pickle file per key in a shared directory
+- sqlite: the shared SQLite backend (utils/shared_cache.py)
+
+For each it prints the hit rate over all workers, how many values were
+computed, the lookups per second, and the size the cache ended up with.
+
+Usage:
+    python benchmarks/shared_cache.py [--workers 4] [--lookups 5000] [--keys 2000]
+"""
+
+import argparse
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cachelib.file import FileSystemCache
+from cachelib.simple import SimpleCache
+
+from utils.shared_cache import SQLiteCache
+
+
+def value_for(key, size):
+    return {'key': key, 'html': 'x' * size}
+
+
+def make_backend(name, tmp, args):
+    if name == 'simple':
+        return SimpleCache(threshold=args.keys, default_timeout=0)
+    if name == 'filesystem':
+        return FileSystemCache(os.path.join(tmp, 'files'), threshold=args.keys, default_timeout=0)
+    return SQLiteCache(os.path.join(tmp, 'cache.sqlite3'), max_bytes=args.max_bytes,
+                       default_timeout=0)
+
+
+def worker(name, tmp, args, seed, results):
+    backend = make_backend(name, tmp, args)
+    rng = random.Random(seed)
+    # Zipf-like popularity: key i is requested in proportion to 1 / (i + 1)
+    keys = [f'page:{i}' for i in range(args.keys)]
+    weights = [1 / (i + 1) for i in range(args.keys)]
+    stream = rng.choices(keys, weights, k=args.lookups)
+    hits = builds = 0
+    start = time.perf_counter()
+    for key in stream:
+        if backend.get(key) is not None:
+            hits += 1
+            continue
+        builds += 1
+        time.sleep(args.build_ms / 1000)  # the work a hit saves
+        backend.set(key, value_for(key, args.value_size))
+    results.put((hits, builds, time.perf_counter() - start))
+
+
+def disk_usage(path):
+    if not os.path.exists(path):
+        return 0
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(entry.stat().st_size for entry in os.scandir(path))
+
+
+def run(name, args):
+    with tempfile.TemporaryDirectory() as tmp:
+        make_backend(name, tmp, args)  # create the schema before the workers race for it
+        results = multiprocessing.Queue()
+        workers = [multiprocessing.Process(target=worker, args=(name, tmp, args, seed, results))
+                   for seed in range(args.workers)]
+        start = time.perf_counter()
+        for process in workers:
+            process.start()
+        totals = [results.get() for _ in workers]
+        for process in workers:
+            process.join()
+        elapsed = time.perf_counter() - start
+        hits = sum(hits for hits, _, _ in totals)
+        builds = sum(builds for _, builds, _ in totals)
+        lookups = args.workers * args.lookups
+        if name == 'sqlite':
+            stored = f"{make_backend(name, tmp, args).stats()['bytes'] / 1e6:.1f} MB"
+        elif name == 'filesystem':
+            stored = f"{disk_usage(os.path.join(tmp, 'files')) / 1e6:.1f} MB"
+        else:
+            stored = 'per process'
+        print(f"{name:<11} hit rate {hits / lookups:6.1%}  {builds:>6} builds  "
+              f"{lookups / elapsed:>8.0f} lookups/sec  stored {stored}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--lookups', type=int, default=5000, help='per worker')
+    parser.add_argument('--keys', type=int, default=2000)
+    parser.add_argument('--value-size', type=int, default=2000, help='bytes of HTML per value')
+    parser.add_argument('--build-ms', type=float, default=2.0, help='cost of computing a value')
+    parser.add_argument('--max-bytes', type=int, default=64 * 1024 * 1024,
+                        help='byte budget of the sqlite backend')
+    args = parser.parse_args()
+
+    print(f"{args.workers} workers x {args.lookups} lookups over {args.keys} keys, "
+          f"{args.build_ms} ms per miss")
+    for name in ('simple', 'filesystem', 'sqlite'):
+        run(name, args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,182 @@
+"""
+Concurrency benchmark of the SQLite database under gunicorn-like load.
+
+Runs several processes with several threads each against one throwaway
+database file for a fixed time. The request mix is page views (a read),
+login attempts (the rate-limit UPSERT) and registrations (a read followed by
+an INSERT in one transaction). This runs twice: once with SQLite's defaults
+(rollback journal, no retries), as the app used to run, and once with
+``utils.sqlite_profile`` installed plus a background checkpointer. Reports
+write throughput, read/write latency percentiles and failed requests.
+
+Usage:
+    python benchmarks/sqlite_concurrency.py [--processes 4] [--threads 4] [--seconds 10]
+"""
+
+import argparse
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import case, create_engine, func, select
+from sqlalchemy.dialects import sqlite
+from sqlalchemy.exc import OperationalError
+
+from models import db, FormData, RateLimit, User
+from utils.sqlite_profile import WALCheckpointer, install
+
+EVENTS = ['Winter Camp', 'Summer Camp', 'Youth Retreat']
+
+
+def make_engine(path, tuned):
+    engine = create_engine(f'sqlite:///{path}')
+    if tuned:
+        install(engine)
+    return engine
+
+
+def setup(path, tuned, users):
+    engine = make_engine(path, tuned)
+    db.metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(User.__table__.insert(),
+                     [{'email': f'user{i}@example.com', 'password_hash': 'x', 'is_admin': False}
+                      for i in range(users)])
+        conn.execute(FormData.__table__.insert(),
+                     [{'user_id': i % users + 1, 'student_name': f'Student {i}',
+                       'event_name': EVENTS[i % 3], 'date_submitted': datetime.utcnow()}
+                      for i in range(2000)])
+    engine.dispose()
+
+
+def page_view(engine, rng, users):
+    table = FormData.__table__
+    with engine.connect() as conn:
+        conn.execute(select(table.c.id, table.c.student_name)
+                     .where(table.c.event_name == rng.choice(EVENTS))
+                     .order_by(table.c.date_submitted.desc()).limit(20)).all()
+
+
+def login_attempt(engine, rng, users):
+    table = RateLimit.__table__
+    now = datetime.utcnow()
+    reset_time = now + timedelta(minutes=15)
+    expired = table.c.reset_time <= now
+    stmt = sqlite.insert(table).values(
+        key=f'login:10.0.0.{rng.randrange(256)}', hits=1, reset_time=reset_time, created_at=now)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.key],
+        set_={'hits': case((expired, 1), else_=table.c.hits + 1),
+              'reset_time': case((expired, reset_time), else_=table.c.reset_time)},
+    ).returning(table.c.hits)
+    with engine.begin() as conn:
+        conn.execute(stmt).scalar_one()
+
+
+def registration(engine, rng, users):
+    table = FormData.__table__
+    user_id = rng.randrange(users) + 1
+    with engine.begin() as conn:
+        conn.execute(select(func.count()).select_from(table).where(table.c.user_id == user_id)).scalar()
+        conn.execute(table.insert().values(user_id=user_id, student_name='New Student',
+                                           event_name=rng.choice(EVENTS),
+                                           date_submitted=datetime.utcnow()))
+
+
+MIX = [(page_view, 0.7), (login_attempt, 0.2), (registration, 0.1)]
+
+
+def worker(path, tuned, threads, seconds, users, results):
+    engine = make_engine(path, tuned)
+    deadline = time.monotonic() + seconds
+    latencies = {'read': [], 'write': []}
+    errors = [0]
+    lock = threading.Lock()
+
+    def run(seed):
+        rng = random.Random(seed)
+        while time.monotonic() < deadline:
+            op = rng.choices([op for op, _ in MIX], [weight for _, weight in MIX])[0]
+            kind = 'read' if op is page_view else 'write'
+            start = time.perf_counter()
+            try:
+                op(engine, rng, users)
+            except OperationalError:
+                with lock:
+                    errors[0] += 1
+                continue
+            with lock:
+                latencies[kind].append(time.perf_counter() - start)
+
+    pool = [threading.Thread(target=run, args=(os.getpid() * 100 + i,)) for i in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    results.put((latencies, errors[0]))
+
+
+def percentile(values, q):
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+def run_profile(name, tmp, tuned, args):
+    path = os.path.join(tmp, f'{name}.db')
+    setup(path, tuned, args.users)
+    stop = threading.Event()
+    if tuned:
+        checkpointer = WALCheckpointer(path, interval=1, truncate_bytes=64 * 1024 * 1024)
+
+        def checkpoint_loop():
+            while not stop.wait(checkpointer.interval):
+                checkpointer.checkpoint()
+        threading.Thread(target=checkpoint_loop, daemon=True).start()
+
+    ctx = multiprocessing.get_context('fork')
+    results = ctx.Queue()
+    procs = [ctx.Process(target=worker, args=(path, tuned, args.threads, args.seconds, args.users, results))
+             for _ in range(args.processes)]
+    for proc in procs:
+        proc.start()
+    reads, writes, errors = [], [], 0
+    for _ in procs:
+        latencies, failed = results.get()
+        reads += latencies['read']
+        writes += latencies['write']
+        errors += failed
+    for proc in procs:
+        proc.join()
+    stop.set()
+
+    print(f"{name:<8} writes {len(writes) / args.seconds:7.1f}/s  "
+          f"write p50 {percentile(writes, 0.5) * 1e3:7.1f} ms  p99 {percentile(writes, 0.99) * 1e3:7.1f} ms  "
+          f"read p50 {percentile(reads, 0.5) * 1e3:6.1f} ms  p99 {percentile(reads, 0.99) * 1e3:7.1f} ms  "
+          f"failed {errors}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--processes', type=int, default=4)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--users', type=int, default=200)
+    args = parser.parse_args()
+
+    print(f"{args.processes} processes x {args.threads} threads, {args.seconds:g}s per profile")
+    with tempfile.TemporaryDirectory() as tmp:
+        run_profile('default', tmp, False, args)
+        run_profile('tuned', tmp, True, args)
+
+
+if __name__ == '__main__':
+    main()
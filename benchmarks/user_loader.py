@@ -0,0 +1,78 @@
+"""
+Micro-benchmark for the login_manager user loader.
+
+Simulates a stream of authenticated requests spread over a set of users and
+compares the legacy loader (one ``User.query.get`` per request) with the
+per-worker ``UserCache``. Reports the time per request and the number of SQL
+statements each one issued, using a throwaway SQLite database.
+
+Usage:
+    python benchmarks/user_loader.py [--requests 20000] [--users 50]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from sqlalchemy import event
+
+from models import db, User
+from utils.user_cache import UserCache
+
+
+def legacy_load(user_id):
+    """The per-request lookup the cache replaced."""
+    return db.session.get(User, user_id)
+
+
+def run(name, load, user_ids, requests):
+    statements = 0
+
+    def count(*args):
+        nonlocal statements
+        statements += 1
+
+    event.listen(db.engine, 'before_cursor_execute', count)
+    start = time.perf_counter()
+    for i in range(requests):
+        load(user_ids[i % len(user_ids)])
+        # Each request gets a fresh session, as under Flask-SQLAlchemy
+        db.session.remove()
+    elapsed = time.perf_counter() - start
+    event.remove(db.engine, 'before_cursor_execute', count)
+    print(f"{name:<8} {requests:>7} requests  {elapsed:8.3f}s  "
+          f"{elapsed / requests * 1e6:8.1f} us/request  "
+          f"{statements / requests:6.3f} queries/request")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--requests', type=int, default=20000)
+    parser.add_argument('--users', type=int, default=50)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        app = Flask(__name__)
+        app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+        app.config['USER_CACHE_VERSION_FILE'] = os.path.join(tmp, 'user_cache.version')
+        db.init_app(app)
+        cache = UserCache(app)
+        with app.app_context():
+            db.create_all()
+            users = [User(email=f"user{i}@example.com", password_hash='x') for i in range(args.users)]
+            db.session.add_all(users)
+            db.session.commit()
+            user_ids = [user.id for user in users]
+
+            run('legacy', legacy_load, user_ids, args.requests)
+            run('cached', cache.get, user_ids, args.requests)
+            print(f"cache stats: {cache.stats()}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,147 @@
+"""
+Build the fingerprinted, precompressed static assets served by nginx.
+
+Downloads the pinned front-end libraries into static/vendor/ (checking each
+against its SRI hash), then writes every file under static/ to static/dist/
+with a content hash in its name, plus .gz (and .br, with the brotli package)
+copies of text assets, and static/dist/manifest.json for url_for('static').
+Run it on every deploy, before restarting the app.
+
+Usage:
+    python build_static.py [--no-vendor]
+"""
+
+import argparse
+import base64
+import gzip
+import hashlib
+import json
+import os
+import re
+import sys
+import urllib.request
+
+from utils.static_assets import DIST_DIR, MANIFEST, VENDOR
+
+try:
+    import brotli
+except ImportError:  # optional: nginx then serves the gzip copies only
+    brotli = None
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+COMPRESSIBLE = {'.css', '.js', '.svg', '.json', '.txt', '.map'}
+MIN_COMPRESS_SIZE = 256
+_CSS_URL = re.compile(r'url\(\s*([\'"]?)([^\'")]+)\1\s*\)')
+
+
+def sri_matches(data: bytes, integrity: str) -> bool:
+    algorithm, expected = integrity.split('-', 1)
+    return base64.b64encode(hashlib.new(algorithm, data).digest()).decode() == expected
+
+
+def vendor() -> None:
+    """Download the libraries that are missing or do not match their hash."""
+    os.makedirs(os.path.join(STATIC_DIR, 'vendor'), exist_ok=True)
+    for name, (url, integrity) in VENDOR.items():
+        path = os.path.join(STATIC_DIR, 'vendor', name)
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                if sri_matches(f.read(), integrity):
+                    continue
+        try:
+            with urllib.request.urlopen(url, timeout=30) as response:
+                data = response.read()
+        except OSError as e:
+            sys.exit(f"Could not download {url}: {e} (--no-vendor loads it from the CDN instead)")
+        if not sri_matches(data, integrity):
+            sys.exit(f"{url} does not match {integrity}; not vendoring it")
+        with open(path, 'wb') as f:
+            f.write(data)
+        print(f"vendored {name} ({len(data) // 1024} KB)")
+
+
+def sources():
+    """Paths under static/, relative and with forward slashes, outside dist/."""
+    for folder, dirs, files in os.walk(STATIC_DIR):
+        if folder == STATIC_DIR:
+            dirs[:] = [name for name in dirs if name != DIST_DIR]
+        for name in sorted(files):
+            yield os.path.relpath(os.path.join(folder, name), STATIC_DIR).replace(os.sep, '/')
+
+
+def rewrite_css(source: str, css: bytes, manifest) -> bytes:
+    """Point relative url() references at their fingerprinted files."""
+    base = os.path.dirname(source)
+
+    def replace(match):
+        target = match.group(2)
+        if re.match(r'^(?:[a-z]+:|/|#)', target):
+            return match.group(0)
+        resolved = os.path.normpath(os.path.join(base, target.split('?')[0])).replace(os.sep, '/')
+        if resolved not in manifest:
+            return match.group(0)
+        built = os.path.relpath(manifest[resolved], os.path.dirname(f'{DIST_DIR}/{source}'))
+        return f'url({built.replace(os.sep, "/")})'
+
+    return _CSS_URL.sub(replace, css.decode('utf-8')).encode('utf-8')
+
+
+def fingerprinted(source: str, data: bytes) -> str:
+    stem, ext = os.path.splitext(source)
+    return f'{DIST_DIR}/{stem}.{hashlib.sha256(data).hexdigest()[:10]}{ext}'
+
+
+def write(path: str, data: bytes) -> int:
+    """Write an asset and its compressed copies; returns the bytes written."""
+    full = os.path.join(STATIC_DIR, path)
+    os.makedirs(os.path.dirname(full), exist_ok=True)
+    with open(full, 'wb') as f:
+        f.write(data)
+    written = len(data)
+    if os.path.splitext(path)[1] not in COMPRESSIBLE or len(data) < MIN_COMPRESS_SIZE:
+        return written
+    # mtime=0 keeps rebuilds of unchanged files byte-identical
+    variants = [('.gz', gzip.compress(data, compresslevel=9, mtime=0))]
+    if brotli is not None:
+        variants.append(('.br', brotli.compress(data)))
+    for suffix, compressed in variants:
+        if len(compressed) < len(data):
+            with open(full + suffix, 'wb') as f:
+                f.write(compressed)
+            written += len(compressed)
+    return written
+
+
+def build() -> dict:
+    # Files of earlier builds are kept: workers not yet restarted still link to them
+    dist = os.path.join(STATIC_DIR, DIST_DIR)
+    manifest, total = {}, 0
+    # Non-CSS first, so stylesheets can reference the fingerprinted files
+    for source in sorted(sources(), key=lambda path: path.endswith('.css')):
+        with open(os.path.join(STATIC_DIR, source), 'rb') as f:
+            data = f.read()
+        if source.endswith('.css'):
+            data = rewrite_css(source, data, manifest)
+        manifest[source] = fingerprinted(source, data)
+        total += write(manifest[source], data)
+    os.makedirs(dist, exist_ok=True)
+    with open(os.path.join(dist, MANIFEST + '.tmp'), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(os.path.join(dist, MANIFEST + '.tmp'), os.path.join(dist, MANIFEST))
+    print(f"built {len(manifest)} assets ({total // 1024} KB with compressed copies) "
+          f"into static/{DIST_DIR}/")
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--no-vendor', action='store_true',
+                        help='skip downloading libraries; pages load missing ones from the CDN')
+    args = parser.parse_args()
+    if not args.no_vendor:
+        vendor()
+    build()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+"""
+Copy the SQLite database into PostgreSQL.
+
+Creates the tables on the PostgreSQL database named by ``DATABASE_URL``, then
+loads every table from the SQLite file with ``COPY`` in dependency order and
+moves the id sequences past the copied rows. The target tables must be empty.
+The SQLite file is only read.
+
+Afterwards run ``flask db stamp head`` against PostgreSQL so that later
+migrations start from the current schema.
+
+Usage:
+    DATABASE_URL=postgresql://... python copy_to_postgres.py [SQLITE_PATH]
+"""
+
+import argparse
+import os
+import sys
+
+from sqlalchemy import Integer, create_engine, func, inspect, select
+
+from app import app, db
+from utils.database import copy_rows_into, is_postgres, reset_sequence
+
+BATCH_SIZE = 10000
+
+
+def copy_database(sqlite_path):
+    source = create_engine(f'sqlite:///{sqlite_path}')
+    source_tables = set(inspect(source).get_table_names())
+    with app.app_context():
+        if not is_postgres(db.engine):
+            sys.exit("DATABASE_URL must point at PostgreSQL")
+        db.metadata.create_all(db.engine)
+
+        with source.connect() as src, db.engine.begin() as dst:
+            for table in db.metadata.sorted_tables:
+                if table.name not in source_tables:
+                    print(f"{table.name}: not in the SQLite database, skipped")
+                    continue
+                if dst.execute(select(func.count()).select_from(table)).scalar():
+                    sys.exit(f"{table.name} already has rows in PostgreSQL, aborting")
+
+                # Only columns that exist on both sides; the rest keep their defaults
+                existing = {column['name'] for column in inspect(source).get_columns(table.name)}
+                columns = [column for column in table.columns if column.name in existing]
+                result = src.execution_options(yield_per=BATCH_SIZE).execute(select(*columns))
+                count = copy_rows_into(dst, table, [column.name for column in columns], result,
+                                       batch_size=BATCH_SIZE)
+
+                for column in table.primary_key.columns:
+                    if isinstance(column.type, Integer) and column.autoincrement in (True, 'auto'):
+                        reset_sequence(dst, table, column.name)
+                print(f"{table.name}: {count} rows")
+
+    print("Done. Now run `flask db stamp head` with the same DATABASE_URL.")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('sqlite_path', nargs='?',
+                        default=os.path.join(app.instance_path, 'church.db'))
+    args = parser.parse_args()
+    copy_database(args.sqlite_path)
@@ -1,3 +1,5 @@
+import os
+
 bind = "0.0.0.0:8000"  # Listen on all network interfaces
 workers = 3  # Number of worker processes
 timeout = 120  # Timeout in seconds
@@ -5,3 +7,21 @@ accesslog = "access.log"
 errorlog = "error.log"
 capture_output = True
 enable_stdio_inheritance = True
+
+METRICS_DIR = os.getenv(
+    'METRICS_DIR',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance', 'metrics')
+)
+
+
+def on_starting(server):
+    """Start /metrics from zero; snapshots of a previous run are stale."""
+    import shutil
+    shutil.rmtree(METRICS_DIR, ignore_errors=True)
+    os.makedirs(METRICS_DIR, exist_ok=True)
+
+
+def child_exit(server, worker):
+    """Keep an exited worker's counters without keeping its snapshot file."""
+    from utils.metrics import retire_worker
+    retire_worker(METRICS_DIR, worker.pid)
@@ -0,0 +1,118 @@
+"""
+Import sessions saved by the old Flask-Session filesystem backend.
+
+Reads every session file under ``flask_session/`` (or the directory given on
+the command line), skips expired ones and writes the rest into the SQLite
+session store, so users stay logged in across the switch. Files are left in
+place unless ``--delete`` is given.
+
+Old sessions hold the bare user id in ``_user_id``; it is rewritten to the
+``"<id>:<password version>"`` form ``load_user`` expects (see
+``User.get_id``). Sessions of users that no longer exist are imported
+logged out.
+
+Usage:
+    python import_sessions.py [--delete] [SESSION_DIR]
+"""
+
+import argparse
+import os
+import pickle
+import re
+import struct
+import time
+
+from sqlalchemy import select
+
+from app import app
+from models import db, User
+
+BATCH_SIZE = 1000
+_FILE_NAME = re.compile(r'^[0-9a-f]{32}$')
+# Flask-Login's keys and the ones the login view adds
+LOGIN_KEYS = ('_user_id', '_fresh', '_id', '_remember', '_remember_seconds',
+              'user_id', 'email', 'is_admin', 'login_time')
+
+
+def read_session_file(path):
+    """Return ``(expiry, data)`` for a Flask-Session file, or ``None`` if unusable."""
+    try:
+        with open(path, 'rb') as f:
+            expiry = struct.unpack('I', f.read(4))[0]
+            data = pickle.load(f)
+    except (OSError, EOFError, struct.error, pickle.UnpicklingError, AttributeError, ImportError):
+        return None
+    return (expiry, data) if isinstance(data, dict) else None
+
+
+def upgrade_user_ids(sessions):
+    """
+    Rewrite bare ``_user_id`` values in ``sessions`` to ``User.get_id()``.
+
+    Sessions whose user is gone (or whose id is unreadable) lose their login
+    keys. Ids already in the new form are left alone. Needs an app context.
+    """
+    bare = {}
+    for data in sessions:
+        user_id = data.get('_user_id')
+        if user_id is not None and ':' not in str(user_id):
+            bare.setdefault(str(user_id), []).append(data)
+    if not bare:
+        return
+    ids = [int(user_id) for user_id in bare if user_id.isdigit()]
+    rows = db.session.execute(select(User.id, User.password_hash).where(User.id.in_(ids))).all()
+    new_ids = {str(row.id): f'{row.id}:{User.password_version_for(row.password_hash)}'
+               for row in rows}
+    for user_id, matching in bare.items():
+        for data in matching:
+            if user_id in new_ids:
+                data['_user_id'] = new_ids[user_id]
+            else:
+                for key in LOGIN_KEYS:
+                    data.pop(key, None)
+
+
+def import_sessions(session_dir, delete=False):
+    interface = app.session_interface
+    store = app.extensions['session_store'].store
+    lifetime = app.permanent_session_lifetime.total_seconds()
+    now = time.time()
+    imported = skipped = 0
+    batch, done = [], []
+
+    def flush():
+        with app.app_context():
+            upgrade_user_ids([data for _, data, _ in batch])
+        store.save_many([(key, interface.serializer.dumps(data), expiry)
+                         for key, data, expiry in batch])
+        if delete:
+            for path in done:
+                os.remove(path)
+        batch.clear()
+        done.clear()
+
+    for name in os.listdir(session_dir):
+        path = os.path.join(session_dir, name)
+        # File names are md5("session:<sid>"), the same key the store uses
+        record = read_session_file(path) if _FILE_NAME.match(name) else None
+        if record is None or (record[0] and record[0] <= now):
+            skipped += 1
+            continue
+        expiry, data = record
+        batch.append((bytes.fromhex(name), data, float(expiry) if expiry else now + lifetime))
+        done.append(path)
+        imported += 1
+        if len(batch) >= BATCH_SIZE:
+            flush()
+    flush()
+    return imported, skipped
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('session_dir', nargs='?',
+                        default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'flask_session'))
+    parser.add_argument('--delete', action='store_true', help='remove files once imported')
+    args = parser.parse_args()
+    imported, skipped = import_sessions(args.session_dir, args.delete)
+    print(f"Imported {imported} sessions, skipped {skipped} expired or unreadable files")
@@ -1,13 +1,17 @@
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from models import User, db
+from utils.database import database_url, engine_options
+from utils.search import ensure_search_index
+from utils.registration_stats import reconcile
 import os
 
 # Initialize Flask app
 app = Flask(__name__)
 
 # Configuration
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///church.db'
+app.config['SQLALCHEMY_DATABASE_URI'] = database_url()
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config['SQLALCHEMY_DATABASE_URI'])
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'default-secret-key')
 
@@ -19,6 +23,14 @@ def init_db():
         # Create all tables
         db.create_all()
         
+        # Create the full-text search index and its sync triggers
+        with db.engine.begin() as conn:
+            ensure_search_index(conn)
+        
+        # Count any registrations already in the database
+        with db.engine.begin() as conn:
+            reconcile(conn)
+        
         # Check if admin user exists
         admin = User.query.filter_by(email='admin@church.org').first()
         if not admin:
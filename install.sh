@@ -138,6 +138,9 @@ setup_venv() {
     pip install --upgrade pip
     pip install -r requirements.txt
     
+    # Vendored libraries and fingerprinted assets, served by nginx
+    python3 build_static.py
+    
     # Deactivate virtual environment
     deactivate
 }
@@ -188,7 +191,8 @@ setup_nginx() {
     
     # Copy project nginx configuration
     print_status "Installing nginx configuration..."
-    cp "$APP_DIR/nginx.conf" /etc/nginx/conf.d/church.conf
+    # (written for the Docker image, where the app lives in /app)
+    sed "s#/app/static/#$APP_DIR/static/#" "$APP_DIR/nginx.conf" > /etc/nginx/conf.d/church.conf
     
     # Create static directory if it doesn't exist
     mkdir -p "$APP_DIR/static"
@@ -236,6 +240,24 @@ EOL
     systemctl start church
 }
 
+# Rotate the application log; workers reopen it after it is moved
+setup_logrotate() {
+    print_status "Setting up log rotation..."
+    
+    cat > /etc/logrotate.d/church << EOL
+$APP_DIR/logs/*.log {
+    daily
+    rotate 14
+    maxsize 10M
+    compress
+    delaycompress
+    missingok
+    notifempty
+    create 0644 church_app church_app
+}
+EOL
+}
+
 # Main installation process
 main() {
     if [ "$EUID" -ne 0 ]; then
@@ -251,6 +273,7 @@ main() {
     init_database
     setup_nginx
     setup_service
+    setup_logrotate
     
     print_status "Installation completed successfully!"
     print_status "Please update the .env file with your email settings"
@@ -24,7 +24,7 @@ def upgrade():
                nullable=False,
                autoincrement=True)
         batch_op.alter_column('date_joined',
-               existing_type=sa.DATETIME(),
+               existing_type=sa.DateTime(),
                nullable=True,
                existing_server_default=sa.text('(CURRENT_TIMESTAMP)'))
         batch_op.create_unique_constraint('uq_user_reset_token', ['reset_token'])
@@ -39,7 +39,7 @@ def downgrade():
         batch_op.drop_constraint('uq_user_email', type_='unique')
         batch_op.drop_constraint('uq_user_reset_token', type_='unique')
         batch_op.alter_column('date_joined',
-               existing_type=sa.DATETIME(),
+               existing_type=sa.DateTime(),
                nullable=False,
                existing_server_default=sa.text('(CURRENT_TIMESTAMP)'))
         batch_op.alter_column('id',
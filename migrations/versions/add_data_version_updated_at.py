@@ -0,0 +1,27 @@
+"""add data version updated at
+
+Revision ID: add_data_version_updated_at
+Revises: add_form_data_version
+Create Date: 2026-10-17 21:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'add_data_version_updated_at'
+down_revision = 'add_form_data_version'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Left empty until each scope's next write; responses omit Last-Modified until then
+    with op.batch_alter_table('data_versions') as batch_op:
+        batch_op.add_column(sa.Column('updated_at', sa.DateTime(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('data_versions') as batch_op:
+        batch_op.drop_column('updated_at')
@@ -7,7 +7,6 @@ Create Date: 2024-01-08 10:00:00.000000
 """
 from alembic import op
 import sqlalchemy as sa
-from datetime import datetime
 
 
 # revision identifiers, used by Alembic.
@@ -18,55 +17,14 @@ depends_on = None
 
 
 def upgrade():
-    # Create a temporary table with the new schema
-    op.execute('''
-        CREATE TABLE user_new (
-            id INTEGER PRIMARY KEY,
-            email VARCHAR(120) NOT NULL UNIQUE,
-            password_hash VARCHAR(128),
-            is_admin BOOLEAN DEFAULT 0,
-            reset_token VARCHAR(100) UNIQUE,
-            reset_token_expiry DATETIME,
-            date_joined DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    # Copy data from the old table to the new table
-    op.execute('''
-        INSERT INTO user_new (id, email, password_hash, is_admin, reset_token, reset_token_expiry)
-        SELECT id, email, password_hash, is_admin, reset_token, reset_token_expiry
-        FROM user
-    ''')
-    
-    # Drop the old table
-    op.execute('DROP TABLE user')
-    
-    # Rename the new table to the original name
-    op.execute('ALTER TABLE user_new RENAME TO user')
+    # SQLite cannot ALTER TABLE ADD COLUMN with a non-constant default, so
+    # there batch mode copies the table; PostgreSQL adds the column in place
+    recreate = 'always' if op.get_bind().dialect.name == 'sqlite' else 'auto'
+    with op.batch_alter_table('user', recreate=recreate) as batch_op:
+        batch_op.add_column(sa.Column('date_joined', sa.DateTime(), nullable=False,
+                                      server_default=sa.func.current_timestamp()))
 
 
 def downgrade():
-    # Create a temporary table without the date_joined column
-    op.execute('''
-        CREATE TABLE user_new (
-            id INTEGER PRIMARY KEY,
-            email VARCHAR(120) NOT NULL UNIQUE,
-            password_hash VARCHAR(128),
-            is_admin BOOLEAN DEFAULT 0,
-            reset_token VARCHAR(100) UNIQUE,
-            reset_token_expiry DATETIME
-        )
-    ''')
-    
-    # Copy data from the current table to the new table
-    op.execute('''
-        INSERT INTO user_new (id, email, password_hash, is_admin, reset_token, reset_token_expiry)
-        SELECT id, email, password_hash, is_admin, reset_token, reset_token_expiry
-        FROM user
-    ''')
-    
-    # Drop the current table
-    op.execute('DROP TABLE user')
-    
-    # Rename the new table to the original name
-    op.execute('ALTER TABLE user_new RENAME TO user')
+    with op.batch_alter_table('user') as batch_op:
+        batch_op.drop_column('date_joined')
@@ -0,0 +1,27 @@
+"""add export job heartbeat
+
+Revision ID: add_export_job_heartbeat
+Revises: add_data_version_updated_at
+Create Date: 2026-10-18 09:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'add_export_job_heartbeat'
+down_revision = 'add_data_version_updated_at'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Jobs left queued or running by the old code have none and count as stale
+    with op.batch_alter_table('export_jobs') as batch_op:
+        batch_op.add_column(sa.Column('heartbeat_at', sa.DateTime(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('export_jobs') as batch_op:
+        batch_op.drop_column('heartbeat_at')
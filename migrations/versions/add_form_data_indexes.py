@@ -0,0 +1,40 @@
+"""add form data indexes
+
+Revision ID: add_form_data_indexes
+Revises: add_announcements
+Create Date: 2026-10-17 14:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'add_form_data_indexes'
+down_revision = 'add_announcements'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # A parent's registrations, newest first (dashboard, admin user forms)
+    op.create_index('ix_form_data_user_id_date_submitted', 'form_data',
+                    ['user_id', 'date_submitted'], unique=False)
+    # The admin list, exports and date-range filters, in date order
+    op.create_index('ix_form_data_date_submitted', 'form_data', ['date_submitted'], unique=False)
+    # Event and payment filters, and the list of event names
+    op.create_index('ix_form_data_event_name_payment_status', 'form_data',
+                    ['event_name', 'payment_status'], unique=False)
+    op.create_index('ix_form_data_student_name', 'form_data', ['student_name'], unique=False)
+    op.create_index('ix_form_data_status', 'form_data', ['status'], unique=False)
+    if op.get_bind().dialect.name == 'sqlite':
+        # Give the planner row counts for the new indexes
+        op.execute('ANALYZE form_data')
+
+
+def downgrade():
+    op.drop_index('ix_form_data_status', table_name='form_data')
+    op.drop_index('ix_form_data_student_name', table_name='form_data')
+    op.drop_index('ix_form_data_event_name_payment_status', table_name='form_data')
+    op.drop_index('ix_form_data_date_submitted', table_name='form_data')
+    op.drop_index('ix_form_data_user_id_date_submitted', table_name='form_data')
@@ -0,0 +1,27 @@
+"""add form data version
+
+Revision ID: add_form_data_version
+Revises: add_registration_stats
+Create Date: 2026-10-17 18:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'add_form_data_version'
+down_revision = 'add_registration_stats'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Existing rows start at version 1, like new ones
+    with op.batch_alter_table('form_data') as batch_op:
+        batch_op.add_column(sa.Column('version', sa.Integer(), nullable=False, server_default='1'))
+
+
+def downgrade():
+    with op.batch_alter_table('form_data') as batch_op:
+        batch_op.drop_column('version')
@@ -0,0 +1,33 @@
+"""add FTS5 registration search index
+
+Revision ID: add_registration_search
+Revises: rate_limit_unique_key
+Create Date: 2026-10-17 10:00:00.000000
+
+"""
+from alembic import op
+
+from utils.search import rebuild_search_index, DROP_SCHEMA
+
+
+# revision identifiers, used by Alembic.
+revision = 'add_registration_search'
+down_revision = 'rate_limit_unique_key'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # FTS5 is SQLite-only; other backends fall back to LIKE filtering
+    bind = op.get_bind()
+    if bind.dialect.name != 'sqlite':
+        return
+    rebuild_search_index(bind)
+
+
+def downgrade():
+    bind = op.get_bind()
+    if bind.dialect.name != 'sqlite':
+        return
+    for statement in DROP_SCHEMA:
+        op.execute(statement)
@@ -0,0 +1,41 @@
+"""add registration stats
+
+Revision ID: add_registration_stats
+Revises: move_signatures_to_blobs
+Create Date: 2026-10-17 17:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from utils.registration_stats import reconcile
+
+
+# revision identifiers, used by Alembic.
+revision = 'add_registration_stats'
+down_revision = 'move_signatures_to_blobs'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('registration_stats',
+        sa.Column('event_name', sa.String(length=100), nullable=False),
+        sa.Column('registrations', sa.Integer(), nullable=False),
+        sa.Column('paid', sa.Integer(), nullable=False),
+        sa.Column('status_pending', sa.Integer(), nullable=False),
+        sa.Column('status_approved', sa.Integer(), nullable=False),
+        sa.Column('status_rejected', sa.Integer(), nullable=False),
+        sa.Column('current_treatment', sa.Integer(), nullable=False),
+        sa.Column('physical_restrictions', sa.Integer(), nullable=False),
+        sa.Column('medical_flagged', sa.Integer(), nullable=False),
+        sa.Column('collected_cents', sa.BigInteger(), nullable=False),
+        sa.Column('outstanding_cents', sa.BigInteger(), nullable=False),
+        sa.PrimaryKeyConstraint('event_name')
+    )
+    # Fill the totals from the existing registrations
+    reconcile(op.get_bind())
+
+
+def downgrade():
+    op.drop_table('registration_stats')
@@ -0,0 +1,69 @@
+"""move signatures to the blob store
+
+Revision ID: move_signatures_to_blobs
+Revises: add_form_data_indexes
+Create Date: 2026-10-17 15:00:00.000000
+
+"""
+import logging
+
+from alembic import op
+import sqlalchemy as sa
+from flask import current_app
+
+from utils.blob_store import InvalidBlob, is_data_url, is_ref
+
+
+# revision identifiers, used by Alembic.
+revision = 'move_signatures_to_blobs'
+down_revision = 'add_form_data_indexes'
+branch_labels = None
+depends_on = None
+
+logger = logging.getLogger('alembic.runtime.migration')
+
+BATCH_SIZE = 500
+
+form_data = sa.table('form_data',
+    sa.column('id', sa.Integer),
+    sa.column('liability_signature', sa.Text),
+    sa.column('photo_signature', sa.Text),
+)
+SIGNATURES = ('liability_signature', 'photo_signature')
+
+
+def _rewrite(pattern, convert):
+    """Rewrite signature values matching ``pattern`` in id order, one batch at a time."""
+    bind = op.get_bind()
+    matches = sa.or_(*(form_data.c[name].like(pattern) for name in SIGNATURES))
+    last_id = 0
+    while True:
+        rows = bind.execute(
+            sa.select(form_data.c.id, *(form_data.c[name] for name in SIGNATURES))
+            .where(form_data.c.id > last_id, matches)
+            .order_by(form_data.c.id).limit(BATCH_SIZE)).all()
+        if not rows:
+            break
+        for row in rows:
+            values = {}
+            for name in SIGNATURES:
+                try:
+                    value = convert(getattr(row, name))
+                except (InvalidBlob, FileNotFoundError) as e:
+                    logger.warning("form_data %s: %s left unchanged (%s)", row.id, name, e)
+                    continue
+                if value != getattr(row, name):
+                    values[name] = value
+            if values:
+                bind.execute(form_data.update().where(form_data.c.id == row.id).values(**values))
+        last_id = rows[-1].id
+
+
+def upgrade():
+    store = current_app.extensions['blob_store']
+    _rewrite('data:%', lambda value: store.put_data_url(value) if is_data_url(value) else value)
+
+
+def downgrade():
+    store = current_app.extensions['blob_store']
+    _rewrite('%.%', lambda value: store.data_url(value) if is_ref(value) else value)
@@ -0,0 +1,33 @@
+"""make rate limit keys unique for atomic upserts
+
+Revision ID: rate_limit_unique_key
+Revises: add_rate_limit_table
+Create Date: 2026-10-17 09:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'rate_limit_unique_key'
+down_revision = 'add_rate_limit_table'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Keep only the newest row per key so the unique index can be created
+    op.execute('''
+        DELETE FROM rate_limits
+        WHERE id NOT IN (SELECT MAX(id) FROM rate_limits GROUP BY key)
+    ''')
+    op.drop_index('ix_rate_limits_key', table_name='rate_limits')
+    op.create_index('ix_rate_limits_key', 'rate_limits', ['key'], unique=True)
+    op.create_index('ix_rate_limits_reset_time', 'rate_limits', ['reset_time'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_rate_limits_reset_time', table_name='rate_limits')
+    op.drop_index('ix_rate_limits_key', table_name='rate_limits')
+    op.create_index('ix_rate_limits_key', 'rate_limits', ['key'], unique=False)
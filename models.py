@@ -2,6 +2,9 @@ from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime, timedelta
+import hashlib
+import hmac
+import secrets
 
 db = SQLAlchemy()
 
@@ -21,7 +24,45 @@ class User(UserMixin, db.Model):
     def check_password(self, password):
         return check_password_hash(self.password_hash, password)
 
+    @staticmethod
+    def password_version_for(password_hash):
+        """Short fingerprint of a password hash; changes whenever the password does."""
+        return hashlib.sha256((password_hash or '').encode('utf-8')).hexdigest()[:16]
+
+    @property
+    def password_version(self):
+        return self.password_version_for(self.password_hash)
+
+    def get_id(self):
+        """Id stored in the session and remember cookie; stops matching once the password changes."""
+        return f'{self.id}:{self.password_version}'
+
+    def generate_reset_token(self, expires_in=timedelta(hours=1)):
+        self.reset_token = secrets.token_urlsafe(32)
+        self.reset_token_expiry = datetime.utcnow() + expires_in
+        return self.reset_token
+
+    def is_reset_token_valid(self, token):
+        return (self.reset_token is not None and
+                hmac.compare_digest(self.reset_token, token) and
+                self.reset_token_expiry is not None and
+                self.reset_token_expiry > datetime.utcnow())
+
+    def clear_reset_token(self):
+        self.reset_token = None
+        self.reset_token_expiry = None
+
 class FormData(db.Model):
+    # Matched to the access paths of the views; checked by tests/test_query_plans.py.
+    # Descending sorts walk these backwards, so no DESC columns are needed.
+    __table_args__ = (
+        db.Index('ix_form_data_user_id_date_submitted', 'user_id', 'date_submitted'),
+        db.Index('ix_form_data_date_submitted', 'date_submitted'),
+        db.Index('ix_form_data_event_name_payment_status', 'event_name', 'payment_status'),
+        db.Index('ix_form_data_student_name', 'student_name'),
+        db.Index('ix_form_data_status', 'status'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     
@@ -41,9 +82,9 @@ class FormData(db.Model):
     
     # Medical Information
     current_treatment = db.Column(db.Boolean, default=False)
-    treatment_details = db.Column(db.Text)
+    treatment_details = db.deferred(db.Column(db.Text), group='medical')
     physical_restrictions = db.Column(db.Boolean, default=False)
-    restriction_details = db.Column(db.Text)
+    restriction_details = db.deferred(db.Column(db.Text), group='medical')
     family_doctor = db.Column(db.String(100))
     doctor_phone = db.Column(db.String(20))
     insurance_company = db.Column(db.String(100))
@@ -58,41 +99,151 @@ class FormData(db.Model):
     payment_status = db.Column(db.Boolean, default=False)
     
     # Signatures
-    liability_signature = db.Column(db.Text)
-    photo_signature = db.Column(db.Text)
+    liability_signature = db.deferred(db.Column(db.Text), group='signatures')
+    photo_signature = db.deferred(db.Column(db.Text), group='signatures')
     
     # Submission Information
     date_submitted = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     form_type = db.Column(db.String(50), default='winter_camp')
     status = db.Column(db.String(20), default='pending')  # pending, approved, rejected
+    # Bumped by every update, for optimistic concurrency (see utils.registration_updates)
+    version = db.Column(db.Integer, nullable=False, default=1)
+
+    __mapper_args__ = {'version_id_col': version}
+
+    # Columns loaded by the list profile (see FormData.profile) and selected
+    # by the export's core query (utils/export.py). The large Text columns are
+    # deferred by default and only loaded by the profiles that display them.
+    LIST_COLUMNS = (
+        'user_id', 'date_submitted', 'student_name', 'parent_guardian', 'parent_cell_phone',
+        'event_name', 'payment_status', 'form_type', 'status', 'version',
+    )
+    EXPORT_COLUMNS = (
+        'date_submitted', 'student_name', 'date_of_birth', 'street', 'city', 'zip_code',
+        'parent_guardian', 'parent_cell_phone', 'home_phone', 'emergency_contact',
+        'emergency_phone', 'current_treatment', 'treatment_details', 'family_doctor',
+        'doctor_phone', 'insurance_company', 'policy_number', 'payment_status',
+    )
+
+    @classmethod
+    def profile(cls, name, with_user=False):
+        """
+        Return loader options for a named loading profile.
+
+        Profiles:
+            list: Only the columns shown in tables
+            dashboard: Every column and the medical text, but not the signatures
+            detail: Every column, including the deferred medical and signature text
+
+        Args:
+            name: Profile name
+            with_user: Eager-load the owner's email in the same query
+
+        Returns:
+            list: Options to pass to ``Query.options()``
+        """
+        if name == 'list':
+            options = [db.load_only(*(getattr(cls, col) for col in cls.LIST_COLUMNS))]
+        elif name == 'dashboard':
+            options = [db.undefer_group('medical')]
+        elif name == 'detail':
+            options = [db.undefer_group('medical'), db.undefer_group('signatures')]
+        else:
+            raise ValueError(f"Unknown FormData loading profile: {name}")
+        if with_user:
+            options.append(db.joinedload(cls.user).load_only(User.email))
+        return options
 
 class RateLimit(db.Model):
+    """Fixed-window counter row used by the SQL rate limiter backend."""
     __tablename__ = 'rate_limits'
     
     id = db.Column(db.Integer, primary_key=True)
-    key = db.Column(db.String(255), nullable=False, index=True)
+    key = db.Column(db.String(255), nullable=False, unique=True, index=True)
     hits = db.Column(db.Integer, default=0)
-    reset_time = db.Column(db.DateTime, nullable=False)
+    reset_time = db.Column(db.DateTime, nullable=False, index=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    
-    @classmethod
-    def get_rate_limit(cls, key):
-        limit = cls.query.filter_by(key=key).first()
-        now = datetime.utcnow()
-        if limit and limit.reset_time <= now:
-            limit.hits = 0
-            limit.reset_time = now + timedelta(hours=1)
-            db.session.commit()
-        return limit
-    
-    @classmethod
-    def increment(cls, key, reset_after=timedelta(hours=1)):
-        now = datetime.utcnow()
-        limit = cls.get_rate_limit(key)
-        if not limit:
-            limit = cls(key=key, hits=1, reset_time=now + reset_after)
-            db.session.add(limit)
-        else:
-            limit.hits += 1
-        db.session.commit()
-        return limit.hits
+
+class DataVersion(db.Model):
+    """Monotonic change counter per data scope (see utils.versioning)."""
+    __tablename__ = 'data_versions'
+
+    scope = db.Column(db.String(50), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime)  # time of the last bump, for Last-Modified
+
+class RegistrationStats(db.Model):
+    """Running registration totals of one event (see utils.registration_stats)."""
+    __tablename__ = 'registration_stats'
+
+    event_name = db.Column(db.String(100), primary_key=True)  # '' for registrations without one
+    registrations = db.Column(db.Integer, nullable=False, default=0)
+    paid = db.Column(db.Integer, nullable=False, default=0)
+    status_pending = db.Column(db.Integer, nullable=False, default=0)
+    status_approved = db.Column(db.Integer, nullable=False, default=0)
+    status_rejected = db.Column(db.Integer, nullable=False, default=0)
+    current_treatment = db.Column(db.Integer, nullable=False, default=0)
+    physical_restrictions = db.Column(db.Integer, nullable=False, default=0)
+    medical_flagged = db.Column(db.Integer, nullable=False, default=0)  # either medical flag
+    collected_cents = db.Column(db.BigInteger, nullable=False, default=0)
+    outstanding_cents = db.Column(db.BigInteger, nullable=False, default=0)
+
+class ExportJob(db.Model):
+    """A background export run and, once finished, its cached output file."""
+    __tablename__ = 'export_jobs'
+
+    id = db.Column(db.String(32), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='SET NULL'))
+    status = db.Column(db.String(20), nullable=False, default='queued')  # queued, running, done, failed
+    format = db.Column(db.String(10), nullable=False, default='csv')
+    filters = db.Column(db.Text, nullable=False, default='{}')
+    cache_key = db.Column(db.String(64), nullable=False, index=True)
+    rows_processed = db.Column(db.Integer, nullable=False, default=0)
+    total_rows = db.Column(db.Integer)
+    file_path = db.Column(db.String(255))
+    error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime)
+    # Refreshed with progress; a stale one means the worker running it died
+    heartbeat_at = db.Column(db.DateTime)
+
+class OutboxMessage(db.Model):
+    """An email waiting to be (or already) sent by the outbox dispatcher."""
+    __tablename__ = 'email_outbox'
+    __table_args__ = (
+        db.Index('ix_email_outbox_status_next_attempt', 'status', 'next_attempt_at'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    subject = db.Column(db.String(255), nullable=False)
+    recipients = db.Column(db.Text, nullable=False)  # comma-separated
+    sender = db.Column(db.String(255))
+    html = db.Column(db.Text)
+    body = db.Column(db.Text)
+    status = db.Column(db.String(20), nullable=False, default='pending')  # pending, sending, sent, failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    claimed_at = db.Column(db.DateTime)
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime)
+
+class Announcement(db.Model):
+    """A bulk email to the families registered for an event (see utils.announcements)."""
+    __tablename__ = 'announcements'
+
+    id = db.Column(db.Integer, primary_key=True)
+    subject = db.Column(db.String(255), nullable=False)
+    body = db.Column(db.Text, nullable=False)  # Jinja template source
+    event_name = db.Column(db.String(100))  # recipient filter, None for all events
+    form_status = db.Column(db.String(20))  # recipient filter, None for any status
+    status = db.Column(db.String(20), nullable=False, default='queued')  # queued, sending, paused, done, failed
+    total_recipients = db.Column(db.Integer, nullable=False, default=0)
+    sent_count = db.Column(db.Integer, nullable=False, default=0)
+    failed_count = db.Column(db.Integer, nullable=False, default=0)
+    last_user_id = db.Column(db.Integer, nullable=False, default=0)  # resume checkpoint
+    heartbeat_at = db.Column(db.DateTime)
+    last_error = db.Column(db.Text)
+    created_by = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='SET NULL'))
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime)
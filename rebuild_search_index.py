@@ -0,0 +1,14 @@
+from app import app, db
+from utils.search import is_supported, rebuild_search_index
+
+def rebuild():
+    with app.app_context():
+        if not is_supported(db.engine):
+            print("Full-text search index requires SQLite, nothing to do")
+            return
+        with db.engine.begin() as conn:
+            count = rebuild_search_index(conn)
+        print(f"Indexed {count} registrations")
+
+if __name__ == '__main__':
+    rebuild()
@@ -0,0 +1,33 @@
+"""
+Rebuild the registration statistics from scratch and report drift.
+
+The totals in ``registration_stats`` are kept up to date as registrations
+change; this recomputes them from ``form_data`` and replaces them, printing
+every counter that was wrong. Safe to run while the app is serving, e.g.
+nightly from cron. Exits with status 1 if anything had drifted.
+
+Usage:
+    python reconcile_stats.py
+"""
+
+import argparse
+import sys
+
+from app import app, db
+from utils.registration_stats import reconcile
+
+
+def main():
+    argparse.ArgumentParser(description=__doc__.splitlines()[1]).parse_args()
+    with app.app_context():
+        with db.engine.begin() as conn:
+            drift = reconcile(conn)
+    for item in drift:
+        print(f"{item['event_name'] or '(no event)'}: {item['counter']} was {item['stored']}, "
+              f"actually {item['actual']}")
+    print(f"Fixed {len(drift)} drifted counters" if drift else "Statistics were up to date")
+    sys.exit(1 if drift else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,9 +1,27 @@
-from flask import Blueprint, render_template, jsonify, request, abort, send_file
+from flask import (
+    Blueprint, Response, current_app, render_template, jsonify, request, abort, make_response,
+    send_file, stream_with_context, url_for
+)
 from flask_login import login_required, current_user
 from functools import wraps
-from models import db, User, FormData
-import csv
-from io import StringIO
+from models import db, User, FormData, ExportJob, Announcement
+from utils.registration_query import (
+    DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, InvalidCursor, fetch_page, parse_filters,
+    serialize_detail, serialize_row
+)
+from utils.database import is_postgres
+from utils.export import FORMATS as EXPORT_FORMATS, generate_export, iter_copy_export, iter_export_rows
+from utils.announcements import count_recipients
+from utils.registration_stats import summary as stats_summary
+from utils.registration_updates import BatchConflict, InvalidBatch, apply_batch, parse_batch
+from utils.export_jobs import serialize_job
+from jinja2 import TemplateSyntaxError
+from utils.search import is_supported as search_supported, search_ids
+from utils.query_profiler import query_budget
+from utils.versioning import REGISTRATIONS, USERS, user_forms as forms_scope
+from utils.conditional import conditional
+from markupsafe import Markup
+import os
 from datetime import datetime
 
 admin_bp = Blueprint('admin', __name__)
@@ -20,67 +38,357 @@ def admin_required(f):
 @login_required
 @admin_required
 def export_data():
-    # Create a string buffer to write CSV data
-    si = StringIO()
-    writer = csv.writer(si)
-    
-    # Write headers
-    writer.writerow([
-        'Date Submitted', 'Student Name', 'Date of Birth', 'Address',
-        'Parent/Guardian', 'Parent Cell', 'Home Phone', 'Emergency Contact',
-        'Emergency Phone', 'Medical Info', 'Doctor Info', 'Insurance',
-        'Payment Status'
-    ])
-    
-    # Get all form submissions
-    forms = FormData.query.all()
-    
-    # Write data rows
-    for form in forms:
-        writer.writerow([
-            form.date_submitted.strftime('%Y-%m-%d'),
-            form.student_name,
-            form.date_of_birth,
-            f"{form.street}, {form.city}, {form.zip_code}",
-            form.parent_guardian,
-            form.parent_cell_phone,
-            form.home_phone,
-            form.emergency_contact,
-            form.emergency_phone,
-            f"Treatment: {'Yes' if form.current_treatment else 'No'}, Details: {form.treatment_details or 'N/A'}",
-            f"Doctor: {form.family_doctor}, Phone: {form.doctor_phone}",
-            f"Company: {form.insurance_company}, Policy: {form.policy_number}",
-            'Paid' if form.payment_status else 'Pending'
-        ])
-    
-    # Create the response
-    output = si.getvalue()
-    si.close()
-    
+    """
+    Stream registrations as CSV (default) or NDJSON (``format=ndjson``).
+
+    Accepts the same filters as the dashboard, including ``event``,
+    ``payment`` and the ``date_from``/``date_to`` range (YYYY-MM-DD).
+    """
+    fmt = request.args.get('format', 'csv')
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({'success': False, 'message': 'Unsupported export format'}), 400
+    filters = parse_filters(request.args)
+
     # Generate filename with current date
-    filename = f"registrations_{datetime.now().strftime('%Y%m%d')}.csv"
-    
-    # Create response with CSV data
-    return send_file(
-        StringIO(output),
-        mimetype='text/csv',
-        as_attachment=True,
-        download_name=filename
-    )
+    filename = f"registrations_{datetime.now().strftime('%Y%m%d')}.{fmt}"
+
+    if fmt == 'csv' and is_postgres(db.engine):
+        chunks = iter_copy_export(filters)
+    else:
+        chunks = generate_export(iter_export_rows(filters), fmt)
+    response = Response(stream_with_context(chunks), mimetype=EXPORT_FORMATS[fmt])
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    response.headers['Cache-Control'] = 'no-store'
+    # Ask nginx not to buffer the whole response before sending it on
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+@admin_bp.route('/admin/export/jobs', methods=['POST'])
+@login_required
+@admin_required
+def start_export_job():
+    """
+    Start a background export and return its job id.
+
+    Takes the same ``format`` and filter parameters as ``export_data``, either
+    as a JSON body or as query/form values. An unchanged export that was built
+    before comes back already ``done``.
+    """
+    params = request.get_json(silent=True) or request.values
+    fmt = params.get('format', 'csv')
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({'success': False, 'message': 'Unsupported export format'}), 400
+
+    runner = current_app.extensions['export_jobs']
+    job = runner.start(parse_filters(params), fmt, user_id=current_user.id)
+    payload = serialize_job(job)
+    payload['status_url'] = url_for('admin.export_job_status', job_id=job.id)
+    payload['download_url'] = url_for('admin.download_export_job', job_id=job.id)
+    return jsonify(payload), 200 if job.status == 'done' else 202
+
+@admin_bp.route('/admin/export/jobs/<job_id>')
+@login_required
+@admin_required
+def export_job_status(job_id):
+    job = ExportJob.query.get_or_404(job_id)
+    payload = serialize_job(job)
+    payload['download_url'] = url_for('admin.download_export_job', job_id=job.id)
+    return jsonify(payload)
+
+@admin_bp.route('/admin/export/jobs/<job_id>/download')
+@login_required
+@admin_required
+def download_export_job(job_id):
+    job = ExportJob.query.get_or_404(job_id)
+    if job.status != 'done':
+        return jsonify({'success': False, 'message': f'Export is {job.status}'}), 409
+    if not job.file_path or not os.path.exists(job.file_path):
+        # Evicted from the cache; the client should start a new job
+        return jsonify({'success': False, 'message': 'Export has expired'}), 410
+
+    filename = f"registrations_{job.created_at.strftime('%Y%m%d')}.{job.format}"
+    return send_file(job.file_path, mimetype=EXPORT_FORMATS[job.format],
+                     as_attachment=True, download_name=filename)
 
 @admin_bp.route('/admin/dashboard')
 @login_required
 @admin_required
+@query_budget(5)
+@conditional(REGISTRATIONS)
 def dashboard():
-    registrations = FormData.query.all()
-    return render_template('admin/dashboard.html', registrations=registrations)
+    filters = parse_filters(request.args)
+    fragments = current_app.extensions['fragment_cache']
+
+    def build_stats():
+        stats = stats_summary(db.session)
+        events = [row['event_name'] for row in stats['events'] if row['event_name']]
+        return Markup(render_template('admin/stats_panel_partial.html', stats=stats)), events
+
+    def build_rows():
+        registrations, next_cursor = fetch_page(filters)
+        html = render_template('admin/registration_rows_partial.html', registrations=registrations)
+        return Markup(html), next_cursor
+
+    stats_panel, events = fragments.get_or_build('admin_stats', [REGISTRATIONS], None, build_stats)
+    registration_rows, next_cursor = fragments.get_or_build(
+        'admin_rows', [REGISTRATIONS], tuple(sorted(filters.items())), build_rows)
+    return render_template('admin/dashboard.html', stats_panel=stats_panel,
+                           registration_rows=registration_rows, filters=filters,
+                           next_cursor=next_cursor, events=events)
+
+@admin_bp.route('/admin/api/stats')
+@login_required
+@admin_required
+@query_budget(3)
+@conditional(REGISTRATIONS)
+def registration_stats():
+    """
+    Registration counts, payments, revenue and medical flags per event and in total.
+
+    Served from the incrementally maintained totals, so the cost does not grow
+    with the number of registrations. Amounts are in cents.
+    """
+    return jsonify(stats_summary(db.session))
+
+@admin_bp.route('/admin/api/registrations')
+@login_required
+@admin_required
+@query_budget(4)
+@conditional(REGISTRATIONS)
+def registrations_api():
+    """
+    Return one page of registrations filtered and sorted in SQL.
+
+    Query parameters:
+        student, parent, email, phone, payment, event, sort: Filters
+        cursor: Cursor returned as ``next_cursor`` by the previous page
+        limit: Page size (capped server-side)
+        render: ``rows`` to also return the rendered table rows as ``html``
+    """
+    filters = parse_filters(request.args)
+    try:
+        limit = int(request.args.get('limit', DEFAULT_PAGE_SIZE))
+        registrations, next_cursor = fetch_page(filters, request.args.get('cursor'), limit)
+    except (ValueError, InvalidCursor):
+        return jsonify({'success': False, 'message': 'Invalid cursor or limit'}), 400
+
+    payload = {
+        'items': [serialize_row(reg) for reg in registrations],
+        'next_cursor': next_cursor,
+    }
+    if request.args.get('render') == 'rows':
+        payload['html'] = render_template('admin/registration_rows_partial.html',
+                                          registrations=registrations)
+    return jsonify(payload)
+
+@admin_bp.route('/admin/api/registrations/batch', methods=['POST'])
+@login_required
+@admin_required
+@query_budget(8)
+def update_registrations():
+    """
+    Set the payment status and/or review status of many registrations at once.
+
+    Takes a JSON list (or ``{"updates": [...]}``) of
+    ``{id, payment_status?, status?, expected_version}`` and applies it in one
+    transaction with a single UPDATE. A row whose version is no longer
+    ``expected_version`` is left alone and reported as a ``conflict``.
+    Returns a result per entry, in order, with each row's new version.
+    """
+    try:
+        parsed = parse_batch(request.get_json(silent=True))
+    except InvalidBatch as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    try:
+        results = apply_batch(parsed)
+    except BatchConflict as e:
+        return jsonify({'success': False, 'message': str(e)}), 409
+    return jsonify({'success': True, 'results': results,
+                    'updated': sum(result['result'] == 'updated' for result in results)})
+
+@admin_bp.route('/admin/registration/<int:form_id>')
+@login_required
+@admin_required
+@query_budget(3)
+@conditional(REGISTRATIONS)
+def registration_detail(form_id):
+    """
+    Return the full details of one registration for the dashboard modal.
+
+    Responds with an HTML fragment by default, or JSON when the client asks for
+    ``application/json`` (or passes ``format=json``). Repeated opens revalidate
+    with a 304 until a registration changes.
+    """
+    registration = FormData.query.options(*FormData.profile('detail', with_user=True)).get_or_404(form_id)
+
+    wants_json = (request.args.get('format') == 'json' or
+                  request.accept_mimetypes.best_match(['text/html', 'application/json']) == 'application/json')
+    if wants_json:
+        response = jsonify(serialize_detail(registration))
+    else:
+        response = make_response(render_template('admin/registration_detail_partial.html',
+                                                 registration=registration))
+    response.vary.add('Accept')
+    return response
+
+@admin_bp.route('/admin/api/registrations/search')
+@login_required
+@admin_required
+@conditional(REGISTRATIONS)
+def search_registrations():
+    """
+    Ranked full-text search over student, parent, emergency contact, email and phone.
+
+    Every word in ``q`` is matched as a prefix, best matches first.
+    """
+    query = request.args.get('q', '')
+    try:
+        limit = max(1, min(int(request.args.get('limit', DEFAULT_PAGE_SIZE)), MAX_PAGE_SIZE))
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Invalid limit'}), 400
+    if not search_supported(db.engine):
+        return jsonify({'success': False, 'message': 'Full-text search requires SQLite'}), 501
+
+    hits = search_ids(db.session, query, limit)
+    forms = {}
+    if hits:
+        forms = {form.id: form for form in FormData.query
+                 .options(*FormData.profile('list', with_user=True))
+                 .filter(FormData.id.in_([form_id for form_id, _ in hits]))}
+    return jsonify({
+        'items': [dict(serialize_row(forms[form_id]), rank=rank)
+                  for form_id, rank in hits if form_id in forms],
+    })
+
+def serialize_announcement(announcement):
+    return {
+        'id': announcement.id,
+        'subject': announcement.subject,
+        'event_name': announcement.event_name,
+        'form_status': announcement.form_status,
+        'status': announcement.status,
+        'total_recipients': announcement.total_recipients,
+        'sent_count': announcement.sent_count,
+        'failed_count': announcement.failed_count,
+        'last_error': announcement.last_error,
+        'created_at': announcement.created_at.isoformat(),
+        'finished_at': announcement.finished_at.isoformat() if announcement.finished_at else None,
+    }
+
+@admin_bp.route('/admin/announcements')
+@login_required
+@admin_required
+def announcements():
+    events = [name for (name,) in db.session.query(FormData.event_name)
+              .filter(FormData.event_name.isnot(None))
+              .distinct().order_by(FormData.event_name)]
+    history = Announcement.query.order_by(Announcement.created_at.desc()).limit(50).all()
+    return render_template('admin/announcements.html', events=events, announcements=history)
+
+@admin_bp.route('/admin/announcements/recipients')
+@login_required
+@admin_required
+def announcement_recipients():
+    """Preview how many families an event/status filter would reach."""
+    count = count_recipients(request.args.get('event') or None, request.args.get('status') or None)
+    return jsonify({'count': count})
+
+@admin_bp.route('/admin/announcements', methods=['POST'])
+@login_required
+@admin_required
+def create_announcement():
+    """
+    Create an announcement and start sending it in the background.
+
+    The body is a Jinja template; ``students``, ``student_names``, ``email``
+    and ``event_name`` are available for each family.
+    """
+    data = request.get_json(silent=True) or request.form
+    subject = (data.get('subject') or '').strip()
+    body = data.get('body') or ''
+    if not subject or not body.strip():
+        return jsonify({'success': False, 'message': 'Subject and message are required'}), 400
+
+    announcer = current_app.extensions['announcer']
+    try:
+        announcer.validate(body)
+    except TemplateSyntaxError as e:
+        return jsonify({'success': False, 'message': f'Template error: {e}'}), 400
+
+    event_name = data.get('event') or None
+    form_status = data.get('status') or None
+    announcement = Announcement(
+        subject=subject, body=body, event_name=event_name, form_status=form_status,
+        total_recipients=count_recipients(event_name, form_status),
+        created_by=current_user.id
+    )
+    db.session.add(announcement)
+    db.session.commit()
+    announcer.start(announcement)
+    return jsonify(serialize_announcement(announcement)), 202
+
+@admin_bp.route('/admin/announcements/<int:announcement_id>')
+@login_required
+@admin_required
+def announcement_status(announcement_id):
+    return jsonify(serialize_announcement(Announcement.query.get_or_404(announcement_id)))
+
+@admin_bp.route('/admin/announcements/<int:announcement_id>/pause', methods=['POST'])
+@login_required
+@admin_required
+def pause_announcement(announcement_id):
+    announcement = Announcement.query.get_or_404(announcement_id)
+    if announcement.status not in ('queued', 'sending'):
+        return jsonify({'success': False, 'message': f'Announcement is {announcement.status}'}), 409
+    announcement.status = 'paused'
+    db.session.commit()
+    return jsonify(serialize_announcement(announcement))
+
+@admin_bp.route('/admin/announcements/<int:announcement_id>/resume', methods=['POST'])
+@login_required
+@admin_required
+def resume_announcement(announcement_id):
+    """Continue a paused, failed or abandoned announcement from its checkpoint."""
+    announcement = Announcement.query.get_or_404(announcement_id)
+    announcer = current_app.extensions['announcer']
+    if not announcer.is_resumable(announcement):
+        return jsonify({'success': False, 'message': f'Announcement is {announcement.status}'}), 409
+    if announcement.status == 'paused':
+        announcement.status = 'queued'
+        db.session.commit()
+    announcer.start(announcement)
+    return jsonify(serialize_announcement(announcement)), 202
+
+@admin_bp.route('/admin/diagnostics/queries')
+@login_required
+@admin_required
+def query_diagnostics():
+    """Per-endpoint query counts, N+1 findings and slow queries of this worker."""
+    return render_template('admin/query_diagnostics.html',
+                           summary=current_app.extensions['query_profiler'].summary(),
+                           slow_ms=current_app.config['QUERY_PROFILER_SLOW_MS'],
+                           pid=os.getpid())
 
 @admin_bp.route('/admin/users')
 @login_required
 @admin_required
+@conditional(USERS, REGISTRATIONS)
 def user_management():
-    users = User.query.all()
-    return render_template('admin/user_management.html', users=users)
+    def build():
+        # Counted in SQL: ``user.forms|length`` loaded every user's registrations
+        form_counts = (db.session.query(FormData.user_id, db.func.count(FormData.id).label('forms'))
+                       .group_by(FormData.user_id)
+                       .subquery())
+        users = (db.session.query(User, db.func.coalesce(form_counts.c.forms, 0))
+                 .outerjoin(form_counts, form_counts.c.user_id == User.id)
+                 .order_by(User.id)
+                 .all())
+        return Markup(render_template('admin/user_rows_partial.html', users=users))
+
+    # The rows disable the admin's own toggle, so they are cached per admin
+    user_rows = current_app.extensions['fragment_cache'].get_or_build(
+        'user_rows', [USERS, REGISTRATIONS], current_user.id, build)
+    return render_template('admin/user_management.html', user_rows=user_rows)
 
 @admin_bp.route('/admin/user/<int:user_id>/toggle-admin', methods=['POST'])
 @login_required
@@ -103,9 +411,15 @@ def toggle_admin(user_id):
 @admin_bp.route('/admin/user/<int:user_id>/forms')
 @login_required
 @admin_required
+@query_budget(4)
+@conditional(USERS, forms_scope)
 def user_forms(user_id):
     user = User.query.get_or_404(user_id)
-    forms = FormData.query.filter_by(user_id=user_id).all()
+    forms = (FormData.query
+             .options(*FormData.profile('list'))
+             .filter_by(user_id=user_id)
+             .order_by(FormData.date_submitted.desc())
+             .all())
     return render_template('admin/user_forms_partial.html', forms=forms, user=user)
 
 @admin_bp.route('/admin/user/<int:user_id>/delete', methods=['POST'])
@@ -3,6 +3,7 @@ class SignaturePad {
         this.canvas = canvas;
         this.ctx = canvas.getContext('2d');
         this.points = [];
+        this.strokes = [];  // one array of points per stroke, for toVectorDataURL()
         this.isDrawing = false;
         
         // Set canvas size
@@ -30,12 +31,16 @@ class SignaturePad {
         const rect = this.canvas.parentNode.getBoundingClientRect();
         this.canvas.width = rect.width;
         this.canvas.height = 150;
+        // Resizing wipes the canvas, so forget what was drawn on it
+        this.points = [];
+        this.strokes = [];
     }
 
     onMouseDown(event) {
         this.isDrawing = true;
         const point = this.getPoint(event);
         this.points.push(point);
+        this.strokes.push([point]);
         this.ctx.beginPath();
         this.ctx.moveTo(point.x, point.y);
     }
@@ -44,6 +49,7 @@ class SignaturePad {
         if (!this.isDrawing) return;
         const point = this.getPoint(event);
         this.points.push(point);
+        this.strokes[this.strokes.length - 1].push(point);
         this.ctx.lineTo(point.x, point.y);
         this.ctx.stroke();
     }
@@ -82,6 +88,7 @@ class SignaturePad {
     clear() {
         this.ctx.clearRect(0, 0, this.canvas.width, this.canvas.height);
         this.points = [];
+        this.strokes = [];
     }
 
     isEmpty() {
@@ -91,6 +98,54 @@ class SignaturePad {
     toDataURL() {
         return this.canvas.toDataURL('image/png');
     }
+
+    /**
+     * Encode the strokes in the compact binary format read by utils/signature.py:
+     * 'SG', version 1, then varints for the canvas size, the stroke count and,
+     * per stroke, the point count followed by zigzag-encoded x/y deltas.
+     */
+    toBytes() {
+        const out = [0x53, 0x47, 1];
+        const varint = (n) => {
+            while (n >= 0x80) {
+                out.push((n & 0x7f) | 0x80);
+                n >>>= 7;
+            }
+            out.push(n);
+        };
+        const zigzag = (n) => ((n << 1) ^ (n >> 31)) >>> 0;
+
+        varint(Math.max(1, Math.round(this.canvas.width)));
+        varint(Math.max(1, Math.round(this.canvas.height)));
+        const strokes = this.strokes.map((stroke) => {
+            // Whole pixels only, without repeats
+            const points = [];
+            for (const point of stroke) {
+                const x = Math.round(point.x), y = Math.round(point.y);
+                const last = points[points.length - 1];
+                if (!last || last[0] !== x || last[1] !== y) points.push([x, y]);
+            }
+            return points;
+        });
+        varint(strokes.length);
+        for (const points of strokes) {
+            varint(points.length);
+            let px = 0, py = 0;
+            for (const [x, y] of points) {
+                varint(zigzag(x - px));
+                varint(zigzag(y - py));
+                px = x;
+                py = y;
+            }
+        }
+        return new Uint8Array(out);
+    }
+
+    toVectorDataURL() {
+        let binary = '';
+        for (const byte of this.toBytes()) binary += String.fromCharCode(byte);
+        return 'data:application/x-signature-strokes;base64,' + btoa(binary);
+    }
 }
 
 // Initialize signature pad when document is loaded
@@ -112,5 +167,10 @@ document.addEventListener('DOMContentLoaded', function() {
             alert('Please sign the photo release form');
             return false;
         }
+
+        // Submit the strokes (a few hundred bytes) rather than a PNG of the canvas
+        const signature = window.signaturePad.isEmpty() ? '' : window.signaturePad.toVectorDataURL();
+        document.getElementById('liability_signature').value = signature;
+        document.getElementById('photo_signature').value = photoRelease.checked ? signature : '';
     });
 });
@@ -0,0 +1,209 @@
+"""
+Shared fixtures.
+
+``app.py`` configures itself from the environment when it is imported, so
+every file it writes (database, sessions, caches, blobs, exports) is pointed
+at a temporary directory first. The SQL query profiler is on, which makes a
+view that runs more statements than its ``@query_budget`` fail the test that
+requested it.
+
+Tests of database-level code take the ``database`` fixture instead, which runs
+them once per entry of ``DATABASE_URLS``: SQLite, and PostgreSQL when
+``TEST_DATABASE_URL`` names a scratch database (its tables are dropped), as
+``docker compose --profile test run --rm tests`` does.
+
+Mail is delivered for real to ``smtp_sink``, a local SMTP server (aiosmtpd)
+that keeps what it receives.
+"""
+
+import os
+import socket
+import tempfile
+from datetime import datetime, timedelta
+
+import pytest
+from aiosmtpd.controller import Controller
+from flask import Flask
+
+_TMP = tempfile.mkdtemp(prefix='church-tests-')
+os.environ.update({
+    'DATABASE_URL': f"sqlite:///{os.path.join(_TMP, 'church.db')}",
+    'SESSION_STORE_PATH': os.path.join(_TMP, 'sessions.sqlite3'),
+    'RATE_LIMIT_FILE': os.path.join(_TMP, 'rate_limits.mmap'),
+    'METRICS_DIR': os.path.join(_TMP, 'metrics'),
+    'USER_CACHE_VERSION_FILE': os.path.join(_TMP, 'user_cache.version'),
+    'EXPORT_DIR': os.path.join(_TMP, 'exports'),
+    'BLOB_DIR': os.path.join(_TMP, 'uploads'),
+    'CACHE_SQLITE_PATH': os.path.join(_TMP, 'cache.sqlite3'),
+    'LOG_FILE': '',
+    'LOG_LEVEL': 'WARNING',
+    'QUERY_PROFILER': 'True',
+})
+
+from app import app as flask_app, cache  # noqa: E402  (needs the environment above)
+from models import db, User, FormData  # noqa: E402
+from utils.database import engine_options  # noqa: E402
+from utils.registration_stats import reconcile  # noqa: E402
+from utils.search import DROP_SCHEMA, ensure_search_index  # noqa: E402
+
+EVENTS = ['Winter Camp', 'Summer Camp', 'Youth Retreat']
+STATUSES = ['pending', 'approved', 'rejected']
+FORMS_PER_USER = 2
+
+DATABASE_URLS = {
+    'sqlite': f"sqlite:///{os.path.join(_TMP, 'database.db')}",
+    'postgresql': os.getenv('TEST_DATABASE_URL'),
+}
+
+# The test client has no stable identity for Flask-Login's session protection
+flask_app.config.update(TESTING=True, SESSION_PROTECTION=None)
+
+
+@pytest.fixture(scope='session')
+def app():
+    return flask_app
+
+
+def reset_database() -> None:
+    """Recreate the app's tables and search index, empty; needs an app context."""
+    with db.engine.begin() as conn:
+        for statement in DROP_SCHEMA:
+            conn.exec_driver_sql(statement)
+    db.drop_all()
+    db.create_all()
+    with db.engine.begin() as conn:
+        ensure_search_index(conn)
+
+
+def forget_cached_pages(app) -> None:
+    """Drop what was cached for an earlier seed, which can share its ids and data versions."""
+    app.extensions['fragment_cache'].clear()
+    app.extensions['user_cache'].invalidate()
+    with app.app_context():
+        cache.clear()
+
+
+@pytest.fixture(params=sorted(DATABASE_URLS))
+def database(request):
+    """
+    ``db`` inside an app context bound to an empty schema on one of ``DATABASE_URLS``.
+
+    The app is a bare one, so ``db.session`` and the helpers using it run
+    against that database while the main app keeps its own.
+    """
+    url = DATABASE_URLS[request.param]
+    if not url:
+        pytest.skip(f'TEST_DATABASE_URL does not name a {request.param} database')
+    app = Flask(__name__)
+    app.config.update(TESTING=True, SQLALCHEMY_DATABASE_URI=url,
+                      SQLALCHEMY_ENGINE_OPTIONS=engine_options(url))
+    db.init_app(app)
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        yield db
+        db.session.remove()
+        db.drop_all()
+        db.engine.dispose()
+
+
+@pytest.fixture
+def seed(app):
+    """
+    Return a function that resets the database and fills it with registrations.
+
+    ``seed(n)`` creates an admin and ``n / FORMS_PER_USER`` parents owning
+    ``n`` registrations spread over a few events, and returns
+    ``(admin_id, parent_id)`` for the first parent.
+    """
+    def seed(registrations):
+        with app.app_context():
+            reset_database()
+            admin = User(email='admin@example.com', is_admin=True)
+            admin.set_password('Admin123!')
+            parents = [User(email=f'parent{i}@example.com')
+                       for i in range(max(1, registrations // FORMS_PER_USER))]
+            for parent in parents:
+                parent.set_password('Parent123!')
+            db.session.add_all([admin, *parents])
+            db.session.flush()
+            now = datetime.utcnow()
+            db.session.add_all(
+                FormData(user_id=parents[i % len(parents)].id, student_name=f'Student {i:03d}',
+                         date_of_birth='2012-05-01', street=f'{i} Main St', city='Seattle',
+                         zip_code='98101', parent_guardian=f'Parent {i % len(parents)}',
+                         parent_cell_phone=f'206-555-{i:04d}', emergency_contact='Grandparent',
+                         emergency_phone='206-555-9999', current_treatment=i % 4 == 0,
+                         treatment_details='Inhaler' if i % 4 == 0 else None,
+                         event_name=EVENTS[i % len(EVENTS)], status=STATUSES[i % len(STATUSES)],
+                         payment_status=i % 2 == 0, date_submitted=now - timedelta(minutes=i))
+                for i in range(registrations))
+            db.session.commit()
+            with db.engine.begin() as conn:
+                reconcile(conn)
+            ids = admin.id, parents[0].id
+        forget_cached_pages(app)
+        return ids
+
+    return seed
+
+
+def signed_in_client(app, user_id):
+    """A test client whose session is signed in as ``user_id``."""
+    client = app.test_client()
+    with app.app_context():
+        user_key = db.session.get(User, user_id).get_id()
+    with client.session_transaction() as session:
+        session['_user_id'] = user_key
+        session['_fresh'] = True
+    return client
+
+
+@pytest.fixture
+def client_for(app):
+    """Return a function giving a test client signed in as a user id."""
+    return lambda user_id: signed_in_client(app, user_id)
+
+
+def free_port() -> int:
+    """A local TCP port nothing listens on (until someone binds it)."""
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def mail_settings(port: int) -> dict:
+    """Flask-Mail config that really sends, unencrypted, to 127.0.0.1:``port``."""
+    return {'MAIL_SERVER': '127.0.0.1', 'MAIL_PORT': port, 'MAIL_USE_TLS': False,
+            'MAIL_USE_SSL': False, 'MAIL_USERNAME': None, 'MAIL_PASSWORD': None,
+            'MAIL_SUPPRESS_SEND': False, 'MAIL_DEFAULT_SENDER': 'office@example.com'}
+
+
+class SMTPSink:
+    """
+    aiosmtpd handler keeping every envelope it accepts in ``messages``.
+
+    ``on_message``, if set, is called with the number received so far after
+    each one, on the server's thread.
+    """
+
+    def __init__(self):
+        self.messages = []
+        self.on_message = None
+
+    async def handle_DATA(self, server, session, envelope):
+        self.messages.append(envelope)
+        if self.on_message:
+            self.on_message(len(self.messages))
+        return '250 OK'
+
+
+@pytest.fixture
+def smtp_sink():
+    """A running ``SMTPSink``; its port is ``smtp_sink.port``."""
+    sink = SMTPSink()
+    controller = Controller(sink, hostname='127.0.0.1', port=free_port())
+    controller.start()
+    sink.port = controller.port
+    yield sink
+    controller.stop()
@@ -0,0 +1,114 @@
+"""
+Announcements reach every family once, paced, and resume from their checkpoint.
+
+Runs send to a local SMTP server (``smtp_sink``) through the admin routes,
+in chunks of ``CHUNK`` families. Pausing mid-chunk stops after that chunk is
+checkpointed; resuming continues from its ``last_user_id``.
+"""
+
+import time
+
+import pytest
+from flask_mail import Mail
+from sqlalchemy import select, update
+
+from conftest import mail_settings
+from models import db, Announcement, FormData
+from utils.announcements import Throttle
+
+CHUNK = 2
+RATE = 20
+FAMILIES = 6
+
+
+@pytest.fixture
+def run(app, seed, client_for, smtp_sink, monkeypatch):
+    """Seed ``FAMILIES`` families; return an admin client and the families' user ids."""
+    admin_id, _ = seed(FAMILIES * 2)
+    settings = dict(mail_settings(smtp_sink.port), ANNOUNCEMENT_CHUNK_SIZE=CHUNK,
+                    ANNOUNCEMENT_RATE=RATE, ANNOUNCEMENT_CONNECTIONS=2)
+    for key, value in settings.items():
+        monkeypatch.setitem(app.config, key, value)
+    monkeypatch.setitem(app.extensions, 'mail',
+                        Mail().init_mail(app.config, app.debug, app.testing))
+    with app.app_context():
+        families = db.session.scalars(
+            select(FormData.user_id).distinct().order_by(FormData.user_id)).all()
+    assert len(families) == FAMILIES
+    return client_for(admin_id), families
+
+
+def announce(admin):
+    response = admin.post('/admin/announcements',
+                          json={'subject': 'Camp news', 'body': 'Hello {{ students }}'})
+    assert response.status_code == 202
+    return response.get_json()['id']
+
+
+def wait_for(app, announcement_id, reached, timeout=10):
+    """Poll the announcement until ``reached(announcement)`` is true, and return it."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        with app.app_context():
+            announcement = db.session.get(Announcement, announcement_id)
+            if reached(announcement):
+                return announcement
+        time.sleep(0.05)
+    pytest.fail(f'announcement {announcement_id} did not get there')
+
+
+def finished(announcement):
+    return announcement.status in ('done', 'failed')
+
+
+def recipients(sink):
+    return [envelope.rcpt_tos[0] for envelope in sink.messages]
+
+
+def test_throttle_paces_all_threads():
+    throttle = Throttle(RATE)
+    start = time.monotonic()
+    for _ in range(5):
+        throttle.wait()
+    assert time.monotonic() - start >= 4 / RATE
+
+
+def test_announcement_reaches_every_family_once(app, run, smtp_sink):
+    admin, families = run
+    start = time.monotonic()
+    announcement = wait_for(app, announce(admin), finished)
+
+    assert (announcement.status, announcement.sent_count, announcement.failed_count) == \
+        ('done', FAMILIES, 0)
+    assert announcement.last_user_id == families[-1]
+    assert sorted(recipients(smtp_sink)) == sorted(f'parent{i}@example.com' for i in range(FAMILIES))
+    # Both connections share one messages-per-second budget
+    assert time.monotonic() - start >= (FAMILIES - 1) / RATE
+
+
+def test_pause_keeps_the_chunk_checkpoint_and_resume_continues(app, run, smtp_sink):
+    admin, families = run
+    paused_at = CHUNK + 1
+
+    def pause(received):
+        # As the pause route does, while the second chunk is being sent
+        if received == paused_at:
+            with app.app_context(), db.engine.begin() as conn:
+                conn.execute(update(Announcement.__table__).values(status='paused'))
+
+    smtp_sink.on_message = pause
+    announcement_id = announce(admin)
+    # The chunk being sent when the pause came is finished and checkpointed
+    announcement = wait_for(app, announcement_id, lambda a: a.sent_count >= paused_at)
+    assert announcement.status == 'paused'
+    assert announcement.sent_count == 2 * CHUNK
+    assert announcement.last_user_id == families[2 * CHUNK - 1]
+    assert len(smtp_sink.messages) == 2 * CHUNK
+
+    smtp_sink.on_message = None
+    assert admin.post(f'/admin/announcements/{announcement_id}/resume').status_code == 202
+    announcement = wait_for(app, announcement_id, finished)
+    assert (announcement.status, announcement.sent_count) == ('done', FAMILIES)
+    assert announcement.last_user_id == families[-1]
+    # Nothing sent twice
+    assert sorted(recipients(smtp_sink)) == sorted(f'parent{i}@example.com' for i in range(FAMILIES))
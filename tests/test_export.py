@@ -0,0 +1,86 @@
+"""
+The CSV export is the same file whichever way it is produced.
+
+SQLite (and PostgreSQL without ``COPY``) write it row by row with the csv
+module in :func:`generate_export`; PostgreSQL formats it in SQL and writes it
+with ``COPY`` (:func:`copy_csv_export`). The rows below cover what the SQL has
+to mimic: ``to_char`` dates, ``None`` for missing address, doctor and
+insurance parts, ``N/A`` for NULL and empty treatment details, the Yes/No and
+Paid/Pending cases, and values that need quoting.
+"""
+
+from datetime import datetime
+from io import BytesIO
+
+import pytest
+
+from models import User, FormData
+from utils.database import is_postgres
+from utils.export import copy_csv_export, generate_export, iter_copy_export, iter_export_rows
+
+REGISTRATIONS = [
+    dict(student_name='Ann Lee', date_of_birth='2012-05-01', street='1 Main St', city='Seattle',
+         zip_code='98101', parent_guardian='Pat Lee', parent_cell_phone='206-555-0100',
+         emergency_contact='Sam Lee', emergency_phone='206-555-0199', current_treatment=True,
+         treatment_details='Inhaler, as needed', family_doctor='Dr. Ray', doctor_phone='206-555-0111',
+         insurance_company='Acme', policy_number='P-1', payment_status=True,
+         date_submitted=datetime(2026, 1, 5, 9, 30)),
+    dict(student_name='Ben Ortiz', date_of_birth='', street=None, city='', zip_code=None,
+         parent_guardian='Ana Ortiz', parent_cell_phone='206-555-0200', home_phone='',
+         emergency_contact=None, emergency_phone=None, current_treatment=False,
+         treatment_details=None, family_doctor=None, doctor_phone='', payment_status=False,
+         date_submitted=datetime(2026, 1, 6, 23, 59, 59)),
+    dict(student_name='Zoë "Z" Ng', date_of_birth=None, street='2 Pine St, Apt 4', city='Tacoma',
+         zip_code='98402', parent_guardian='Kim Ng', current_treatment=None, treatment_details='',
+         insurance_company='', policy_number=None, payment_status=None,
+         date_submitted=datetime(2026, 1, 7, 0, 0)),
+    dict(student_name='Dee Park', current_treatment=True,
+         treatment_details='Line one\r\nline two', date_submitted=datetime(2026, 1, 8, 12, 0)),
+]
+
+EXPECTED_CSV = (
+    'Date Submitted,Student Name,Date of Birth,Address,Parent/Guardian,Parent Cell,Home Phone,'
+    'Emergency Contact,Emergency Phone,Medical Info,Doctor Info,Insurance,Payment Status\n'
+    '2026-01-05,Ann Lee,2012-05-01,"1 Main St, Seattle, 98101",Pat Lee,206-555-0100,,Sam Lee,'
+    '206-555-0199,"Treatment: Yes, Details: Inhaler, as needed","Doctor: Dr. Ray, Phone: 206-555-0111",'
+    '"Company: Acme, Policy: P-1",Paid\n'
+    '2026-01-06,Ben Ortiz,,"None, , None",Ana Ortiz,206-555-0200,,,,"Treatment: No, Details: N/A",'
+    '"Doctor: None, Phone: ","Company: None, Policy: None",Pending\n'
+    '2026-01-07,"Zoë ""Z"" Ng",,"2 Pine St, Apt 4, Tacoma, 98402",Kim Ng,,,,,'
+    '"Treatment: No, Details: N/A","Doctor: None, Phone: None","Company: , Policy: None",Pending\n'
+    '2026-01-08,Dee Park,,"None, None, None",,,,,,"Treatment: Yes, Details: Line one\r\nline two",'
+    '"Doctor: None, Phone: None","Company: None, Policy: None",Pending\n'
+)
+
+
+@pytest.fixture
+def registrations(database):
+    parent = User(email='parent@example.com', password_hash='x')
+    database.session.add(parent)
+    database.session.flush()
+    database.session.add_all(FormData(user_id=parent.id, **values) for values in REGISTRATIONS)
+    database.session.commit()
+    return database
+
+
+def test_csv_writer_output(registrations):
+    assert ''.join(generate_export(iter_export_rows({}), chunk_rows=2)) == EXPECTED_CSV
+
+
+def test_copy_export_matches_csv_writer(registrations):
+    if not is_postgres(registrations.engine):
+        pytest.skip('COPY needs PostgreSQL')
+    written = ''.join(generate_export(iter_export_rows({}))).encode('utf-8')
+
+    copied = BytesIO()
+    assert copy_csv_export({}, copied) == len(REGISTRATIONS)
+    assert copied.getvalue() == written
+    assert b''.join(iter_copy_export({}, chunk_size=100)) == written
+
+
+def test_copy_export_filters_like_csv_writer(registrations):
+    if not is_postgres(registrations.engine):
+        pytest.skip('COPY needs PostgreSQL')
+    filters = {'payment': 'pending'}
+    written = ''.join(generate_export(iter_export_rows(filters))).encode('utf-8')
+    assert b''.join(iter_copy_export(filters)) == written
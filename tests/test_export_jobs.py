@@ -0,0 +1,67 @@
+"""
+Background export jobs are not handed out once their worker has gone.
+
+A job whose heartbeat is older than ``EXPORT_STALE_AFTER`` is marked failed,
+and asking for the same export again starts a new job that runs to the end.
+"""
+
+import time
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+
+from models import db, ExportJob
+from utils.export_jobs import ExportJobRunner
+from utils.versioning import REGISTRATIONS, current_version
+
+FILTERS = {'event': 'Summer Camp'}
+
+
+@pytest.fixture
+def runner(app, seed):
+    seed(10)
+    return app.extensions['export_jobs']
+
+
+def abandoned_job(status, heartbeat_at):
+    """A job for ``FILTERS`` as a worker that died would have left it."""
+    key = ExportJobRunner.cache_key(FILTERS, 'csv', current_version(REGISTRATIONS))
+    job = ExportJob(id=uuid.uuid4().hex, format='csv', filters='{}', cache_key=key,
+                    status=status, heartbeat_at=heartbeat_at)
+    db.session.add(job)
+    db.session.commit()
+    return job.id
+
+
+def wait_for(job_id, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        db.session.expire_all()
+        job = db.session.get(ExportJob, job_id)
+        if job.status in ('done', 'failed'):
+            return job
+        time.sleep(0.05)
+    pytest.fail(f'export {job_id} did not finish')
+
+
+@pytest.mark.parametrize('status', ['queued', 'running'])
+def test_stale_job_is_failed_and_replaced(app, runner, status):
+    with app.app_context():
+        stale_id = abandoned_job(status, datetime.utcnow() - timedelta(hours=1))
+        job = runner.start(FILTERS, 'csv')
+        assert job.id != stale_id
+        assert db.session.get(ExportJob, stale_id).status == 'failed'
+        assert wait_for(job.id).status == 'done'
+
+
+def test_job_without_heartbeat_is_stale(app, runner):
+    with app.app_context():
+        stale_id = abandoned_job('running', None)
+        assert runner.start(FILTERS, 'csv').id != stale_id
+
+
+def test_live_job_is_reused(app, runner):
+    with app.app_context():
+        live_id = abandoned_job('running', datetime.utcnow())
+        assert runner.start(FILTERS, 'csv').id == live_id
@@ -0,0 +1,63 @@
+"""
+Sessions imported from the old filesystem backend keep users signed in.
+
+Flask-Session wrote the bare user id to ``_user_id``; the import rewrites it
+to the ``"<id>:<password version>"`` form ``load_user`` accepts, and imports
+the sessions of users that no longer exist logged out.
+"""
+
+import pickle
+import struct
+import time
+
+import pytest
+
+from import_sessions import import_sessions
+from utils.session_store import storage_key
+
+MISSING_USER = 9999
+
+
+def write_session(directory, sid, data, expiry=0):
+    """Save ``data`` under ``sid`` the way Flask-Session's filesystem backend did."""
+    path = directory / storage_key(sid).hex()
+    path.write_bytes(struct.pack('I', expiry) + pickle.dumps(data))
+
+
+def login_data(user_id):
+    return {'_user_id': str(user_id), '_fresh': True, '_id': 'x' * 128, 'user_id': user_id,
+            'email': f'user{user_id}@example.com', 'is_admin': False,
+            'login_time': time.time(), '_permanent': True}
+
+
+@pytest.fixture
+def imported(app, seed, tmp_path):
+    _, parent_id = seed(2)
+    write_session(tmp_path, 'a' * 32, login_data(parent_id))
+    write_session(tmp_path, 'b' * 32, login_data(MISSING_USER))
+    write_session(tmp_path, 'c' * 32, login_data(parent_id), expiry=int(time.time()) - 60)
+    assert import_sessions(str(tmp_path)) == (2, 1)
+    return parent_id
+
+
+def client_with_session(app, sid):
+    client = app.test_client()
+    client.set_cookie(app.config['SESSION_COOKIE_NAME'], sid)
+    return client
+
+
+def stored(app, sid):
+    interface = app.session_interface
+    data, _ = interface.store.load(storage_key(sid), time.time())
+    return interface.serializer.loads(data)
+
+
+def test_user_ids_are_rewritten_for_load_user(app, imported):
+    assert client_with_session(app, 'a' * 32).get('/dashboard').status_code == 200
+    assert stored(app, 'a' * 32)['_user_id'].startswith(f'{imported}:')
+
+
+def test_sessions_of_missing_users_are_logged_out(app, imported):
+    data = stored(app, 'b' * 32)
+    assert data == {'_permanent': True}
+    assert client_with_session(app, 'b' * 32).get('/dashboard').status_code == 302
@@ -0,0 +1,58 @@
+"""
+Views load only the FormData columns they display.
+
+The signature columns hold the largest values in the table and are deferred;
+only the admin registration detail shows them.
+"""
+
+import pytest
+from sqlalchemy import event
+
+from models import db
+
+SIGNATURES = ('liability_signature', 'photo_signature')
+
+
+def selected(app, client, url):
+    """The SELECT statements run while ``client`` requests ``url``."""
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith('SELECT'):
+            statements.append(statement)
+
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', record)
+    try:
+        response = client.get(url)
+    finally:
+        event.remove(engine, 'before_cursor_execute', record)
+    assert response.status_code == 200
+    return ' '.join(statements)
+
+
+@pytest.fixture
+def clients(seed, client_for):
+    admin_id, parent_id = seed(3)
+    return client_for(admin_id), client_for(parent_id)
+
+
+def test_parent_dashboard_loads_medical_details_but_not_signatures(app, clients):
+    _, parent = clients
+    sql = selected(app, parent, '/dashboard')
+    assert 'form_data.treatment_details' in sql
+    assert not any(f'form_data.{column}' in sql for column in SIGNATURES)
+
+
+def test_admin_lists_skip_deferred_text(app, clients):
+    admin, _ = clients
+    sql = selected(app, admin, '/admin/api/registrations')
+    assert not any(f'form_data.{column}' in sql
+                   for column in SIGNATURES + ('treatment_details', 'restriction_details'))
+
+
+def test_registration_detail_loads_signatures(app, clients):
+    admin, _ = clients
+    sql = selected(app, admin, '/admin/registration/1?format=json')
+    assert all(f'form_data.{column}' in sql for column in SIGNATURES)
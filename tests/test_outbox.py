@@ -0,0 +1,118 @@
+"""
+The email outbox delivers what was committed, once, and backs off on failure.
+
+Messages are enqueued in the caller's transaction and drained to a local SMTP
+server (``smtp_sink``). A server that refuses connections leaves them pending
+with an exponentially growing delay, and claims left behind by a dead worker
+are released to the queue.
+"""
+
+from datetime import datetime, timedelta
+
+import pytest
+from flask import current_app
+from flask_mail import Mail
+
+from conftest import free_port, mail_settings
+from models import User, OutboxMessage
+from utils.outbox import Outbox
+
+RETRY_BASE = 30
+
+
+@pytest.fixture
+def outbox_to(database):
+    """Return a function giving an ``Outbox`` of the ``database`` app that mails ``port``."""
+    app = current_app._get_current_object()
+
+    def outbox_to(port):
+        app.config.update(mail_settings(port), OUTBOX_ENABLED=False, OUTBOX_BATCH_SIZE=2,
+                          OUTBOX_MAX_ATTEMPTS=3, OUTBOX_RETRY_BASE=RETRY_BASE)
+        return Outbox(app, Mail(app))
+
+    return outbox_to
+
+
+def enqueue(database, outbox, count=1):
+    for i in range(count):
+        outbox.enqueue(f'Registration {i} received', f'parent{i}@example.com', body='Thank you')
+    database.session.commit()
+
+
+def messages(database, **filters):
+    database.session.expire_all()
+    return OutboxMessage.query.filter_by(**filters).order_by(OutboxMessage.id).all()
+
+
+def test_enqueue_follows_the_transaction(database, outbox_to):
+    outbox = outbox_to(free_port())
+    database.session.add(User(email='parent@example.com', password_hash='x'))
+    outbox.enqueue('Welcome', 'parent@example.com', body='Hello')
+    database.session.rollback()
+    assert messages(database) == []
+
+    enqueue(database, outbox)
+    assert [m.status for m in messages(database)] == ['pending']
+
+
+def test_drain_sends_committed_messages(database, outbox_to, smtp_sink):
+    outbox = outbox_to(smtp_sink.port)
+    enqueue(database, outbox, count=5)
+
+    # Three batches of OUTBOX_BATCH_SIZE over one connection
+    assert outbox.drain() == 5
+    assert [m.status for m in messages(database)] == ['sent'] * 5
+    assert all(m.attempts == 1 and m.sent_at and m.claimed_at is None
+               for m in messages(database))
+    assert sorted(envelope.rcpt_tos[0] for envelope in smtp_sink.messages) == \
+        [f'parent{i}@example.com' for i in range(5)]
+    assert outbox.drain() == 0
+    assert len(smtp_sink.messages) == 5
+
+
+def test_refused_connection_backs_off(database, outbox_to):
+    outbox = outbox_to(free_port())
+    enqueue(database, outbox)
+
+    for attempt in range(1, 3):
+        before = datetime.utcnow()
+        assert outbox.drain() == 0
+        message, = messages(database)
+        assert (message.status, message.attempts) == ('pending', attempt)
+        assert message.last_error and message.claimed_at is None
+        delay = timedelta(seconds=RETRY_BASE * 2 ** (attempt - 1))
+        assert before + delay <= message.next_attempt_at <= datetime.utcnow() + delay
+        # Not due yet
+        assert outbox.claim_batch() == []
+        message.next_attempt_at = datetime.utcnow()
+        database.session.commit()
+
+    assert outbox.drain() == 0
+    message, = messages(database)
+    assert (message.status, message.attempts) == ('failed', 3)
+
+
+def test_claimed_messages_are_not_claimed_again(database, outbox_to):
+    outbox = outbox_to(free_port())
+    enqueue(database, outbox, count=3)
+
+    first = outbox.claim_batch()
+    second = outbox.claim_batch()
+    assert len(first) == 2 and len(second) == 1
+    assert not {row.id for row in first} & {row.id for row in second}
+    assert outbox.claim_batch() == []
+    assert all(m.status == 'sending' and m.claimed_at for m in messages(database))
+
+
+def test_stale_claims_are_released(database, outbox_to, smtp_sink):
+    outbox = outbox_to(smtp_sink.port)
+    enqueue(database, outbox, count=2)
+    stale, _ = messages(database)
+    outbox.claim_batch()
+    stale.claimed_at = datetime.utcnow() - timedelta(hours=1)
+    database.session.commit()
+
+    assert outbox.release_stale_claims() == 1
+    assert [m.status for m in messages(database)] == ['pending', 'sending']
+    assert outbox.drain() == 1
+    assert [m.status for m in messages(database, id=stale.id)] == ['sent']
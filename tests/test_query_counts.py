@@ -0,0 +1,62 @@
+"""
+The number of SQL statements a view runs must not grow with the data.
+
+Every list, detail and API view is requested against a small and a larger
+database, with the query profiler counting statements. A view that issues a
+query per registration or per user (an N+1) runs more statements on the
+larger one and fails.
+"""
+
+import pytest
+
+SMALL, LARGE = 5, 80
+
+
+def views(parent_id):
+    """(client, url) of each view to count; ``client`` is ``admin`` or ``parent``."""
+    return [
+        ('parent', '/dashboard'),
+        ('admin', '/admin/dashboard'),
+        ('admin', '/admin/dashboard?event=Summer+Camp&payment=paid'),
+        ('admin', '/admin/api/stats'),
+        ('admin', '/admin/api/registrations'),
+        ('admin', '/admin/api/registrations?render=rows'),
+        ('admin', '/admin/api/registrations/search?q=Student'),
+        ('admin', '/admin/registration/1'),
+        ('admin', '/admin/registration/1?format=json'),
+        ('admin', '/admin/users'),
+        ('admin', f'/admin/user/{parent_id}/forms'),
+        ('admin', '/admin/announcements'),
+        ('admin', '/admin/announcements/recipients?event=Summer+Camp'),
+    ]
+
+
+def statements_per_view(app, seed, client_for, registrations):
+    """Seed ``registrations`` rows, request every view once and count its statements."""
+    admin_id, parent_id = seed(registrations)
+    clients = {'admin': client_for(admin_id), 'parent': client_for(parent_id)}
+    profiler = app.extensions['query_profiler']
+    counts = {}
+    for who, url in views(parent_id):
+        before = sum(stats['queries'] for stats in profiler.endpoints.values())
+        response = clients[who].get(url)
+        assert response.status_code == 200, f'{url}: HTTP {response.status_code}'
+        counts[url] = sum(stats['queries'] for stats in profiler.endpoints.values()) - before
+    return counts
+
+
+@pytest.fixture
+def counts(app, seed, client_for):
+    assert app.extensions['query_profiler'].enabled
+    return {size: statements_per_view(app, seed, client_for, size) for size in (SMALL, LARGE)}
+
+
+def test_statement_count_does_not_grow_with_registrations(counts):
+    grew = {url: (counts[SMALL][url], counts[LARGE][url])
+            for url in counts[SMALL] if counts[SMALL][url] != counts[LARGE][url]}
+    assert not grew, f'statements with {SMALL} vs {LARGE} registrations: {grew}'
+
+
+def test_every_view_queries_the_database(counts):
+    # Guards the comparison above against views answered from a cache
+    assert all(counts[SMALL].values()), counts[SMALL]
@@ -0,0 +1,261 @@
+"""
+Bulk announcement mailer.
+
+An ``Announcement`` goes to every family (user account) with a registration
+matching its event/status filter. Sending runs on a background coordinator
+thread, never on a web worker's request thread:
+
+- The announcement body and the shared email layout are compiled once, then
+  rendered per recipient.
+- Messages are sent by a small pool of sender threads. Each sender keeps one
+  SMTP connection open for the whole run, and all senders share a
+  messages-per-second throttle.
+- Recipients are processed in chunks ordered by user id. After each chunk the
+  sent/failed counters and the last user id are checkpointed, so a paused or
+  interrupted announcement resumes where it stopped. Delivery is at least
+  once: a crash mid-chunk resends that chunk.
+"""
+
+import contextlib
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Dict, List
+
+from flask_mail import Message
+from jinja2.sandbox import SandboxedEnvironment
+from sqlalchemy import select, update
+
+from models import db, Announcement, FormData, User
+
+logger = logging.getLogger(__name__)
+
+
+class Throttle:
+    """Thread-safe pacing of at most ``rate`` events per second."""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate > 0 else 0
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self) -> None:
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(self._next, now)
+            self._next = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+def recipient_filter(stmt, event_name=None, form_status=None):
+    stmt = stmt.where(FormData.user_id == User.id)
+    if event_name:
+        stmt = stmt.where(FormData.event_name == event_name)
+    if form_status:
+        stmt = stmt.where(FormData.status == form_status)
+    return stmt
+
+
+def count_recipients(event_name=None, form_status=None) -> int:
+    stmt = recipient_filter(select(db.func.count(db.distinct(User.id))), event_name, form_status)
+    return db.session.execute(stmt).scalar()
+
+
+class Announcer:
+    """
+    Flask extension that runs announcements in the background.
+
+    Config:
+        ANNOUNCEMENT_RATE: Messages per second across all connections
+        ANNOUNCEMENT_CONNECTIONS: Persistent SMTP connections per run
+        ANNOUNCEMENT_CHUNK_SIZE: Recipients per checkpoint
+        ANNOUNCEMENT_STALE_AFTER: Seconds without a checkpoint before a
+            'sending' announcement is considered abandoned and may be resumed
+    """
+
+    def __init__(self, app=None, mail=None):
+        self.app = None
+        self.mail = None
+        self._executor = None
+        self._executor_pid = None
+        self._env = SandboxedEnvironment(autoescape=False)
+        if app is not None:
+            self.init_app(app, mail)
+
+    def init_app(self, app, mail) -> None:
+        app.config.setdefault('ANNOUNCEMENT_RATE', 5)
+        app.config.setdefault('ANNOUNCEMENT_CONNECTIONS', 2)
+        app.config.setdefault('ANNOUNCEMENT_CHUNK_SIZE', 100)
+        app.config.setdefault('ANNOUNCEMENT_STALE_AFTER', 300)
+        self.app = app
+        self.mail = mail
+        app.extensions['announcer'] = self
+
+    def _pool(self) -> ThreadPoolExecutor:
+        if self._executor_pid != os.getpid():
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='announcement')
+            self._executor_pid = os.getpid()
+        return self._executor
+
+    def validate(self, body: str) -> None:
+        """Raise ``jinja2.TemplateSyntaxError`` if ``body`` does not compile."""
+        self._env.from_string(body)
+
+    def start(self, announcement: Announcement) -> None:
+        """Queue ``announcement`` (new or resumed) on this worker's coordinator."""
+        self._pool().submit(self._run, announcement.id)
+
+    def is_resumable(self, announcement: Announcement) -> bool:
+        if announcement.status in ('paused', 'failed', 'queued'):
+            return True
+        if announcement.status == 'sending':
+            stale = timedelta(seconds=float(self.app.config['ANNOUNCEMENT_STALE_AFTER']))
+            return (announcement.heartbeat_at is None or
+                    announcement.heartbeat_at < datetime.utcnow() - stale)
+        return False
+
+    def _claim(self, announcement_id: int) -> bool:
+        """Atomically move the announcement to 'sending' so only one worker runs it."""
+        table = Announcement.__table__
+        stale = datetime.utcnow() - timedelta(
+            seconds=float(self.app.config['ANNOUNCEMENT_STALE_AFTER']))
+        with db.engine.begin() as conn:
+            result = conn.execute(
+                update(table)
+                .where(table.c.id == announcement_id,
+                       (table.c.status.in_(('queued', 'failed'))) |
+                       ((table.c.status == 'sending') & (table.c.heartbeat_at < stale)))
+                .values(status='sending', heartbeat_at=datetime.utcnow()))
+        return result.rowcount == 1
+
+    def _next_recipients(self, announcement: Announcement, after_user_id: int) -> List[Dict]:
+        chunk = int(self.app.config['ANNOUNCEMENT_CHUNK_SIZE'])
+        users = db.session.execute(
+            recipient_filter(select(User.id, User.email).distinct(),
+                             announcement.event_name, announcement.form_status)
+            .where(User.id > after_user_id)
+            .order_by(User.id)
+            .limit(chunk)
+        ).all()
+        if not users:
+            return []
+        students = {}
+        rows = db.session.execute(
+            recipient_filter(select(FormData.user_id, FormData.student_name),
+                             announcement.event_name, announcement.form_status)
+            .where(FormData.user_id.in_([user.id for user in users]))
+            .order_by(FormData.user_id, FormData.student_name)
+        )
+        for user_id, student_name in rows:
+            students.setdefault(user_id, []).append(student_name)
+        return [{'user_id': user.id, 'email': user.email,
+                 'student_names': students.get(user.id, [])} for user in users]
+
+    def _run(self, announcement_id: int) -> None:
+        with self.app.app_context():
+            if not self._claim(announcement_id):
+                return
+            announcement = db.session.get(Announcement, announcement_id)
+            try:
+                self._send_all(announcement)
+            except Exception as e:
+                logger.exception("Announcement %s failed", announcement_id)
+                db.session.rollback()
+                db.session.execute(update(Announcement)
+                                   .where(Announcement.id == announcement_id)
+                                   .values(status='failed', last_error=str(e)))
+                db.session.commit()
+
+    def _send_all(self, announcement: Announcement) -> None:
+        # Shared parts are compiled once per run
+        body_template = self._env.from_string(announcement.body)
+        layout = self.app.jinja_env.get_template('email/announcement.html')
+        sender = self.app.config.get('MAIL_DEFAULT_SENDER')
+
+        work = queue.Queue(maxsize=int(self.app.config['ANNOUNCEMENT_CHUNK_SIZE']))
+        results = queue.Queue()
+        throttle = Throttle(float(self.app.config['ANNOUNCEMENT_RATE']))
+        senders = [threading.Thread(target=self._sender, args=(work, results, throttle),
+                                    name=f'announcement-smtp-{i}', daemon=True)
+                   for i in range(int(self.app.config['ANNOUNCEMENT_CONNECTIONS']))]
+        for thread in senders:
+            thread.start()
+
+        try:
+            last_user_id = announcement.last_user_id
+            while True:
+                db.session.refresh(announcement)
+                if announcement.status != 'sending':
+                    logger.info("Announcement %s stopped (%s)", announcement.id, announcement.status)
+                    return
+                recipients = self._next_recipients(announcement, last_user_id)
+                if not recipients:
+                    break
+
+                for recipient in recipients:
+                    context = dict(recipient, event_name=announcement.event_name,
+                                   students=', '.join(recipient['student_names']))
+                    text = body_template.render(context)
+                    work.put(Message(subject=announcement.subject, recipients=[recipient['email']],
+                                     body=text, html=layout.render(body=text, **context),
+                                     sender=sender))
+
+                sent = failed = 0
+                last_error = None
+                for _ in recipients:
+                    error = results.get()
+                    if error is None:
+                        sent += 1
+                    else:
+                        failed += 1
+                        last_error = error
+                last_user_id = recipients[-1]['user_id']
+
+                # Checkpoint the chunk
+                values = dict(sent_count=Announcement.sent_count + sent,
+                              failed_count=Announcement.failed_count + failed,
+                              last_user_id=last_user_id, heartbeat_at=datetime.utcnow())
+                if last_error:
+                    values['last_error'] = last_error
+                db.session.execute(update(Announcement)
+                                   .where(Announcement.id == announcement.id)
+                                   .values(**values))
+                db.session.commit()
+
+            db.session.execute(update(Announcement)
+                               .where(Announcement.id == announcement.id)
+                               .values(status='done', finished_at=datetime.utcnow()))
+            db.session.commit()
+            logger.info("Announcement %s finished", announcement.id)
+        finally:
+            for _ in senders:
+                work.put(None)
+            for thread in senders:
+                thread.join()
+
+    def _sender(self, work: queue.Queue, results: queue.Queue, throttle: Throttle) -> None:
+        """Send messages from ``work`` over one persistent SMTP connection."""
+        with self.app.app_context(), contextlib.ExitStack() as stack:
+            connection = None
+            while True:
+                message = work.get()
+                if message is None:
+                    return
+                throttle.wait()
+                try:
+                    if connection is None:
+                        connection = stack.enter_context(self.mail.connect())
+                    connection.send(message)
+                    results.put(None)
+                except Exception as e:
+                    logger.warning("Announcement email to %s failed: %s", message.recipients, e)
+                    results.put(str(e))
+                    stack.close()
+                    connection = None
@@ -0,0 +1,227 @@
+"""
+Content-addressed storage for signatures and uploaded files.
+
+A blob is stored once under the SHA-256 of its bytes and referred to by a
+short reference, ``<sha256 hex>.<extension>`` (69 characters for a PNG), which
+is what database rows keep instead of the bytes themselves. Identical content
+is therefore stored once, and a reference never changes meaning, so blobs can
+be cached by browsers forever.
+
+The filesystem backend shards files two levels deep (``ab/cd/abcd...png``)
+so no directory grows too large, and writes each file to a temporary name
+before renaming it into place: a reader never sees a partial blob, and two
+workers storing the same content race harmlessly.
+
+Derived files, such as the rendered image of a signature, are stored next to
+their source as ``<sha256 hex>.<extension>.<suffix>`` and built on first use.
+
+Blobs are not deleted when the rows referring to them are; with deduplication
+another row may still use the same content.
+"""
+
+import abc
+import base64
+import binascii
+import hashlib
+import logging
+import mimetypes
+import os
+import re
+import tempfile
+from typing import IO, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+_REF = re.compile(r'^([0-9a-f]{64})\.([a-z0-9]{1,8})$')
+_SUFFIX = re.compile(r'^[a-z0-9]{1,8}$')
+_DATA_URL = re.compile(r'^data:([\w.+-]+/[\w.+-]+);base64,', re.IGNORECASE)
+
+# Content types accepted from clients, and the extension stored with them.
+# SVG is deliberately absent: it can carry script.
+CONTENT_TYPES = {
+    'image/png': 'png',
+    'image/jpeg': 'jpg',
+    'application/pdf': 'pdf',
+    'application/x-signature-strokes': 'sig',  # see utils/signature.py
+}
+
+
+class InvalidBlob(ValueError):
+    """Raised for data that cannot be stored (bad encoding, type or size)."""
+
+
+def is_ref(value) -> bool:
+    """True if ``value`` is a blob reference rather than inline data."""
+    return isinstance(value, str) and _REF.match(value) is not None
+
+
+def is_data_url(value) -> bool:
+    return isinstance(value, str) and _DATA_URL.match(value) is not None
+
+
+def content_type(ref: str) -> str:
+    extension = ref.rsplit('.', 1)[-1]
+    for known_type, known_extension in CONTENT_TYPES.items():
+        if known_extension == extension:
+            return known_type
+    return mimetypes.guess_type(f"blob.{extension}")[0] or 'application/octet-stream'
+
+
+class BlobBackend(abc.ABC):
+    """Interface shared by all blob backends."""
+
+    @abc.abstractmethod
+    def exists(self, digest: str, extension: str) -> bool:
+        """True if a blob is stored under ``digest``."""
+
+    @abc.abstractmethod
+    def write(self, digest: str, extension: str, data: bytes) -> None:
+        """Store ``data`` under ``digest``; must be atomic and idempotent."""
+
+    @abc.abstractmethod
+    def open(self, digest: str, extension: str) -> IO[bytes]:
+        """Open a stored blob for reading; raises FileNotFoundError if missing."""
+
+
+class FilesystemBackend(BlobBackend):
+    """Blobs as files under ``root``, sharded by the first four hex digits."""
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def path(self, digest: str, extension: str) -> str:
+        return os.path.join(self.root, digest[:2], digest[2:4], f"{digest}.{extension}")
+
+    def exists(self, digest: str, extension: str) -> bool:
+        return os.path.exists(self.path(digest, extension))
+
+    def write(self, digest: str, extension: str, data: bytes) -> None:
+        path = self.path(digest, extension)
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.chmod(tmp_path, 0o640)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def open(self, digest: str, extension: str) -> IO[bytes]:
+        return open(self.path(digest, extension), 'rb')
+
+
+class BlobStore:
+    """
+    Flask extension storing blobs by content hash.
+
+    Config:
+        BLOB_BACKEND: Storage backend (only 'filesystem' for now)
+        BLOB_DIR: Root directory of the filesystem backend
+        BLOB_MAX_BYTES: Largest blob accepted
+    """
+
+    def __init__(self, app=None):
+        self.backend = None
+        self.max_bytes = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app) -> None:
+        app.config.setdefault('BLOB_BACKEND', 'filesystem')
+        app.config.setdefault('BLOB_DIR', os.path.join(app.root_path, 'uploads'))
+        app.config.setdefault('BLOB_MAX_BYTES', 2 * 1024 * 1024)
+
+        backend = app.config['BLOB_BACKEND']
+        if backend == 'filesystem':
+            self.backend = FilesystemBackend(app.config['BLOB_DIR'])
+        else:
+            raise ValueError(f"Unknown BLOB_BACKEND: {backend}")
+        self.max_bytes = int(app.config['BLOB_MAX_BYTES'])
+        app.extensions['blob_store'] = self
+
+    def put(self, data: bytes, content_type: str) -> str:
+        """
+        Store ``data`` and return its reference.
+
+        Raises:
+            InvalidBlob: If the content type is not accepted or the data is too large
+        """
+        extension = CONTENT_TYPES.get(content_type.lower())
+        if extension is None:
+            raise InvalidBlob(f"Unsupported content type: {content_type}")
+        if len(data) > self.max_bytes:
+            raise InvalidBlob(f"Blob of {len(data)} bytes exceeds {self.max_bytes}")
+        digest = hashlib.sha256(data).hexdigest()
+        if not self.backend.exists(digest, extension):
+            self.backend.write(digest, extension, data)
+            logger.debug("Stored blob %s.%s (%d bytes)", digest, extension, len(data))
+        return f"{digest}.{extension}"
+
+    def put_data_url(self, value: str) -> str:
+        """Store the payload of a base64 ``data:`` URL (e.g. ``canvas.toDataURL()``)."""
+        match = _DATA_URL.match(value)
+        if match is None:
+            raise InvalidBlob("Not a base64 data URL")
+        try:
+            data = base64.b64decode(value[match.end():], validate=True)
+        except (binascii.Error, ValueError) as e:
+            raise InvalidBlob(f"Invalid base64 payload: {e}") from e
+        return self.put(data, match.group(1))
+
+    def store_inline(self, value: Optional[str]) -> Optional[str]:
+        """
+        Replace a submitted ``data:`` URL by a blob reference.
+
+        Empty values become None; anything else that is not a data URL (such
+        as a typed name) is returned unchanged.
+        """
+        if not value:
+            return None
+        return self.put_data_url(value) if is_data_url(value) else value
+
+    def open(self, ref: str) -> IO[bytes]:
+        """
+        Open the blob ``ref`` for reading.
+
+        Raises:
+            FileNotFoundError: If ``ref`` is malformed or not stored
+        """
+        match = _REF.match(ref or '')
+        if match is None:
+            raise FileNotFoundError(ref)
+        return self.backend.open(match.group(1), match.group(2))
+
+    def open_derived(self, ref: str, suffix: str, build: Callable[[bytes], bytes]) -> IO[bytes]:
+        """
+        Open a file derived from the blob ``ref``, building it on first use.
+
+        ``build`` receives the blob's bytes. It must be deterministic, since the
+        result is kept for good under ``<ref>.<suffix>``.
+
+        Raises:
+            FileNotFoundError: If ``ref`` is malformed or not stored
+        """
+        match = _REF.match(ref or '')
+        if match is None or not _SUFFIX.match(suffix):
+            raise FileNotFoundError(ref)
+        digest, extension = match.group(1), f"{match.group(2)}.{suffix}"
+        try:
+            return self.backend.open(digest, extension)
+        except FileNotFoundError:
+            self.backend.write(digest, extension, build(self.read(ref)))
+            logger.debug("Built %s.%s", digest, extension)
+            return self.backend.open(digest, extension)
+
+    def read(self, ref: str) -> bytes:
+        with self.open(ref) as f:
+            return f.read()
+
+    def data_url(self, ref: str) -> str:
+        """The blob ``ref`` as a base64 ``data:`` URL, the inverse of :meth:`put_data_url`."""
+        return f"data:{content_type(ref)};base64,{base64.b64encode(self.read(ref)).decode('ascii')}"
@@ -0,0 +1,134 @@
+"""
+Conditional GET for pages and APIs built from versioned data.
+
+A view decorated with :func:`conditional` names the data scopes it reads
+(see :mod:`utils.versioning`). Before the view runs, their versions are read
+with one primary-key query and hashed, together with everything else the
+response depends on, into a weak ETag:
+
+- the view and its full URL (filters, cursor, ids),
+- the signed-in user's id, email and admin flag, so one user's validator is
+  never valid for another,
+- the ``Accept`` header (views that return HTML or JSON),
+- the release: ``CONDITIONAL_GET_RELEASE``, or the template files' times.
+
+If the request's ``If-None-Match`` matches, or it has only
+``If-Modified-Since`` and no scope changed since, a 304 is returned without
+running the view. Otherwise the view's 200 response gets the ETag, a
+``Last-Modified`` from the scopes' ``updated_at``, and
+``Cache-Control: private, no-cache``, so browsers revalidate on every load.
+
+Apply it below ``@login_required`` / ``@admin_required``, so authorization
+runs first. Requests carrying flashed messages are never answered with a
+304, since the page would show them.
+"""
+
+import hashlib
+import os
+from datetime import datetime, timezone
+from functools import wraps
+from typing import Callable, Optional, Union
+
+from flask import current_app, make_response, request, session
+from flask_login import current_user
+from werkzeug.http import is_resource_modified
+from werkzeug.wrappers import Response
+
+from utils.versioning import request_stamps
+
+ScopeSpec = Union[str, Callable[..., str]]
+
+
+def _template_release(app) -> tuple:
+    """Fingerprint and time of the newest template, as a default release."""
+    digest = hashlib.blake2b(digest_size=8)
+    newest = 0
+    for folder, _, files in os.walk(os.path.join(app.root_path, app.template_folder)):
+        for name in sorted(files):
+            mtime = os.stat(os.path.join(folder, name)).st_mtime_ns
+            digest.update(f'{name}:{mtime};'.encode())
+            newest = max(newest, mtime)
+    return digest.hexdigest(), datetime.utcfromtimestamp(newest // 1_000_000_000)
+
+
+class ConditionalGet:
+    """
+    Flask extension holding the settings of :func:`conditional`.
+
+    Config:
+        CONDITIONAL_GET_ENABLED: Answer revalidations with 304 (default True)
+        CONDITIONAL_GET_RELEASE: Deployment id mixed into every ETag; by
+            default derived from the template files, so a deploy that changes
+            a template invalidates what browsers hold
+    """
+
+    def __init__(self, app=None):
+        self.enabled = True
+        self.release = ''
+        self.released_at: Optional[datetime] = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app) -> None:
+        app.config.setdefault('CONDITIONAL_GET_ENABLED', True)
+        app.config.setdefault('CONDITIONAL_GET_RELEASE', None)
+        self.enabled = bool(app.config['CONDITIONAL_GET_ENABLED'])
+        self.release, self.released_at = _template_release(app)
+        if app.config['CONDITIONAL_GET_RELEASE']:
+            self.release = str(app.config['CONDITIONAL_GET_RELEASE'])
+        app.extensions['conditional_get'] = self
+
+
+def _validators(extension: ConditionalGet, scopes, view_args):
+    names = sorted({scope(**view_args) if callable(scope) else scope for scope in scopes})
+    stamps = request_stamps(names)
+    user = (current_user.get_id(), current_user.email, current_user.is_admin) \
+        if current_user.is_authenticated else None
+    material = repr((extension.release, request.endpoint, request.full_path, user,
+                     request.headers.get('Accept', ''),
+                     [(name, stamps[name][0]) for name in names]))
+    etag = hashlib.blake2b(material.encode('utf-8'), digest_size=16).hexdigest()
+    times = [updated_at for _, updated_at in stamps.values()]
+    if None in times:
+        # A scope never written has no time, and then neither has the response
+        return etag, None
+    # HTTP dates have whole seconds; compare like with like
+    last_modified = max(times + [extension.released_at]).replace(microsecond=0, tzinfo=timezone.utc)
+    return etag, last_modified
+
+
+def _mark(response: Response, etag: str, last_modified: Optional[datetime]) -> Response:
+    response.set_etag(etag, weak=True)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.vary.add('Cookie')
+    return response
+
+
+def conditional(*scopes: ScopeSpec):
+    """
+    Answer GET requests with 304 while the given scopes are unchanged.
+
+    Args:
+        scopes: Scope names, or callables taking the view's arguments and
+            returning one (e.g. ``lambda user_id: user_forms(user_id)``)
+    """
+    def decorator(f):
+        @wraps(f)
+        def wrapped(*args, **kwargs):
+            extension = current_app.extensions.get('conditional_get')
+            if (extension is None or not extension.enabled
+                    or request.method not in ('GET', 'HEAD') or session.get('_flashes')):
+                return f(*args, **kwargs)
+
+            etag, last_modified = _validators(extension, scopes, kwargs)
+            if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+                return _mark(Response(status=304), etag, last_modified)
+
+            response = make_response(f(*args, **kwargs))
+            if response.status_code == 200:
+                _mark(response, etag, last_modified)
+            return response
+        return wrapped
+    return decorator
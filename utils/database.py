@@ -0,0 +1,149 @@
+"""
+Database selection and PostgreSQL fast paths.
+
+``DATABASE_URL`` picks the backend. Without it the app keeps using the SQLite
+file, as before. PostgreSQL gets a ``QueuePool`` sized per worker with
+pre-ping, so connections dropped by the server or a proxy are replaced
+instead of failing a request.
+
+The ``COPY`` helpers move many rows through a single statement instead of
+one ``INSERT``/fetch round trip per batch. They take a SQLAlchemy
+``Connection`` on PostgreSQL (psycopg2); callers check :func:`is_postgres`
+first.
+"""
+
+import csv
+import io
+import os
+from datetime import date, datetime
+from typing import IO, Iterable, Sequence
+
+DEFAULT_URL = 'sqlite:///church.db'
+
+
+def database_url(default: str = DEFAULT_URL) -> str:
+    """The SQLAlchemy URL from ``DATABASE_URL``, accepting the ``postgres://`` alias."""
+    url = os.getenv('DATABASE_URL') or default
+    if url.startswith('postgres://'):
+        url = 'postgresql://' + url[len('postgres://'):]
+    return url
+
+
+def engine_options(url: str) -> dict:
+    """
+    ``SQLALCHEMY_ENGINE_OPTIONS`` for ``url``.
+
+    Each gunicorn worker has its own pool, so PostgreSQL needs
+    ``max_connections`` of at least workers x (DB_POOL_SIZE + DB_MAX_OVERFLOW)
+    plus whatever else connects.
+    """
+    options = {
+        'pool_timeout': int(os.getenv('DB_POOL_TIMEOUT', 30)),
+        'pool_recycle': int(os.getenv('DB_POOL_RECYCLE', 1800)),
+    }
+    if url.startswith('postgresql'):
+        options.update({
+            # Request threads plus the outbox, announcement and export threads
+            'pool_size': int(os.getenv('DB_POOL_SIZE', 5)),
+            'max_overflow': int(os.getenv('DB_MAX_OVERFLOW', 5)),
+            'pool_pre_ping': True,
+            'pool_use_lifo': True,
+        })
+    return options
+
+
+def is_postgres(bind) -> bool:
+    """True when ``bind`` (an Engine or Connection) talks to PostgreSQL."""
+    return bind.dialect.name == 'postgresql'
+
+
+def _raw_cursor(connection):
+    return connection.connection.cursor()
+
+
+def copy_query_to(connection, stmt, fileobj: IO[bytes], header: bool = True) -> int:
+    """
+    Write the result of ``stmt`` to ``fileobj`` as CSV with ``COPY ... TO STDOUT``.
+
+    Parameters are bound by psycopg2 itself, since ``COPY`` does not take
+    them. Lines end in ``\\n``.
+
+    Returns:
+        int: Rows written
+    """
+    from psycopg2.extensions import encodings
+
+    compiled = stmt.compile(dialect=connection.dialect)
+    cursor = _raw_cursor(connection)
+    try:
+        encoding = encodings[connection.connection.encoding]
+        query = cursor.mogrify(str(compiled), compiled.params).decode(encoding)
+        options = 'FORMAT csv, HEADER' if header else 'FORMAT csv'
+        cursor.copy_expert(f'COPY ({query}) TO STDOUT WITH ({options})', fileobj)
+        return cursor.rowcount
+    finally:
+        cursor.close()
+
+
+def _copy_value(value):
+    if value is None:
+        return r'\N'
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return '\\x' + bytes(value).hex()
+    if isinstance(value, (datetime, date)):
+        return value.isoformat(sep=' ') if isinstance(value, datetime) else value.isoformat()
+    return value
+
+
+def copy_rows_into(connection, table, columns: Sequence[str], rows: Iterable[Sequence],
+                   batch_size: int = 10000) -> int:
+    """
+    Bulk-load ``rows`` into ``table`` with ``COPY ... FROM STDIN``.
+
+    Args:
+        connection: SQLAlchemy Connection to PostgreSQL
+        table: Table object the rows belong to
+        columns: Column names, in the order of each row's values
+        rows: Row value sequences
+        batch_size: Rows sent per ``COPY``
+
+    Returns:
+        int: Rows loaded
+    """
+    preparer = connection.dialect.identifier_preparer
+    target = f"{preparer.format_table(table)} ({', '.join(preparer.quote(c) for c in columns)})"
+    # An unquoted \N is NULL; an empty value stays an empty string
+    sql = f"COPY {target} FROM STDIN WITH (FORMAT csv, NULL '\\N')"
+    cursor = _raw_cursor(connection)
+    loaded = 0
+    try:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, lineterminator='\n')
+        pending = 0
+        for row in rows:
+            writer.writerow([_copy_value(value) for value in row])
+            pending += 1
+            if pending == batch_size:
+                buffer.seek(0)
+                cursor.copy_expert(sql, buffer)
+                loaded += pending
+                buffer.seek(0)
+                buffer.truncate()
+                pending = 0
+        if pending:
+            buffer.seek(0)
+            cursor.copy_expert(sql, buffer)
+            loaded += pending
+    finally:
+        cursor.close()
+    return loaded
+
+
+def reset_sequence(connection, table, column: str = 'id') -> None:
+    """Move the serial sequence of ``table.column`` past rows loaded with explicit ids."""
+    preparer = connection.dialect.identifier_preparer
+    name = preparer.format_table(table)
+    quoted = preparer.quote(column)
+    connection.exec_driver_sql(
+        f"SELECT setval(pg_get_serial_sequence('{name}', '{column}'), "
+        f"COALESCE(MAX({quoted}), 1), MAX({quoted}) IS NOT NULL) FROM {name}")
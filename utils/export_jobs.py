@@ -0,0 +1,240 @@
+"""
+Background export jobs.
+
+Large exports run on a small thread pool inside the worker instead of tying
+up the request (and tripping gunicorn's timeout). Job state lives in the
+``export_jobs`` table so any worker can answer status polls and downloads.
+
+Finished files are cached on disk under a key derived from the filter set,
+the format and the ``registrations`` data version. Asking for the same export
+again while the data is unchanged is answered from disk immediately.
+
+A running job records a heartbeat with its progress. A queued or running job
+whose heartbeat is older than ``EXPORT_STALE_AFTER`` belonged to a worker that
+died (or was restarted) mid-export; it is marked failed instead of being
+handed out as the in-flight job for its export.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+
+from sqlalchemy import func, or_, select, update
+
+from models import db, ExportJob
+from utils.database import is_postgres
+from utils.export import copy_csv_export, export_statement, generate_export, iter_export_rows
+from utils.versioning import REGISTRATIONS, current_version
+
+logger = logging.getLogger(__name__)
+
+PROGRESS_EVERY = 1000
+
+
+class ExportJobRunner:
+    """
+    Flask extension that owns the export thread pool and cache directory.
+
+    Config:
+        EXPORT_DIR: Directory for finished export files
+        EXPORT_WORKERS: Threads per gunicorn worker running exports
+        EXPORT_CACHE_MAX_AGE: Seconds a finished file is kept on disk
+        EXPORT_STALE_AFTER: Seconds without a heartbeat before a queued or
+            running job is considered abandoned and marked failed
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self._executor = None
+        self._executor_pid = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app) -> None:
+        app.config.setdefault('EXPORT_DIR', os.path.join(app.instance_path, 'exports'))
+        app.config.setdefault('EXPORT_WORKERS', 2)
+        app.config.setdefault('EXPORT_CACHE_MAX_AGE', 24 * 3600)
+        app.config.setdefault('EXPORT_STALE_AFTER', 600)
+        self.app = app
+        app.extensions['export_jobs'] = self
+
+    @property
+    def export_dir(self) -> str:
+        path = self.app.config['EXPORT_DIR']
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def _pool(self) -> ThreadPoolExecutor:
+        # Each gunicorn worker gets its own pool; threads do not survive fork
+        if self._executor_pid != os.getpid():
+            self._executor = ThreadPoolExecutor(
+                max_workers=int(self.app.config['EXPORT_WORKERS']),
+                thread_name_prefix='export-job')
+            self._executor_pid = os.getpid()
+        return self._executor
+
+    @staticmethod
+    def cache_key(filters: Dict[str, str], fmt: str, data_version: int) -> str:
+        payload = json.dumps({'filters': filters, 'format': fmt, 'version': data_version},
+                             sort_keys=True)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _cached_path(self, key: str, fmt: str) -> str:
+        return os.path.join(self.export_dir, f"{key}.{fmt}")
+
+    def start(self, filters: Dict[str, str], fmt: str, user_id: Optional[int] = None) -> ExportJob:
+        """
+        Start (or reuse) an export job for ``filters``.
+
+        Returns a finished job straight away if an identical export of the
+        current data is cached, or the in-flight job if one is already running.
+        """
+        key = self.cache_key(filters, fmt, current_version(REGISTRATIONS))
+        path = self._cached_path(key, fmt)
+
+        self._fail_stale(key)
+        running = (ExportJob.query
+                   .filter(ExportJob.cache_key == key,
+                           ExportJob.status.in_(('queued', 'running')))
+                   .first())
+        if running:
+            return running
+
+        job = ExportJob(id=uuid.uuid4().hex, user_id=user_id, format=fmt,
+                        filters=json.dumps(filters, sort_keys=True), cache_key=key,
+                        heartbeat_at=datetime.utcnow())
+        if os.path.exists(path):
+            job.status = 'done'
+            job.file_path = path
+            job.finished_at = datetime.utcnow()
+            db.session.add(job)
+            db.session.commit()
+            logger.info("Export %s served from cache", job.id)
+            return job
+
+        db.session.add(job)
+        db.session.commit()
+        self._prune_cache()
+        self._pool().submit(self._run, job.id)
+        return job
+
+    def _fail_stale(self, key: str) -> int:
+        """Mark queued or running jobs for ``key`` without a recent heartbeat as failed."""
+        table = ExportJob.__table__
+        now = datetime.utcnow()
+        stale = now - timedelta(seconds=float(self.app.config['EXPORT_STALE_AFTER']))
+        with db.engine.begin() as conn:
+            result = conn.execute(
+                update(table)
+                .where(table.c.cache_key == key,
+                       table.c.status.in_(('queued', 'running')),
+                       or_(table.c.heartbeat_at.is_(None), table.c.heartbeat_at < stale))
+                .values(status='failed', error='Export stopped responding', finished_at=now))
+        if result.rowcount:
+            logger.warning("Marked %s stale export job(s) failed", result.rowcount)
+        return result.rowcount
+
+    def _claim(self, job_id: str) -> bool:
+        """Atomically move a queued job to 'running'; False if it was failed as stale meanwhile."""
+        table = ExportJob.__table__
+        with db.engine.begin() as conn:
+            result = conn.execute(update(table)
+                                  .where(table.c.id == job_id, table.c.status == 'queued')
+                                  .values(status='running', heartbeat_at=datetime.utcnow()))
+        return result.rowcount == 1
+
+    def _run(self, job_id: str) -> None:
+        with self.app.app_context():
+            if not self._claim(job_id):
+                logger.info("Export %s is no longer queued; skipping", job_id)
+                return
+            job = db.session.get(ExportJob, job_id)
+            tmp_path = None
+            try:
+                filters = json.loads(job.filters)
+                count_stmt = select(func.count()).select_from(export_statement(filters).subquery())
+                job.total_rows = db.session.execute(count_stmt).scalar()
+                db.session.commit()
+
+                path = self._cached_path(job.cache_key, job.format)
+                tmp_path = f"{path}.{job_id}.tmp"
+                if job.format == 'csv' and is_postgres(db.engine):
+                    # One COPY; progress jumps straight to the total and there is
+                    # no heartbeat until it ends, so EXPORT_STALE_AFTER must
+                    # exceed the longest COPY
+                    with open(tmp_path, 'wb') as f:
+                        copy_csv_export(filters, f)
+                else:
+                    with open(tmp_path, 'w', newline='', encoding='utf-8') as f:
+                        rows = self._track_progress(job_id, iter_export_rows(filters))
+                        for chunk in generate_export(rows, job.format):
+                            f.write(chunk)
+                os.replace(tmp_path, path)
+
+                job = db.session.get(ExportJob, job_id)
+                job.status = 'done'
+                job.rows_processed = job.total_rows
+                job.file_path = path
+                job.finished_at = datetime.utcnow()
+                db.session.commit()
+                logger.info("Export %s finished (%s rows)", job_id, job.total_rows)
+            except Exception as e:
+                logger.exception("Export %s failed", job_id)
+                db.session.rollback()
+                job = db.session.get(ExportJob, job_id)
+                job.status = 'failed'
+                job.error = str(e)
+                job.finished_at = datetime.utcnow()
+                db.session.commit()
+                if tmp_path and os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+
+    def _track_progress(self, job_id: str, rows):
+        """
+        Pass rows through, recording progress and a heartbeat every ``PROGRESS_EVERY`` rows.
+
+        The update runs on a connection of its own: the session's connection is
+        still reading the export, and under WAL (see utils/sqlite_profile.py)
+        that read does not block the write.
+        """
+        table = ExportJob.__table__
+        processed = 0
+        for row in rows:
+            yield row
+            processed += 1
+            if processed % PROGRESS_EVERY == 0:
+                with db.engine.begin() as conn:
+                    conn.execute(update(table)
+                                 .where(table.c.id == job_id)
+                                 .values(rows_processed=processed, heartbeat_at=datetime.utcnow()))
+
+    def _prune_cache(self) -> None:
+        """Delete cached export files older than ``EXPORT_CACHE_MAX_AGE``."""
+        cutoff = time.time() - float(self.app.config['EXPORT_CACHE_MAX_AGE'])
+        for name in os.listdir(self.export_dir):
+            path = os.path.join(self.export_dir, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+            except OSError:
+                pass
+
+
+def serialize_job(job: ExportJob) -> Dict:
+    return {
+        'id': job.id,
+        'status': job.status,
+        'format': job.format,
+        'filters': json.loads(job.filters),
+        'rows_processed': job.rows_processed,
+        'total_rows': job.total_rows,
+        'error': job.error,
+        'created_at': job.created_at.isoformat() if job.created_at else None,
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+    }
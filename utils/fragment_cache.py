@@ -0,0 +1,141 @@
+"""
+Per-process cache of rendered HTML fragments.
+
+A fragment (a table body, a parent's list of registrations) is cached under a
+name and key together with the versions of the data scopes it was built from
+(see :mod:`utils.versioning`). A lookup reads the current versions, one
+primary-key query for all the scopes a request needs, and serves the cached
+fragment only if none of them has moved. Any committed write to a scope's
+tables bumps its version, so fragments are never served stale, in any
+worker, and need no expiry.
+
+Entries are kept in LRU order within a byte budget
+(``FRAGMENT_CACHE_MAX_BYTES``) per worker; hits, misses, stale entries and
+evictions are counted for ``/health/fragment-cache``.
+"""
+
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, Tuple
+
+from flask import g, has_app_context
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from utils.versioning import request_stamps
+
+_ENTRY_OVERHEAD = 200  # bytes of bookkeeping counted per entry
+
+
+def _size(value) -> int:
+    """Approximate memory held by a cached value: its strings plus a little per entry."""
+    if isinstance(value, str):
+        return len(value)
+    if isinstance(value, (tuple, list)):
+        return sum(_size(item) for item in value) + 8 * len(value)
+    return 64
+
+
+class FragmentCache:
+    """
+    Flask extension caching rendered fragments per worker.
+
+    Config:
+        FRAGMENT_CACHE_ENABLED: Cache fragments (default True); when off,
+            every fragment is built on each request
+        FRAGMENT_CACHE_MAX_BYTES: Memory budget of the cache in each worker
+    """
+
+    def __init__(self, app=None):
+        self.enabled = True
+        self.max_bytes = 0
+        self._entries = OrderedDict()  # (name, key) -> (stamp, value, size)
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.evictions = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app) -> None:
+        app.config.setdefault('FRAGMENT_CACHE_ENABLED', True)
+        app.config.setdefault('FRAGMENT_CACHE_MAX_BYTES', 16 * 1024 * 1024)
+        self.enabled = bool(app.config['FRAGMENT_CACHE_ENABLED'])
+        self.max_bytes = int(app.config['FRAGMENT_CACHE_MAX_BYTES'])
+        app.extensions['fragment_cache'] = self
+
+        @event.listens_for(Session, 'after_flush')
+        def _note_write(session, flush_context):
+            # Fragments built from uncommitted data must not be kept: if the
+            # transaction rolled back, a later write would reuse their versions
+            if has_app_context():
+                g._fragment_no_store = True
+
+    def _stamp(self, scopes: Iterable[str]) -> Tuple:
+        """Current versions of ``scopes``, read at most once per request."""
+        stamps = request_stamps(scopes)
+        return tuple(sorted((scope, version) for scope, (version, _) in stamps.items()))
+
+    def get_or_build(self, name: str, scopes: Iterable[str], key: Any,
+                     build: Callable[[], Any]) -> Any:
+        """
+        Return the cached fragment ``name``/``key``, building it on a miss.
+
+        Args:
+            name: Fragment name, e.g. the template it renders
+            scopes: Data scopes the fragment is built from
+            key: Anything else it depends on (filters, user id); must be hashable
+            build: Renders the fragment; it should run the fragment's queries
+                itself, so a hit skips them
+        """
+        if not self.enabled:
+            return build()
+        scopes = list(scopes)
+        stamp = self._stamp(scopes)
+        cache_key = (name, key)
+        with self._lock:
+            entry = self._entries.get(cache_key)
+            if entry is not None:
+                if entry[0] == stamp:
+                    self._entries.move_to_end(cache_key)
+                    self.hits += 1
+                    return entry[1]
+                self._remove(cache_key)
+                self.stale += 1
+            self.misses += 1
+
+        value = build()
+        size = _size(value) + _size(key) + _ENTRY_OVERHEAD
+        if size > self.max_bytes or g.get('_fragment_no_store'):
+            return value
+        with self._lock:
+            if cache_key in self._entries:
+                self._remove(cache_key)
+            self._entries[cache_key] = (stamp, value, size)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+        return value
+
+    def _remove(self, cache_key) -> None:
+        _, _, size = self._entries.pop(cache_key)
+        self.bytes -= size
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'stale': self.stale,
+            'evictions': self.evictions,
+            'entries': len(self._entries),
+            'bytes': self.bytes,
+            'max_bytes': self.max_bytes,
+        }
@@ -0,0 +1,174 @@
+"""
+Non-blocking, structured logging.
+
+Loggers only put records on an in-memory queue. A ``QueueListener`` thread
+formats them and writes them to a log file and/or stderr, so request
+threads never wait on disk I/O for logging.
+
+Every gunicorn worker appends to the same file, so none of them rotates it:
+rotation is left to logrotate (``install.sh`` sets it up), and each worker
+reopens the file once logrotate has renamed it. Set ``LOG_FILE`` to an empty
+value to log to stderr only, e.g. under systemd or Docker.
+
+Everything is configured from the environment:
+
+    LOG_LEVEL           Root level (default INFO)
+    LOG_LEVELS          Per-logger levels, e.g.
+                        ``sqlalchemy.engine=WARNING,utils.outbox=DEBUG``
+    LOG_FORMAT          ``json`` (JSON lines, default) or ``text``
+    LOG_FILE            Log file path (default ``logs/app.log``); empty for
+                        no file
+    LOG_DEBUG_SAMPLE    Fraction of DEBUG records kept (default 1.0)
+    LOG_STDERR          Also log to stderr when true (default true); always
+                        on without a file
+"""
+
+import atexit
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+from datetime import datetime, timezone
+from typing import Dict
+
+# Attributes every LogRecord has; anything else came from ``extra=``
+_RECORD_ATTRS = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime'}
+
+TEXT_FORMAT = '%(asctime)s %(levelname)s %(name)s: %(message)s [in %(pathname)s:%(lineno)d]'
+
+_listener = None
+
+
+def _env_bool(name: str, default: bool) -> bool:
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+def parse_levels(spec: str) -> Dict[str, int]:
+    """Parse ``name=LEVEL,name=LEVEL`` into ``{name: level}``."""
+    levels = {}
+    for item in filter(None, (part.strip() for part in spec.split(','))):
+        name, _, level = item.partition('=')
+        levels[name.strip()] = logging.getLevelName(level.strip().upper())
+    return levels
+
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per line."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        payload = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'module': record.module,
+            'line': record.lineno,
+            'process': record.process,
+            'thread': record.threadName,
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and not key.startswith('_'):
+                payload[key] = value
+        if record.exc_text:
+            payload['exc'] = record.exc_text
+        if record.stack_info:
+            payload['stack'] = record.stack_info
+        return json.dumps(payload, default=str)
+
+
+class DebugSampler(logging.Filter):
+    """Keep only a fraction of DEBUG (and lower) records."""
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.DEBUG or self.rate >= 1:
+            return True
+        return random.random() < self.rate
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """
+    Queue handler that merges ``msg % args`` but leaves all other formatting
+    (timestamps, JSON, tracebacks) to the listener thread.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            # Traceback objects cannot be used safely from another thread later
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def _file_handler(path: str) -> logging.Handler:
+    # Rotating in-process would have each worker rename the shared file under
+    # the others; WatchedFileHandler just reopens it after logrotate moved it
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    return logging.handlers.WatchedFileHandler(path, encoding='utf-8')
+
+
+def configure_logging(default_file: str) -> logging.handlers.QueueListener:
+    """
+    Route all logging through a queue drained by a background listener.
+
+    Args:
+        default_file: Log file used when ``LOG_FILE`` is not set
+
+    Returns:
+        QueueListener: The running listener
+    """
+    global _listener
+    if _listener is not None:
+        return _listener
+
+    formatter = JSONFormatter() if os.getenv('LOG_FORMAT', 'json') == 'json' \
+        else logging.Formatter(TEXT_FORMAT)
+    path = os.getenv('LOG_FILE', default_file)
+    handlers = [_file_handler(path)] if path else []
+    if _env_bool('LOG_STDERR', True) or not handlers:
+        handlers.append(logging.StreamHandler())
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = _QueueHandler(log_queue)
+    queue_handler.addFilter(DebugSampler(float(os.getenv('LOG_DEBUG_SAMPLE', 1.0))))
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(os.getenv('LOG_LEVEL', 'INFO').upper())
+    for name, level in parse_levels(os.getenv('LOG_LEVELS', '')).items():
+        logging.getLogger(name).setLevel(level)
+
+    _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_stop_listener)
+    # The listener thread does not survive fork (gunicorn --preload)
+    os.register_at_fork(after_in_child=_restart_listener)
+    return _listener
+
+
+def _stop_listener() -> None:
+    """Flush queued records; safe to call more than once."""
+    if _listener is not None and _listener._thread is not None:
+        _listener.stop()
+
+
+def _restart_listener() -> None:
+    if _listener is not None:
+        _listener._thread = None
+        _listener.start()
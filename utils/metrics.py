@@ -0,0 +1,310 @@
+"""
+Request instrumentation exposed in Prometheus text format.
+
+Each worker process accumulates its metrics in memory: per-endpoint latency
+histograms, request counts by status, response bytes, and the number of SQL
+statements and time spent in the database per endpoint (from SQLAlchemy
+engine events). Recording a request is a handful of dict updates under a
+lock, so the hot path never touches the disk.
+
+A daemon thread in each worker writes a snapshot of its metrics to
+``METRICS_DIR/worker-<pid>.json`` once per ``METRICS_FLUSH_INTERVAL`` when
+something changed. Every worker owns its file, so no cross-process locking is
+needed. ``render()`` sums the snapshots of all workers. Counters of workers
+that have exited are kept, folded into ``retired.json`` by the gunicorn
+master, so totals never go backwards. The in-flight gauge only counts live
+workers.
+"""
+
+import bisect
+import glob
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, List
+
+from flask import request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _labels(**labels) -> str:
+    return ','.join(f'{name}="{str(value)}"' for name, value in labels.items())
+
+
+class Metrics:
+    """
+    Flask extension recording request metrics.
+
+    Config:
+        METRICS_ENABLED: Instrument requests (default True)
+        METRICS_DIR: Directory shared by all workers for metric snapshots
+        METRICS_FLUSH_INTERVAL: Seconds between snapshot writes
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.directory = None
+        self._lock = threading.Lock()
+        self._local = threading.local()  # start time and SQL totals of the current request
+        self._flusher_pid = None
+        self._flusher_lock = threading.Lock()
+        self._reset()
+        if app is not None:
+            self.init_app(app)
+
+    def _reset(self) -> None:
+        self._requests = defaultdict(int)      # (endpoint, method, status) -> count
+        self._latency = {}                     # (endpoint, method) -> [bucket counts..., sum]
+        self._bytes = defaultdict(int)         # endpoint -> response bytes
+        self._db_queries = defaultdict(int)    # endpoint -> statements
+        self._db_seconds = defaultdict(float)  # endpoint -> seconds
+        self._in_flight = 0
+        self._dirty = False
+
+    def init_app(self, app) -> None:
+        app.config.setdefault('METRICS_ENABLED', True)
+        app.config.setdefault('METRICS_DIR', os.path.join(app.instance_path, 'metrics'))
+        app.config.setdefault('METRICS_FLUSH_INTERVAL', 1.0)
+        self.app = app
+        self.directory = app.config['METRICS_DIR']
+        app.extensions['metrics'] = self
+        if not app.config['METRICS_ENABLED']:
+            return
+
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+        event.listen(Engine, 'before_cursor_execute', self._before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', self._after_cursor_execute)
+
+    # Request hooks
+
+    def _before_request(self) -> None:
+        if self._flusher_pid != os.getpid():
+            self._start_flusher()
+        local = self._local
+        local.queries = 0
+        local.seconds = 0.0
+        local.start = time.perf_counter()
+        with self._lock:
+            self._in_flight += 1
+
+    def _after_request(self, response):
+        start = getattr(self._local, 'start', None)
+        if start is not None:
+            # The header rather than response.content_length: this runs on every request
+            length = response.headers.get('Content-Length')
+            self._record(time.perf_counter() - start, response.status_code,
+                         int(length) if length else 0)
+        return response
+
+    def _teardown_request(self, exc) -> None:
+        # after_request does not run when a view raises; count it as a 500
+        if getattr(self._local, 'start', None) is not None:
+            self._record(time.perf_counter() - self._local.start, 500, 0)
+
+    def _record(self, elapsed: float, status: int, length: int) -> None:
+        local = self._local
+        local.start = None
+        req = request._get_current_object()
+        endpoint = req.endpoint or 'unmatched'
+        key = (endpoint, req.method)
+        index = bisect.bisect_left(BUCKETS, elapsed)
+        with self._lock:
+            self._in_flight -= 1
+            self._requests[key + (status,)] += 1
+            histogram = self._latency.get(key)
+            if histogram is None:
+                histogram = self._latency[key] = [0] * (len(BUCKETS) + 2)
+            histogram[index] += 1
+            histogram[-1] += elapsed
+            if length:
+                self._bytes[endpoint] += length
+            if local.queries:
+                self._db_queries[endpoint] += local.queries
+                self._db_seconds[endpoint] += local.seconds
+            self._dirty = True
+
+    # SQLAlchemy engine events
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if context is not None:
+            context._metrics_start = time.perf_counter()
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        local = self._local
+        if getattr(local, 'start', None) is not None and context is not None:
+            local.queries += 1
+            local.seconds += time.perf_counter() - context._metrics_start
+
+    # Snapshots
+
+    def _start_flusher(self) -> None:
+        with self._flusher_lock:
+            if self._flusher_pid == os.getpid():
+                return
+            if self._flusher_pid is not None:
+                # Forked from a process that already served requests
+                with self._lock:
+                    self._reset()
+            os.makedirs(self.directory, exist_ok=True)
+            threading.Thread(target=self._flush_forever, name='metrics-flusher',
+                             daemon=True).start()
+            self._flusher_pid = os.getpid()
+
+    def _flush_forever(self) -> None:
+        interval = float(self.app.config['METRICS_FLUSH_INTERVAL'])
+        while True:
+            time.sleep(interval)
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Writing metrics snapshot failed")
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            self._dirty = False
+            return {
+                'pid': os.getpid(),
+                'in_flight': self._in_flight,
+                'requests': [[*key, count] for key, count in self._requests.items()],
+                'latency': [[*key, list(values)] for key, values in self._latency.items()],
+                'bytes': dict(self._bytes),
+                'db_queries': dict(self._db_queries),
+                'db_seconds': dict(self._db_seconds),
+            }
+
+    def flush(self, force: bool = False) -> None:
+        """Write this worker's snapshot if anything changed since the last one."""
+        if not (self._dirty or force):
+            return
+        path = os.path.join(self.directory, f'worker-{os.getpid()}.json')
+        with open(f'{path}.tmp', 'w') as f:
+            json.dump(self.snapshot(), f)
+        os.replace(f'{path}.tmp', path)
+
+    def render(self) -> str:
+        """All workers' metrics in the Prometheus text exposition format."""
+        self.flush(force=True)
+        return render(merge(_load_snapshots(self.directory)))
+
+
+def _load_snapshots(directory: str) -> List[Dict]:
+    snapshots = []
+    for path in glob.glob(os.path.join(directory, '*.json')):
+        try:
+            with open(path) as f:
+                snapshots.append(json.load(f))
+        except (OSError, ValueError):
+            continue
+    return snapshots
+
+
+def merge(snapshots: List[Dict]) -> Dict:
+    """Sum worker snapshots into one; in-flight requests of exited workers are dropped."""
+    requests = defaultdict(int)
+    latency = {}
+    totals = {'bytes': defaultdict(int), 'db_queries': defaultdict(int),
+              'db_seconds': defaultdict(float)}
+    in_flight = 0
+    for snap in snapshots:
+        if snap['pid'] and _pid_alive(snap['pid']):
+            in_flight += snap['in_flight']
+        for endpoint, method, status, count in snap['requests']:
+            requests[(endpoint, method, status)] += count
+        for endpoint, method, values in snap['latency']:
+            merged = latency.setdefault((endpoint, method), [0] * len(values))
+            for i, value in enumerate(values):
+                merged[i] += value
+        for name, total in totals.items():
+            for endpoint, value in snap[name].items():
+                total[endpoint] += value
+    return {
+        'pid': None,
+        'in_flight': in_flight,
+        'requests': [[*key, count] for key, count in sorted(requests.items())],
+        'latency': [[*key, values] for key, values in sorted(latency.items())],
+        **{name: dict(sorted(total.items())) for name, total in totals.items()},
+    }
+
+
+def retire_worker(directory: str, pid: int) -> None:
+    """
+    Fold an exited worker's snapshot into ``retired.json``.
+
+    Called from the gunicorn master (see gunicorn.conf.py) so recycled
+    workers do not leave one file each behind.
+    """
+    path = os.path.join(directory, f'worker-{pid}.json')
+    retired = os.path.join(directory, 'retired.json')
+    snapshots = []
+    for source in (retired, path):
+        try:
+            with open(source) as f:
+                snapshots.append(json.load(f))
+        except (OSError, ValueError):
+            continue
+    if not snapshots:
+        return
+    with open(f'{retired}.tmp', 'w') as f:
+        json.dump(merge(snapshots), f)
+    os.replace(f'{retired}.tmp', retired)
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def render(merged: Dict) -> str:
+    lines = [
+        '# HELP http_requests_total Requests handled, by endpoint, method and status.',
+        '# TYPE http_requests_total counter',
+    ]
+    for endpoint, method, status, count in merged['requests']:
+        lines.append(f'http_requests_total{{{_labels(endpoint=endpoint, method=method, status=status)}}} {count}')
+
+    lines += [
+        '# HELP http_request_duration_seconds Request latency, by endpoint and method.',
+        '# TYPE http_request_duration_seconds histogram',
+    ]
+    for endpoint, method, values in merged['latency']:
+        labels = _labels(endpoint=endpoint, method=method)
+        cumulative = 0
+        for bound, count in zip(BUCKETS + ('+Inf',), values[:-1]):
+            cumulative += count
+            lines.append(f'http_request_duration_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f'http_request_duration_seconds_sum{{{labels}}} {values[-1]}')
+        lines.append(f'http_request_duration_seconds_count{{{labels}}} {cumulative}')
+
+    for name, key, help_text in (
+            ('http_response_bytes_total', 'bytes', 'Response body bytes, by endpoint.'),
+            ('http_db_queries_total', 'db_queries', 'SQL statements executed, by endpoint.'),
+            ('http_db_seconds_total', 'db_seconds', 'Time spent executing SQL, by endpoint.')):
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} counter']
+        for endpoint, value in merged[key].items():
+            lines.append(f'{name}{{{_labels(endpoint=endpoint)}}} {value}')
+
+    lines += [
+        '# HELP http_requests_in_flight Requests currently being handled.',
+        '# TYPE http_requests_in_flight gauge',
+        f'http_requests_in_flight {merged["in_flight"]}',
+    ]
+    return '\n'.join(lines) + '\n'
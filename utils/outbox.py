@@ -0,0 +1,217 @@
+"""
+Transactional email outbox.
+
+Views never talk to the SMTP server. They call :meth:`Outbox.enqueue`, which
+adds an ``OutboxMessage`` row to the current session so that the email is
+committed (or rolled back) together with the data it describes. A background
+dispatcher thread in each worker claims pending rows in batches, sends them
+over one SMTP connection that stays open while there is work, and records the
+delivery status. Failed sends are retried with exponential backoff.
+
+Claims are a single ``UPDATE ... RETURNING`` so several gunicorn workers can
+run dispatchers against the same table without sending a message twice.
+"""
+
+import contextlib
+import logging
+import os
+import threading
+from datetime import datetime, timedelta
+from typing import Iterable, List, Optional, Union
+
+from flask_mail import Message
+from sqlalchemy import bindparam, event, select, update
+from sqlalchemy.orm import Session
+
+from models import db, OutboxMessage
+
+logger = logging.getLogger(__name__)
+
+_SESSION_FLAG = 'outbox_enqueued'
+
+
+class Outbox:
+    """
+    Flask extension owning the outbox dispatcher.
+
+    Config:
+        OUTBOX_ENABLED: Start a dispatcher thread in each worker (default True)
+        OUTBOX_BATCH_SIZE: Messages claimed per batch
+        OUTBOX_POLL_INTERVAL: Seconds between checks for new or retryable mail
+        OUTBOX_MAX_ATTEMPTS: Attempts before a message is marked failed
+        OUTBOX_RETRY_BASE: Seconds before the first retry; doubles per attempt
+        OUTBOX_RETRY_MAX: Upper bound on the retry delay
+        OUTBOX_CLAIM_TIMEOUT: Seconds after which an unfinished claim is released
+    """
+
+    def __init__(self, app=None, mail=None):
+        self.app = None
+        self.mail = None
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._thread_pid = None
+        self._start_lock = threading.Lock()
+        if app is not None:
+            self.init_app(app, mail)
+
+    def init_app(self, app, mail) -> None:
+        app.config.setdefault('OUTBOX_ENABLED', True)
+        app.config.setdefault('OUTBOX_BATCH_SIZE', 50)
+        app.config.setdefault('OUTBOX_POLL_INTERVAL', 5)
+        app.config.setdefault('OUTBOX_MAX_ATTEMPTS', 6)
+        app.config.setdefault('OUTBOX_RETRY_BASE', 30)
+        app.config.setdefault('OUTBOX_RETRY_MAX', 3600)
+        app.config.setdefault('OUTBOX_CLAIM_TIMEOUT', 600)
+        self.app = app
+        self.mail = mail
+        app.extensions['outbox'] = self
+
+        if app.config['OUTBOX_ENABLED']:
+            app.before_request(self._ensure_dispatcher)
+
+        @event.listens_for(Session, 'after_commit')
+        def _wake_after_commit(session):
+            if session.info.pop(_SESSION_FLAG, False):
+                self._wakeup.set()
+
+    def enqueue(self, subject: str, recipients: Union[str, Iterable[str]],
+                html: Optional[str] = None, body: Optional[str] = None,
+                sender: Optional[str] = None, session=None) -> OutboxMessage:
+        """
+        Queue an email in the current transaction. The caller commits.
+
+        Returns:
+            OutboxMessage: The pending (not yet flushed) row
+        """
+        session = session or db.session
+        if isinstance(recipients, str):
+            recipients = [recipients]
+        message = OutboxMessage(subject=subject, recipients=','.join(recipients),
+                                html=html, body=body, sender=sender,
+                                next_attempt_at=datetime.utcnow())
+        session.add(message)
+        session.info[_SESSION_FLAG] = True
+        return message
+
+    # Dispatcher
+
+    def _ensure_dispatcher(self) -> None:
+        if self._thread_pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._thread_pid == os.getpid():
+                return
+            self._thread = threading.Thread(target=self._run, name='outbox-dispatcher', daemon=True)
+            self._thread.start()
+            self._thread_pid = os.getpid()
+
+    def _run(self) -> None:
+        interval = float(self.app.config['OUTBOX_POLL_INTERVAL'])
+        while True:
+            self._wakeup.wait(interval)
+            self._wakeup.clear()
+            try:
+                with self.app.app_context():
+                    self.release_stale_claims()
+                    self.drain()
+            except Exception:
+                logger.exception("Outbox dispatcher iteration failed")
+
+    def release_stale_claims(self) -> int:
+        """Return messages claimed by a worker that died mid-send to the queue."""
+        table = OutboxMessage.__table__
+        cutoff = datetime.utcnow() - timedelta(seconds=float(self.app.config['OUTBOX_CLAIM_TIMEOUT']))
+        with db.engine.begin() as conn:
+            result = conn.execute(update(table)
+                                  .where(table.c.status == 'sending', table.c.claimed_at < cutoff)
+                                  .values(status='pending', claimed_at=None))
+        return result.rowcount
+
+    def claim_batch(self) -> List:
+        """Atomically mark up to ``OUTBOX_BATCH_SIZE`` due messages as sending."""
+        table = OutboxMessage.__table__
+        now = datetime.utcnow()
+        due = (select(table.c.id)
+               .where(table.c.status == 'pending', table.c.next_attempt_at <= now)
+               .order_by(table.c.next_attempt_at, table.c.id)
+               .limit(int(self.app.config['OUTBOX_BATCH_SIZE'])))
+        with db.engine.begin() as conn:
+            rows = conn.execute(update(table)
+                                .where(table.c.id.in_(due.scalar_subquery()),
+                                       table.c.status == 'pending')
+                                .values(status='sending', claimed_at=now)
+                                .returning(*table.c)).all()
+        return sorted(rows, key=lambda row: row.id)
+
+    def drain(self) -> int:
+        """
+        Send batches until nothing is due, reusing one SMTP connection.
+
+        Returns:
+            int: Number of messages sent
+        """
+        sent_total = 0
+        with contextlib.ExitStack() as stack:
+            connection = None
+            while True:
+                batch = self.claim_batch()
+                if not batch:
+                    break
+                sent, failed = [], []
+                for row in batch:
+                    try:
+                        if connection is None:
+                            connection = stack.enter_context(self.mail.connect())
+                        connection.send(self._build_message(row))
+                        sent.append(row)
+                    except Exception as e:
+                        logger.warning("Sending outbox message %s failed: %s", row.id, e)
+                        failed.append((row, str(e)))
+                        # The connection may be unusable now; open a fresh one next time
+                        stack.close()
+                        connection = None
+                self._record(sent, failed)
+                sent_total += len(sent)
+        if sent_total:
+            logger.info("Outbox sent %d messages", sent_total)
+        return sent_total
+
+    @staticmethod
+    def _build_message(row) -> Message:
+        return Message(subject=row.subject, recipients=row.recipients.split(','),
+                       html=row.html, body=row.body, sender=row.sender)
+
+    def _retry_delay(self, attempts: int) -> timedelta:
+        base = float(self.app.config['OUTBOX_RETRY_BASE'])
+        return timedelta(seconds=min(base * 2 ** (attempts - 1),
+                                     float(self.app.config['OUTBOX_RETRY_MAX'])))
+
+    def _record(self, sent, failed) -> None:
+        """Write the outcome of one batch in a single transaction."""
+        table = OutboxMessage.__table__
+        now = datetime.utcnow()
+        max_attempts = int(self.app.config['OUTBOX_MAX_ATTEMPTS'])
+        with db.engine.begin() as conn:
+            if sent:
+                conn.execute(
+                    update(table).where(table.c.id == bindparam('row_id'))
+                    .values(status='sent', sent_at=now, claimed_at=None,
+                            attempts=table.c.attempts + 1, last_error=None),
+                    [{'row_id': row.id} for row in sent])
+            if failed:
+                params = []
+                for row, error in failed:
+                    attempts = row.attempts + 1
+                    params.append({
+                        'row_id': row.id,
+                        'new_status': 'failed' if attempts >= max_attempts else 'pending',
+                        'new_attempts': attempts,
+                        'retry_at': now + self._retry_delay(attempts),
+                        'error': error,
+                    })
+                conn.execute(
+                    update(table).where(table.c.id == bindparam('row_id'))
+                    .values(status=bindparam('new_status'), attempts=bindparam('new_attempts'),
+                            next_attempt_at=bindparam('retry_at'), last_error=bindparam('error'),
+                            claimed_at=None),
+                    params)
@@ -0,0 +1,249 @@
+"""
+Opt-in SQL profiler: slow-query log and N+1 detector.
+
+Hooks ``before_cursor_execute``/``after_cursor_execute`` on every engine and,
+during a request, groups statements by their normalized shape (literals and
+``IN`` lists collapsed). At the end of the request:
+
+- a shape executed ``QUERY_PROFILER_N_PLUS_ONE`` times or more is logged as a
+  probable N+1 (usually a lazy relationship touched inside a loop);
+- a view decorated with :func:`query_budget` (or any view, with
+  ``QUERY_PROFILER_BUDGET``) that ran more statements than its budget is
+  logged. When ``QUERY_PROFILER_RAISE`` is set (the default under
+  ``TESTING``), :class:`QueryBudgetExceeded` is raised instead, which fails
+  the test that made the request.
+
+Any statement slower than ``QUERY_PROFILER_SLOW_MS`` is logged together with
+its query plan, inside requests and background threads alike.
+
+Each worker keeps a rolling summary of what it saw for the admin diagnostics
+page. The profiler is off unless ``QUERY_PROFILER_ENABLED`` is set, in which
+case nothing is hooked at all.
+"""
+
+import logging
+import re
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from flask import current_app, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+_IN_LIST = re.compile(r'\bIN\s*\((?:\s*\?\s*,)*\s*\?\s*\)', re.IGNORECASE)
+_POSTCOMPILE = re.compile(r'\(?__\[POSTCOMPILE_\w+\]\)?')
+_PARAM = re.compile(r'%\(\w+\)s|%s|:\w+')
+_SPACE = re.compile(r'\s+')
+
+
+class QueryBudgetExceeded(AssertionError):
+    """A view ran more SQL statements than its budget allows."""
+
+
+def normalize(statement: str) -> str:
+    """Reduce a statement to its shape: parameters, literals and IN lists become ``?``."""
+    shape = _SPACE.sub(' ', statement).strip()
+    shape = _STRING.sub('?', shape)
+    shape = _PARAM.sub('?', shape)
+    shape = _POSTCOMPILE.sub('(?)', shape)
+    shape = _NUMBER.sub('?', shape)
+    return _IN_LIST.sub('IN (?)', shape)
+
+
+def query_budget(max_queries: int):
+    """
+    Declare how many SQL statements a view may run per request.
+
+    Apply below ``@route``; the limit is read from the registered view, so it
+    survives decorators that use ``functools.wraps``.
+    """
+    def decorator(f):
+        f.query_budget = max_queries
+        return f
+    return decorator
+
+
+class _RequestProfile:
+    __slots__ = ('shapes', 'count', 'seconds')
+
+    def __init__(self):
+        self.shapes: Dict[str, List] = {}  # shape -> [count, seconds]
+        self.count = 0
+        self.seconds = 0.0
+
+
+class QueryProfiler:
+    """
+    Flask extension profiling SQL per request.
+
+    Config:
+        QUERY_PROFILER_ENABLED: Hook the engine events (default False)
+        QUERY_PROFILER_SLOW_MS: Latency budget per statement in milliseconds
+        QUERY_PROFILER_N_PLUS_ONE: Executions of one shape per request that
+            are reported as N+1
+        QUERY_PROFILER_BUDGET: Default statement budget for views without
+            ``@query_budget`` (None for no limit)
+        QUERY_PROFILER_RAISE: Raise QueryBudgetExceeded instead of logging
+            (default None: raise when the app is TESTING)
+        QUERY_PROFILER_EXPLAIN: Log the query plan of slow SELECTs
+        QUERY_PROFILER_HISTORY: Slow queries and N+1 findings kept per worker
+    """
+
+    def __init__(self, app=None):
+        self.enabled = False
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.slow_queries = deque()
+        self.n_plus_one = deque()
+        self.endpoints: Dict[str, Dict] = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app) -> None:
+        app.config.setdefault('QUERY_PROFILER_ENABLED', False)
+        app.config.setdefault('QUERY_PROFILER_SLOW_MS', 100)
+        app.config.setdefault('QUERY_PROFILER_N_PLUS_ONE', 5)
+        app.config.setdefault('QUERY_PROFILER_BUDGET', None)
+        app.config.setdefault('QUERY_PROFILER_RAISE', None)
+        app.config.setdefault('QUERY_PROFILER_EXPLAIN', True)
+        app.config.setdefault('QUERY_PROFILER_HISTORY', 100)
+        app.extensions['query_profiler'] = self
+        self.enabled = bool(app.config['QUERY_PROFILER_ENABLED'])
+        if not self.enabled:
+            return
+
+        self.slow_ms = float(app.config['QUERY_PROFILER_SLOW_MS'])
+        self.n_plus_one_threshold = int(app.config['QUERY_PROFILER_N_PLUS_ONE'])
+        self.explain = bool(app.config['QUERY_PROFILER_EXPLAIN'])
+        history = int(app.config['QUERY_PROFILER_HISTORY'])
+        self.slow_queries = deque(maxlen=history)
+        self.n_plus_one = deque(maxlen=history)
+
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+        event.listen(Engine, 'before_cursor_execute', self._before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', self._after_cursor_execute)
+
+    # Request hooks
+
+    def _before_request(self) -> None:
+        self._local.profile = _RequestProfile()
+
+    def _teardown_request(self, exc) -> None:
+        self._local.profile = None
+
+    def _after_request(self, response):
+        profile = getattr(self._local, 'profile', None)
+        if profile is None:
+            return response
+        self._local.profile = None
+        endpoint = request.endpoint or 'unmatched'
+        now = datetime.utcnow()
+
+        repeated = [(shape, count, seconds) for shape, (count, seconds) in profile.shapes.items()
+                    if count >= self.n_plus_one_threshold]
+        for shape, count, seconds in repeated:
+            logger.warning("Possible N+1 in %s: %d executions of %s", endpoint, count, shape,
+                           extra={'endpoint': endpoint, 'executions': count})
+
+        view = current_app.view_functions.get(request.endpoint)
+        budget = getattr(view, 'query_budget', current_app.config['QUERY_PROFILER_BUDGET'])
+        over_budget = budget is not None and profile.count > budget
+
+        with self._lock:
+            for shape, count, seconds in repeated:
+                self.n_plus_one.append({'time': now, 'endpoint': endpoint, 'shape': shape,
+                                        'count': count, 'ms': seconds * 1000})
+            stats = self.endpoints.get(endpoint)
+            if stats is None:
+                stats = self.endpoints[endpoint] = {
+                    'requests': 0, 'queries': 0, 'max_queries': 0, 'ms': 0.0,
+                    'n_plus_one': 0, 'over_budget': 0, 'budget': budget}
+            stats['requests'] += 1
+            stats['queries'] += profile.count
+            stats['max_queries'] = max(stats['max_queries'], profile.count)
+            stats['ms'] += profile.seconds * 1000
+            stats['n_plus_one'] += bool(repeated)
+            stats['over_budget'] += over_budget
+
+        if over_budget:
+            message = f"{endpoint} ran {profile.count} SQL statements, budget is {budget}"
+            strict = current_app.config['QUERY_PROFILER_RAISE']
+            if strict or (strict is None and current_app.testing):
+                raise QueryBudgetExceeded(message)
+            logger.warning(message, extra={'endpoint': endpoint, 'queries': profile.count})
+        return response
+
+    # SQLAlchemy engine events
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if context is not None:
+            context._profiler_start = time.perf_counter()
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if context is None:
+            return
+        elapsed = time.perf_counter() - context._profiler_start
+        profile = getattr(self._local, 'profile', None)
+        if profile is not None:
+            shape = normalize(statement)
+            entry = profile.shapes.get(shape)
+            if entry is None:
+                profile.shapes[shape] = [1, elapsed]
+            else:
+                entry[0] += 1
+                entry[1] += elapsed
+            profile.count += 1
+            profile.seconds += elapsed
+        if elapsed * 1000 >= self.slow_ms:
+            self._slow_query(conn, statement, parameters, executemany, elapsed)
+
+    def _slow_query(self, conn, statement, parameters, executemany, elapsed) -> None:
+        endpoint = request.endpoint if request else None
+        plan = None
+        if self.explain and not executemany:
+            plan = self._query_plan(conn, statement, parameters)
+        logger.warning("Slow query (%.1f ms) in %s: %s%s", elapsed * 1000, endpoint or 'background',
+                       statement, f"\nPlan:\n{plan}" if plan else '',
+                       extra={'endpoint': endpoint, 'duration_ms': round(elapsed * 1000, 1)})
+        with self._lock:
+            self.slow_queries.append({'time': datetime.utcnow(), 'endpoint': endpoint,
+                                      'ms': elapsed * 1000, 'statement': statement, 'plan': plan})
+
+    @staticmethod
+    def _query_plan(conn, statement, parameters) -> Optional[str]:
+        """The plan of a SELECT, run on a raw cursor so it is not profiled itself."""
+        if not statement.lstrip().upper().startswith(('SELECT', 'WITH')):
+            return None
+        prefix = 'EXPLAIN QUERY PLAN ' if conn.dialect.name == 'sqlite' else 'EXPLAIN '
+        try:
+            cursor = conn.connection.cursor()
+            try:
+                cursor.execute(prefix + statement, parameters)
+                rows = cursor.fetchall()
+            finally:
+                cursor.close()
+        except Exception as e:
+            logger.debug("Could not explain slow query: %s", e)
+            return None
+        # SQLite: (id, parent, notused, detail); PostgreSQL: one text column per line
+        return '\n'.join(str(row[-1]) for row in rows)
+
+    def summary(self) -> Dict:
+        """Rolling per-worker summary for the diagnostics page."""
+        with self._lock:
+            endpoints = sorted(self.endpoints.items(), key=lambda item: -item[1]['queries'])
+            return {
+                'enabled': self.enabled,
+                'endpoints': [dict(stats, endpoint=name) for name, stats in endpoints],
+                'slow_queries': list(reversed(self.slow_queries)),
+                'n_plus_one': list(reversed(self.n_plus_one)),
+            }
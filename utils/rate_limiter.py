@@ -0,0 +1,307 @@
+"""
+Pluggable rate limiter engine used by the ``rate_limit`` decorator.
+
+Two backends are available:
+
+- ``mmap``: a sliding-window counter stored in a fixed-size hash table inside
+  an mmap'd file. Every gunicorn worker on the host maps the same file, so
+  limits are shared without touching the database.
+- ``sql``: a fallback that stores counters in the ``rate_limits`` table using a
+  single atomic UPSERT per hit, plus a background sweep that deletes expired
+  keys so the table no longer grows forever.
+
+The backend is selected with the ``RATE_LIMIT_BACKEND`` config value.
+"""
+
+import abc
+import fcntl
+import hashlib
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Optional, Union
+
+from flask import request
+from sqlalchemy import case
+from sqlalchemy.dialects import postgresql, sqlite
+
+logger = logging.getLogger(__name__)
+
+Period = Union[int, float, timedelta]
+
+
+def get_remote_address() -> str:
+    """Return the client address used to key rate limits."""
+    return request.remote_addr or '127.0.0.1'
+
+
+def _seconds(period: Period) -> float:
+    if isinstance(period, timedelta):
+        return period.total_seconds()
+    return float(period)
+
+
+class RateLimiterBackend(abc.ABC):
+    """Interface shared by all limiter backends."""
+
+    @abc.abstractmethod
+    def hit(self, key: str, period: Period) -> int:
+        """
+        Record one hit for ``key`` and return the number of hits in the window.
+
+        Args:
+            key: Identifier being limited (usually ``"<ip>:<endpoint>"``)
+            period: Length of the window
+
+        Returns:
+            int: Hits counted in the current window, including this one
+        """
+
+    @abc.abstractmethod
+    def reset(self, key: str) -> None:
+        """Forget all hits recorded for ``key``."""
+
+
+class MmapRateLimiter(RateLimiterBackend):
+    """
+    Sliding-window counters in a shared, mmap'd open-addressing hash table.
+
+    Each slot stores the key hash, the start of the current window, the window
+    length and the hit counts for the current and previous windows. The
+    reported count weights the previous window by how much of it still
+    overlaps the sliding window, which gives a smooth limit without storing
+    individual timestamps.
+
+    Access is serialized across processes with ``flock`` on the backing file
+    and across threads with a regular lock.
+    """
+
+    MAGIC = b'CHRL0001'
+    HEADER = struct.Struct('<8sI')
+    SLOT = struct.Struct('<QddII')
+    MAX_PROBES = 32
+
+    def __init__(self, path: str, slots: int = 4096):
+        self.path = path
+        self.slots = slots
+        self._size = self.HEADER.size + self.SLOT.size * slots
+        self._lock = threading.Lock()
+        self._pid = None
+        self._fd = None
+        self._map = None
+
+    def _open(self) -> None:
+        # Reopen after fork so that each worker holds its own open file
+        # description; flock does not exclude processes sharing one.
+        if self._pid == os.getpid():
+            return
+        if self._map is not None:
+            self._map.close()
+            os.close(self._fd)
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            if os.fstat(fd).st_size != self._size:
+                os.ftruncate(fd, 0)
+                os.ftruncate(fd, self._size)
+            mapped = mmap.mmap(fd, self._size)
+            magic, slots = self.HEADER.unpack_from(mapped, 0)
+            if magic != self.MAGIC or slots != self.slots:
+                mapped[:] = b'\x00' * self._size
+                self.HEADER.pack_into(mapped, 0, self.MAGIC, self.slots)
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        self._fd = fd
+        self._map = mapped
+        self._pid = os.getpid()
+
+    @staticmethod
+    def _hash(key: str) -> int:
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest()
+        # Zero marks an empty slot
+        return int.from_bytes(digest, 'little') or 1
+
+    def _offset(self, index: int) -> int:
+        return self.HEADER.size + index * self.SLOT.size
+
+    def _find_slot(self, key_hash: int, now: float) -> Optional[int]:
+        """Return the slot holding ``key_hash`` or the first reusable one."""
+        start = key_hash % self.slots
+        free = None
+        for probe in range(self.MAX_PROBES):
+            index = (start + probe) % self.slots
+            stored_hash, window_start, window, _, _ = self.SLOT.unpack_from(
+                self._map, self._offset(index))
+            if stored_hash == key_hash:
+                return index
+            if free is None and (stored_hash == 0 or now >= window_start + 2 * window):
+                free = index
+            if stored_hash == 0:
+                break
+        return free
+
+    def hit(self, key: str, period: Period) -> int:
+        window = _seconds(period)
+        key_hash = self._hash(key)
+        with self._lock:
+            self._open()
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                now = time.time()
+                index = self._find_slot(key_hash, now)
+                if index is None:
+                    # Table saturated around this key; fail open rather than
+                    # locking out legitimate users.
+                    logger.warning("Rate limiter table full, not limiting %s", key)
+                    return 1
+                offset = self._offset(index)
+                stored_hash, window_start, stored_window, current, previous = \
+                    self.SLOT.unpack_from(self._map, offset)
+                if stored_hash != key_hash or stored_window != window:
+                    window_start, current, previous = now, 0, 0
+                elapsed = now - window_start
+                if elapsed >= 2 * window:
+                    window_start, current, previous = now, 0, 0
+                elif elapsed >= window:
+                    window_start, current, previous = window_start + window, 0, current
+                current += 1
+                self.SLOT.pack_into(self._map, offset, key_hash, window_start,
+                                    window, current, previous)
+                overlap = 1 - (now - window_start) / window
+                return current + int(previous * max(overlap, 0))
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def reset(self, key: str) -> None:
+        key_hash = self._hash(key)
+        with self._lock:
+            self._open()
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                index = self._find_slot(key_hash, time.time())
+                if index is not None:
+                    offset = self._offset(index)
+                    if self.SLOT.unpack_from(self._map, offset)[0] == key_hash:
+                        self.SLOT.pack_into(self._map, offset, key_hash, 0, 0, 0, 0)
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+
+class SQLRateLimiter(RateLimiterBackend):
+    """
+    Fixed-window counters in the ``rate_limits`` table.
+
+    Each hit is one ``INSERT ... ON CONFLICT DO UPDATE ... RETURNING`` executed
+    on its own connection, so it never commits the caller's session. Expired
+    keys are removed by a daemon thread every ``sweep_interval`` seconds.
+    """
+
+    def __init__(self, app=None, sweep_interval: float = 300):
+        self.app = app
+        self.sweep_interval = sweep_interval
+        self._sweeper = None
+        self._sweeper_pid = None
+        self._sweeper_lock = threading.Lock()
+
+    def hit(self, key: str, period: Period) -> int:
+        from models import db, RateLimit
+        self._ensure_sweeper()
+        now = datetime.utcnow()
+        reset_time = now + timedelta(seconds=_seconds(period))
+        table = RateLimit.__table__
+        if db.engine.dialect.name == 'postgresql':
+            insert = postgresql.insert
+        else:
+            insert = sqlite.insert
+        expired = table.c.reset_time <= now
+        stmt = insert(table).values(key=key, hits=1, reset_time=reset_time, created_at=now)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.key],
+            set_={
+                'hits': case((expired, 1), else_=table.c.hits + 1),
+                'reset_time': case((expired, reset_time), else_=table.c.reset_time),
+            },
+        ).returning(table.c.hits)
+        with db.engine.begin() as conn:
+            return conn.execute(stmt).scalar_one()
+
+    def reset(self, key: str) -> None:
+        from models import db, RateLimit
+        with db.engine.begin() as conn:
+            conn.execute(RateLimit.__table__.delete().where(RateLimit.__table__.c.key == key))
+
+    def sweep(self) -> int:
+        """Delete expired counters and return how many rows were removed."""
+        from models import db, RateLimit
+        table = RateLimit.__table__
+        with db.engine.begin() as conn:
+            result = conn.execute(table.delete().where(table.c.reset_time <= datetime.utcnow()))
+        return result.rowcount
+
+    def _ensure_sweeper(self) -> None:
+        if self._sweeper_pid == os.getpid() or self.app is None:
+            return
+        with self._sweeper_lock:
+            if self._sweeper_pid == os.getpid():
+                return
+            self._sweeper = threading.Thread(target=self._sweep_loop,
+                                             name='rate-limit-sweeper', daemon=True)
+            self._sweeper.start()
+            self._sweeper_pid = os.getpid()
+
+    def _sweep_loop(self) -> None:
+        while True:
+            time.sleep(self.sweep_interval)
+            try:
+                with self.app.app_context():
+                    removed = self.sweep()
+                if removed:
+                    logger.info("Rate limiter sweep removed %d expired keys", removed)
+            except Exception:
+                logger.exception("Rate limiter sweep failed")
+
+
+class RateLimiter:
+    """
+    Flask extension that owns the configured limiter backend.
+
+    Config:
+        RATE_LIMIT_BACKEND: ``'mmap'`` (default) or ``'sql'``
+        RATE_LIMIT_FILE: Path of the shared mmap file
+        RATE_LIMIT_SLOTS: Number of hash table slots for the mmap backend
+        RATE_LIMIT_SWEEP_INTERVAL: Seconds between SQL expiry sweeps
+    """
+
+    def __init__(self, app=None):
+        self.backend = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app) -> None:
+        default_file = os.path.join(app.instance_path, 'rate_limits.mmap')
+        app.config.setdefault('RATE_LIMIT_BACKEND', 'mmap')
+        app.config.setdefault('RATE_LIMIT_FILE', default_file)
+        app.config.setdefault('RATE_LIMIT_SLOTS', 4096)
+        app.config.setdefault('RATE_LIMIT_SWEEP_INTERVAL', 300)
+
+        backend = app.config['RATE_LIMIT_BACKEND']
+        if backend == 'mmap':
+            self.backend = MmapRateLimiter(app.config['RATE_LIMIT_FILE'],
+                                           slots=int(app.config['RATE_LIMIT_SLOTS']))
+        elif backend == 'sql':
+            self.backend = SQLRateLimiter(
+                app, sweep_interval=float(app.config['RATE_LIMIT_SWEEP_INTERVAL']))
+        else:
+            raise ValueError(f"Unknown RATE_LIMIT_BACKEND: {backend}")
+        app.extensions['rate_limiter'] = self
+
+    def hit(self, key: str, period: Period) -> int:
+        return self.backend.hit(key, period)
+
+    def reset(self, key: str) -> None:
+        self.backend.reset(key)
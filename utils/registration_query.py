@@ -0,0 +1,223 @@
+"""
+Server-side filtering, sorting and keyset pagination for registrations.
+
+The admin dashboard and its JSON API share these helpers so that the first
+page rendered by Jinja and the pages fetched later by the browser come from
+exactly the same query.
+
+Pagination uses a seek cursor of ``(sort value, id)`` instead of OFFSET, so
+fetching page N costs the same as fetching page 1.
+"""
+
+import base64
+import json
+from datetime import date, datetime, time, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import or_, tuple_
+from sqlalchemy.orm import contains_eager
+
+from models import db, User, FormData
+from utils.search import build_match_query, is_supported as search_supported, match_clause
+from utils.signature import signature_url
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+# name -> (column, descending)
+SORTS = {
+    'newest': (FormData.date_submitted, True),
+    'oldest': (FormData.date_submitted, False),
+    'student': (FormData.student_name, False),
+}
+DEFAULT_SORT = 'newest'
+
+FILTER_FIELDS = ('q', 'student', 'parent', 'email', 'phone', 'payment', 'event',
+                 'date_from', 'date_to', 'sort')
+
+
+class InvalidCursor(ValueError):
+    """Raised when a pagination cursor cannot be decoded."""
+
+
+def parse_filters(args) -> Dict[str, str]:
+    """
+    Extract the supported filters from request arguments.
+
+    Args:
+        args: ``request.args`` or any mapping of query string values
+
+    Returns:
+        dict: Non-empty, stripped filter values keyed by name
+    """
+    filters = {}
+    for field in FILTER_FIELDS:
+        value = (args.get(field) or '').strip()
+        if value:
+            filters[field] = value
+    if filters.get('sort') not in SORTS:
+        filters.pop('sort', None)
+    if filters.get('payment') not in ('paid', 'pending'):
+        filters.pop('payment', None)
+    for field in ('date_from', 'date_to'):
+        if field in filters:
+            try:
+                date.fromisoformat(filters[field])
+            except ValueError:
+                filters.pop(field)
+    return filters
+
+
+def filtered_query(filters: Dict[str, str]):
+    """Build the registrations query (with the owning user joined) for ``filters``."""
+    query = (FormData.query
+             .join(User, FormData.user_id == User.id)
+             .options(*FormData.profile('list'),
+                      contains_eager(FormData.user).load_only(User.email)))
+    return apply_filters(query, filters)
+
+
+def apply_filters(query, filters: Dict[str, str]):
+    """
+    Apply ``filters`` to an ORM ``Query`` or a Core ``Select``.
+
+    The statement must already be joined to ``User`` (needed by the email and
+    free-text filters).
+    """
+    if 'q' in filters and build_match_query(filters['q']):
+        if search_supported(db.engine):
+            query = query.filter(match_clause(FormData.id, filters['q']))
+        else:
+            term = filters['q']
+            query = query.filter(or_(
+                FormData.student_name.icontains(term, autoescape=True),
+                FormData.parent_guardian.icontains(term, autoescape=True),
+                FormData.emergency_contact.icontains(term, autoescape=True),
+                User.email.icontains(term, autoescape=True),
+                FormData.parent_cell_phone.contains(term, autoescape=True),
+            ))
+    if 'student' in filters:
+        query = query.filter(FormData.student_name.icontains(filters['student'], autoescape=True))
+    if 'parent' in filters:
+        query = query.filter(FormData.parent_guardian.icontains(filters['parent'], autoescape=True))
+    if 'email' in filters:
+        query = query.filter(User.email.icontains(filters['email'], autoescape=True))
+    if 'phone' in filters:
+        query = query.filter(or_(
+            FormData.parent_cell_phone.contains(filters['phone'], autoescape=True),
+            FormData.home_phone.contains(filters['phone'], autoescape=True),
+        ))
+    if filters.get('payment') == 'paid':
+        query = query.filter(FormData.payment_status.is_(True))
+    elif filters.get('payment') == 'pending':
+        query = query.filter(or_(FormData.payment_status.is_(False),
+                                 FormData.payment_status.is_(None)))
+    if 'event' in filters:
+        query = query.filter(FormData.event_name == filters['event'])
+    if 'date_from' in filters:
+        start = datetime.combine(date.fromisoformat(filters['date_from']), time.min)
+        query = query.filter(FormData.date_submitted >= start)
+    if 'date_to' in filters:
+        end = datetime.combine(date.fromisoformat(filters['date_to']) + timedelta(days=1), time.min)
+        query = query.filter(FormData.date_submitted < end)
+    return query
+
+
+def encode_cursor(value: Any, row_id: int) -> str:
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    raw = json.dumps([value, row_id], separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor: str, sort: str) -> Tuple[Any, int]:
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        value, row_id = json.loads(base64.urlsafe_b64decode(padded))
+        if SORTS[sort][0] is FormData.date_submitted:
+            value = datetime.fromisoformat(value)
+        return value, int(row_id)
+    except (ValueError, TypeError, KeyError) as e:
+        raise InvalidCursor(str(e)) from e
+
+
+def fetch_page(filters: Dict[str, str], cursor: Optional[str] = None,
+               limit: int = DEFAULT_PAGE_SIZE) -> Tuple[List[FormData], Optional[str]]:
+    """
+    Fetch one page of registrations after ``cursor``.
+
+    Args:
+        filters: Output of :func:`parse_filters`
+        cursor: Opaque cursor returned with the previous page
+        limit: Page size, capped at ``MAX_PAGE_SIZE``
+
+    Returns:
+        tuple: (registrations, next_cursor or None on the last page)
+
+    Raises:
+        InvalidCursor: If ``cursor`` is malformed
+    """
+    sort = filters.get('sort', DEFAULT_SORT)
+    column, descending = SORTS[sort]
+    limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+
+    query = filtered_query(filters)
+    if cursor:
+        value, row_id = decode_cursor(cursor, sort)
+        key = tuple_(column, FormData.id)
+        query = query.filter(key < (value, row_id) if descending else key > (value, row_id))
+
+    if descending:
+        query = query.order_by(column.desc(), FormData.id.desc())
+    else:
+        query = query.order_by(column.asc(), FormData.id.asc())
+
+    rows = query.limit(limit + 1).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor(getattr(last, column.key), last.id)
+    return rows, next_cursor
+
+
+def serialize_row(form: FormData) -> Dict[str, Any]:
+    """Return the list-view fields of a registration as a JSON-safe dict."""
+    return {
+        'id': form.id,
+        'date_submitted': form.date_submitted.isoformat(),
+        'student_name': form.student_name,
+        'parent_guardian': form.parent_guardian,
+        'email': form.user.email,
+        'parent_cell_phone': form.parent_cell_phone,
+        'event_name': form.event_name,
+        'payment_status': bool(form.payment_status),
+        'status': form.status,
+        'version': form.version,
+    }
+
+
+DETAIL_FIELDS = (
+    'student_name', 'date_of_birth', 'street', 'city', 'zip_code',
+    'parent_guardian', 'parent_cell_phone', 'home_phone',
+    'emergency_contact', 'emergency_phone',
+    'current_treatment', 'treatment_details', 'physical_restrictions', 'restriction_details',
+    'family_doctor', 'doctor_phone', 'insurance_company', 'policy_number',
+    'photo_release', 'event_name', 'event_cost', 'payment_status', 'form_type', 'status',
+    'version',
+)
+
+
+def serialize_detail(form: FormData) -> Dict[str, Any]:
+    """Return every displayed field of a registration as a JSON-safe dict."""
+    detail = {field: getattr(form, field) for field in DETAIL_FIELDS}
+    detail.update(
+        id=form.id,
+        email=form.user.email,
+        date_submitted=form.date_submitted.isoformat(),
+        liability_signed=bool(form.liability_signature),
+        photo_signed=bool(form.photo_signature),
+        liability_signature_url=signature_url(form.liability_signature),
+        photo_signature_url=signature_url(form.photo_signature),
+    )
+    return detail
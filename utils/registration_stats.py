@@ -0,0 +1,262 @@
+"""
+Registration statistics maintained incrementally.
+
+``registration_stats`` holds one row of running totals per event: how many
+registrations there are, how many are paid, how many are in each review
+status and carry each medical flag, and the revenue collected and still
+outstanding (``event_cost`` parsed to cents). Reading the summary costs one
+small query however many registrations there are.
+
+The totals change in the same transaction as the registrations they count.
+Before a flush the old values of changed and deleted rows are read from the
+database and subtracted; after it the new values of inserted and changed rows
+are read back and added, and the net change is applied per event with an
+``INSERT ... ON CONFLICT DO UPDATE`` increment, so concurrent writers never
+overwrite each other's counts. Bulk ``Query.update()`` / ``Query.delete()``
+calls and executemany UPDATEs, which bypass the flush, are handled the same
+way around the statement.
+
+Writes that bypass the ORM (raw SQL, Core inserts) are not counted. Run
+``python reconcile_stats.py`` afterwards, or from cron, to rebuild the totals
+from scratch and report any drift.
+"""
+
+import logging
+import re
+from collections import defaultdict
+from decimal import Decimal, InvalidOperation
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy import event, func, inspect, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from models import FormData, RegistrationStats
+from utils.versioning import bulk_write_ids
+
+logger = logging.getLogger(__name__)
+
+# form_data columns the statistics depend on
+TRACKED = ('event_name', 'event_cost', 'payment_status', 'status',
+           'current_treatment', 'physical_restrictions')
+
+COUNTERS = ('registrations', 'paid', 'status_pending', 'status_approved', 'status_rejected',
+            'current_treatment', 'physical_restrictions', 'medical_flagged',
+            'collected_cents', 'outstanding_cents')
+
+NO_EVENT = ''  # key of registrations without an event name
+
+_BATCH_SIZE = 500
+_COST_NOISE = re.compile(r'[\s$,]')
+
+Deltas = Dict[str, Dict[str, int]]
+
+
+def parse_cost(value: Optional[str]) -> int:
+    """Cents in an ``event_cost`` such as "$150" or "$1,250.50"; 0 if it has no price."""
+    try:
+        amount = Decimal(_COST_NOISE.sub('', value or ''))
+    except InvalidOperation:
+        return 0
+    if not amount.is_finite() or amount < 0:
+        return 0
+    return int((amount * 100).to_integral_value())
+
+
+def contribution(event_name, event_cost, payment_status, status,
+                 current_treatment, physical_restrictions) -> Dict[str, int]:
+    """The counters one registration adds to its event's totals."""
+    cost = parse_cost(event_cost)
+    paid = bool(payment_status)
+    status = status or 'pending'
+    return {
+        'registrations': 1,
+        'paid': int(paid),
+        'status_pending': int(status == 'pending'),
+        'status_approved': int(status == 'approved'),
+        'status_rejected': int(status == 'rejected'),
+        'current_treatment': int(bool(current_treatment)),
+        'physical_restrictions': int(bool(physical_restrictions)),
+        'medical_flagged': int(bool(current_treatment or physical_restrictions)),
+        'collected_cents': cost if paid else 0,
+        'outstanding_cents': 0 if paid else cost,
+    }
+
+
+def _accumulate(deltas: Deltas, rows: Iterable, sign: int) -> None:
+    for row in rows:
+        counters = deltas[row[0] or NO_EVENT]
+        for name, value in contribution(*row).items():
+            counters[name] += sign * value
+
+
+def _tracked_columns():
+    table = FormData.__table__
+    return [table.c[name] for name in TRACKED]
+
+
+def _read(connection, ids: List[int]):
+    """Current tracked values of the given form_data rows."""
+    table = FormData.__table__
+    for start in range(0, len(ids), _BATCH_SIZE):
+        yield from connection.execute(
+            select(*_tracked_columns()).where(table.c.id.in_(ids[start:start + _BATCH_SIZE])))
+
+
+def apply(connection, deltas: Deltas) -> None:
+    """Add ``{event key: {counter: delta}}`` to the stored totals, creating missing rows."""
+    table = RegistrationStats.__table__
+    insert = postgresql.insert if connection.dialect.name == 'postgresql' else sqlite.insert
+    for key in sorted(deltas):  # a fixed order, so concurrent writers cannot deadlock
+        changes = {name: value for name, value in deltas[key].items() if value}
+        if not changes:
+            continue
+        stmt = insert(table).values(event_name=key, **changes)
+        connection.execute(stmt.on_conflict_do_update(
+            index_elements=[table.c.event_name],
+            set_={name: table.c[name] + stmt.excluded[name] for name in changes},
+        ))
+
+
+def _changed_forms(session) -> List[FormData]:
+    forms = []
+    for obj in session.dirty:
+        if isinstance(obj, FormData) and obj.id is not None:
+            state = inspect(obj)
+            if any(state.attrs[name].history.has_changes() for name in TRACKED):
+                forms.append(obj)
+    return forms
+
+
+@event.listens_for(Session, 'before_flush')
+def _subtract_before_flush(session, flush_context, instances):
+    changed = _changed_forms(session)
+    deleted = [obj for obj in session.deleted if isinstance(obj, FormData) and obj.id is not None]
+    deltas = defaultdict(lambda: defaultdict(int))
+    if changed or deleted:
+        # The database still holds the values counted so far
+        _accumulate(deltas, _read(session.connection(), [obj.id for obj in changed + deleted]), -1)
+    session.info['registration_stats'] = (deltas, changed)
+
+
+@event.listens_for(Session, 'after_flush')
+def _add_after_flush(session, flush_context):
+    deltas, changed = session.info.pop('registration_stats', (None, []))
+    if deltas is None:
+        return
+    ids = [obj.id for obj in session.new if isinstance(obj, FormData)]
+    ids += [obj.id for obj in changed]
+    if ids:
+        _accumulate(deltas, _read(session.connection(), ids), 1)
+    if deltas:
+        apply(session.connection(), deltas)
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _count_bulk_write(orm_execute_state):
+    if not (orm_execute_state.is_update or orm_execute_state.is_delete):
+        return None
+    mapper = orm_execute_state.bind_mapper
+    if mapper is None or mapper.class_ is not FormData:
+        return None
+
+    session = orm_execute_state.session
+    if session.autoflush:
+        # Count pending changes now rather than in the statement's own autoflush,
+        # which would run after the old values below are read
+        session.flush()
+    connection = session.connection()
+    ids = bulk_write_ids(orm_execute_state, connection)
+    deltas = defaultdict(lambda: defaultdict(int))
+    _accumulate(deltas, _read(connection, ids), -1)
+
+    result = orm_execute_state.invoke_statement()
+    if orm_execute_state.is_update:
+        _accumulate(deltas, _read(connection, ids), 1)
+    apply(connection, deltas)
+    return result
+
+
+def compute(connection) -> Deltas:
+    """Totals per event computed from ``form_data`` (one grouped scan)."""
+    columns = _tracked_columns()
+    totals = defaultdict(lambda: defaultdict(int))
+    for row in connection.execute(select(*columns, func.count()).group_by(*columns)):
+        *values, count = row
+        counters = totals[values[0] or NO_EVENT]
+        for name, value in contribution(*values).items():
+            counters[name] += value * count
+    return totals
+
+
+def _stored(connection) -> Deltas:
+    table = RegistrationStats.__table__
+    stored = {}
+    for row in connection.execute(select(table)):
+        stored[row.event_name] = {name: getattr(row, name) for name in COUNTERS}
+    return stored
+
+
+def reconcile(connection) -> List[dict]:
+    """
+    Rebuild the totals from ``form_data`` and report where they had drifted.
+
+    Args:
+        connection: Connection inside a transaction (e.g. ``engine.begin()``)
+
+    Returns:
+        list: ``{'event_name', 'counter', 'stored', 'actual'}`` for each wrong
+        counter, empty if the totals were right
+    """
+    table = RegistrationStats.__table__
+    # Stop incremental updates until the rebuild commits. A registration
+    # committed before the lock is in the scan below; one committed after it
+    # waits for the lock and then adds itself to the rebuilt totals.
+    if connection.dialect.name == 'postgresql':
+        connection.exec_driver_sql(f'LOCK TABLE {table.name} IN EXCLUSIVE MODE')
+        stored = _stored(connection)
+    else:
+        stored = _stored(connection)
+        # On SQLite the first write takes the database write lock
+        connection.execute(table.delete())
+    actual = compute(connection)
+
+    drift = []
+    for key in sorted(set(stored) | set(actual)):
+        for name in COUNTERS:
+            stored_value = stored.get(key, {}).get(name, 0)
+            actual_value = actual.get(key, {}).get(name, 0)
+            if stored_value != actual_value:
+                drift.append({'event_name': key or None, 'counter': name,
+                              'stored': stored_value, 'actual': actual_value})
+
+    if connection.dialect.name == 'postgresql':
+        connection.execute(table.delete())
+    rows = [dict({name: counters.get(name, 0) for name in COUNTERS}, event_name=key)
+            for key, counters in actual.items()]
+    if rows:
+        connection.execute(table.insert(), rows)
+    if drift:
+        logger.warning("Registration statistics had drifted on %d counters", len(drift))
+    return drift
+
+
+def summary(session) -> dict:
+    """
+    The statistics per event and in total, read from the stored totals.
+
+    Returns:
+        dict: ``{'events': [{'event_name', <counters>}...], 'totals': {<counters>}}``
+    """
+    rows = session.execute(
+        select(RegistrationStats)
+        .where(RegistrationStats.registrations > 0)
+        .order_by(RegistrationStats.event_name)
+    ).scalars()
+    events, totals = [], dict.fromkeys(COUNTERS, 0)
+    for row in rows:
+        counters = {name: getattr(row, name) for name in COUNTERS}
+        for name, value in counters.items():
+            totals[name] += value
+        events.append(dict(counters, event_name=row.event_name or None))
+    return {'events': events, 'totals': totals}
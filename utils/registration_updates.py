@@ -0,0 +1,160 @@
+"""
+Batch payment and status updates with optimistic concurrency.
+
+Every registration carries a ``version`` that any update increments (the ORM
+does it through ``version_id_col``). A client sends back the version it last
+saw with each change; a row that has been changed since is reported as a
+conflict instead of being overwritten, and the client reloads it.
+
+A batch is applied in one transaction with a single executemany ``UPDATE``:
+
+1. the current versions of all the batch's rows are read in one query
+   (``SELECT ... FOR UPDATE`` on PostgreSQL), which sorts each entry into
+   updated, conflict or not found;
+2. the matching rows are updated with ``WHERE id = :id AND version = :expected``;
+3. if fewer rows changed than expected, another writer got in between steps
+   1 and 2 (SQLite only locks at the first write), so the transaction is
+   rolled back and the batch retried, and the row now shows as a conflict.
+"""
+
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import Boolean, String, bindparam, func, select, update
+
+from models import db, FormData
+
+STATUSES = ('pending', 'approved', 'rejected')
+MAX_BATCH_SIZE = 500
+
+_ATTEMPTS = 3
+
+# Updates one row; a NULL parameter leaves its column unchanged
+_UPDATE = (
+    update(FormData)
+    .where(FormData.id == bindparam('form_id'), FormData.version == bindparam('expected_version'))
+    .values(
+        payment_status=func.coalesce(bindparam('new_payment_status', type_=Boolean),
+                                     FormData.payment_status),
+        status=func.coalesce(bindparam('new_status', type_=String), FormData.status),
+        version=FormData.version + 1,
+    )
+)
+
+
+class InvalidBatch(ValueError):
+    """Raised for a request body that is not a list of updates."""
+
+
+class BatchConflict(Exception):
+    """Raised when concurrent writes kept the batch from applying."""
+
+
+def _parse_entry(entry) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+    """Return ``(update params, None)`` or ``(None, error message)`` for one entry."""
+    if not isinstance(entry, dict):
+        return None, 'Each update must be an object'
+    form_id, expected = entry.get('id'), entry.get('expected_version')
+    if not isinstance(form_id, int) or isinstance(form_id, bool):
+        return None, 'id must be an integer'
+    if not isinstance(expected, int) or isinstance(expected, bool):
+        return None, 'expected_version must be an integer'
+    payment_status, status = entry.get('payment_status'), entry.get('status')
+    if payment_status is not None and not isinstance(payment_status, bool):
+        return None, 'payment_status must be true or false'
+    if status is not None and status not in STATUSES:
+        return None, f"status must be one of {', '.join(STATUSES)}"
+    if payment_status is None and status is None:
+        return None, 'Nothing to update'
+    return {'id': form_id, 'expected_version': expected,
+            'payment_status': payment_status, 'status': status}, None
+
+
+def parse_batch(body) -> List[Tuple[Any, Optional[Dict[str, Any]], Optional[str]]]:
+    """
+    Validate a request body: a list of updates, or ``{"updates": [...]}``.
+
+    Returns:
+        list: ``(id as sent, params, error)`` per entry, in request order
+
+    Raises:
+        InvalidBatch: If the body is not a list of at most ``MAX_BATCH_SIZE`` entries
+    """
+    entries = body.get('updates') if isinstance(body, dict) else body
+    if not isinstance(entries, list) or not entries:
+        raise InvalidBatch('Expected a non-empty list of updates')
+    if len(entries) > MAX_BATCH_SIZE:
+        raise InvalidBatch(f'At most {MAX_BATCH_SIZE} updates per request')
+
+    parsed, seen = [], set()
+    for entry in entries:
+        params, error = _parse_entry(entry)
+        if params is not None and params['id'] in seen:
+            params, error = None, 'Duplicate id in batch'
+        if params is not None:
+            seen.add(params['id'])
+        parsed.append((entry.get('id') if isinstance(entry, dict) else None, params, error))
+    return parsed
+
+
+def apply_batch(parsed, session=None) -> List[Dict[str, Any]]:
+    """
+    Apply parsed updates in one transaction and commit it.
+
+    Args:
+        parsed: Output of :func:`parse_batch`
+        session: Session to use (default ``db.session``)
+
+    Returns:
+        list: Per entry, ``{'id', 'result', ...}`` where result is ``updated``,
+        ``conflict``, ``not_found`` or ``invalid`` (with a ``message``).
+        Updated and conflicting rows also carry their ``version``,
+        ``payment_status`` and ``status`` after the batch.
+
+    Raises:
+        BatchConflict: If concurrent writes interfered with every attempt
+    """
+    session = session or db.session
+    ids = [params['id'] for _, params, _ in parsed if params is not None]
+    for _ in range(_ATTEMPTS):
+        current = {row.id: row for row in session.execute(
+            select(FormData.id, FormData.version, FormData.payment_status, FormData.status)
+            .where(FormData.id.in_(ids)).with_for_update()
+        )} if ids else {}
+        ready = [params for _, params, _ in parsed if params is not None
+                 and params['id'] in current
+                 and current[params['id']].version == params['expected_version']]
+        if ready:
+            rows = [{'form_id': params['id'], 'expected_version': params['expected_version'],
+                     'new_payment_status': params['payment_status'], 'new_status': params['status']}
+                    for params in ready]
+            result = session.execute(_UPDATE, rows, execution_options={
+                'dml_strategy': 'core_only', 'synchronize_session': False})
+            if result.rowcount != len(ready) and session.get_bind().dialect.supports_sane_multi_rowcount:
+                session.rollback()
+                continue
+        session.commit()
+        break
+    else:
+        raise BatchConflict('Registrations kept changing; try again')
+
+    updated = {params['id']: params for params in ready}
+    results = []
+    for entry_id, params, error in parsed:
+        if params is None:
+            results.append({'id': entry_id, 'result': 'invalid', 'message': error})
+            continue
+        form_id = params['id']
+        row = current.get(form_id)
+        if row is None:
+            results.append({'id': form_id, 'result': 'not_found'})
+            continue
+        result = {'id': form_id, 'result': 'conflict', 'version': row.version,
+                  'payment_status': bool(row.payment_status), 'status': row.status}
+        if form_id in updated:
+            result.update(result='updated', version=row.version + 1)
+            if params['payment_status'] is not None:
+                result['payment_status'] = params['payment_status']
+            if params['status'] is not None:
+                result['status'] = params['status']
+        results.append(result)
+    return results
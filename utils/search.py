@@ -0,0 +1,179 @@
+"""
+SQLite FTS5 full-text index over registrations.
+
+The ``registration_search`` virtual table holds one row per ``form_data`` row
+(sharing its rowid) with the searchable registration columns and the owning
+user's email. Triggers keep it in sync on insert, update and delete, including
+bulk ``Query.delete()`` calls that bypass ORM events, and when a user's email
+changes.
+
+Phone numbers are also indexed with punctuation stripped so that "2065550100"
+matches "206-555-0100".
+"""
+
+import logging
+import re
+from typing import List, Tuple
+
+from sqlalchemy import Integer, column as sql_column, inspect, text
+
+logger = logging.getLogger(__name__)
+
+SEARCH_TABLE = 'registration_search'
+
+# Strip common phone punctuation inside SQLite
+_DIGITS_SQL = ("replace(replace(replace(replace(replace(replace(coalesce({col}, ''), "
+               "'-', ''), ' ', ''), '(', ''), ')', ''), '.', ''), '+', '')")
+
+
+def _row_values(prefix: str) -> str:
+    phones = " || ' ' || ".join(
+        _DIGITS_SQL.format(col=f'{prefix}.{col}')
+        for col in ('parent_cell_phone', 'home_phone', 'emergency_phone')
+    )
+    return (
+        f"{prefix}.id, {prefix}.student_name, {prefix}.parent_guardian, "
+        f"{prefix}.emergency_contact, "
+        f"(SELECT email FROM \"user\" WHERE \"user\".id = {prefix}.user_id), "
+        f"coalesce({prefix}.parent_cell_phone, '') || ' ' || "
+        f"coalesce({prefix}.home_phone, '') || ' ' || "
+        f"coalesce({prefix}.emergency_phone, '') || ' ' || {phones}"
+    )
+
+
+_COLUMNS = 'rowid, student_name, parent_guardian, emergency_contact, email, phones'
+
+SCHEMA = [
+    f"""
+    CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5(
+        student_name, parent_guardian, emergency_contact, email, phones,
+        tokenize = 'unicode61 remove_diacritics 2',
+        prefix = '2 3'
+    )
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS form_data_search_ai AFTER INSERT ON form_data BEGIN
+        INSERT INTO {SEARCH_TABLE} ({_COLUMNS}) SELECT {_row_values('NEW')};
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS form_data_search_au AFTER UPDATE OF
+        user_id, student_name, parent_guardian, emergency_contact,
+        parent_cell_phone, home_phone, emergency_phone ON form_data BEGIN
+        DELETE FROM {SEARCH_TABLE} WHERE rowid = OLD.id;
+        INSERT INTO {SEARCH_TABLE} ({_COLUMNS}) SELECT {_row_values('NEW')};
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS form_data_search_ad AFTER DELETE ON form_data BEGIN
+        DELETE FROM {SEARCH_TABLE} WHERE rowid = OLD.id;
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS user_search_au AFTER UPDATE OF email ON "user" BEGIN
+        UPDATE {SEARCH_TABLE} SET email = NEW.email
+        WHERE rowid IN (SELECT id FROM form_data WHERE user_id = NEW.id);
+    END
+    """,
+]
+
+DROP_SCHEMA = [
+    'DROP TRIGGER IF EXISTS user_search_au',
+    'DROP TRIGGER IF EXISTS form_data_search_ad',
+    'DROP TRIGGER IF EXISTS form_data_search_au',
+    'DROP TRIGGER IF EXISTS form_data_search_ai',
+    f'DROP TABLE IF EXISTS {SEARCH_TABLE}',
+]
+
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def is_supported(bind) -> bool:
+    """FTS5 is only available on SQLite."""
+    return bind.dialect.name == 'sqlite'
+
+
+def ensure_search_index(conn) -> None:
+    """
+    Create the FTS table and triggers on ``conn`` if they do not exist yet.
+
+    A table created here is filled from ``form_data`` the same way the
+    migration does, so registrations added before it existed are searchable.
+    """
+    if not is_supported(conn):
+        return
+    inspector = inspect(conn)
+    if not inspector.has_table('form_data'):
+        return
+    if not inspector.has_table(SEARCH_TABLE):
+        count = rebuild_search_index(conn)
+        logger.info("Created the registration search index with %d registrations", count)
+        return
+    for statement in SCHEMA:
+        conn.execute(text(statement))
+
+
+def rebuild_search_index(conn) -> int:
+    """
+    Recreate the index from scratch and repopulate it from ``form_data``.
+
+    Args:
+        conn: Connection inside a transaction (e.g. ``engine.begin()``)
+
+    Returns:
+        int: Number of registrations indexed
+    """
+    for statement in DROP_SCHEMA:
+        conn.execute(text(statement))
+    for statement in SCHEMA:
+        conn.execute(text(statement))
+    conn.execute(text(
+        f"INSERT INTO {SEARCH_TABLE} ({_COLUMNS}) "
+        f"SELECT {_row_values('form_data')} FROM form_data"
+    ))
+    conn.execute(text(f"INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}) VALUES ('optimize')"))
+    return conn.execute(text(f'SELECT count(*) FROM {SEARCH_TABLE}')).scalar()
+
+
+def build_match_query(query: str) -> str:
+    """
+    Turn free text into an FTS5 MATCH expression.
+
+    Every word becomes a quoted prefix term and all terms must match, so user
+    input can never inject FTS5 syntax.
+
+    Returns:
+        str: The MATCH expression, or an empty string if there are no terms
+    """
+    tokens = _TOKEN_RE.findall(query)
+    return ' '.join(f'"{token}"*' for token in tokens)
+
+
+def search_ids(session, query: str, limit: int = 50) -> List[Tuple[int, float]]:
+    """
+    Return ``(form_data id, rank)`` pairs best match first.
+
+    Args:
+        session: SQLAlchemy session to run the query on
+        query: Free text typed by the admin
+        limit: Maximum number of hits
+    """
+    match = build_match_query(query)
+    if not match:
+        return []
+    result = session.execute(
+        text(f"SELECT rowid, rank FROM {SEARCH_TABLE} "
+             f"WHERE {SEARCH_TABLE} MATCH :match ORDER BY rank LIMIT :limit"),
+        {'match': match, 'limit': limit},
+    )
+    return [(row[0], row[1]) for row in result]
+
+
+def match_clause(column, query: str):
+    """Return a SQL expression restricting ``column`` (a form_data id) to matches."""
+    matches = (
+        text(f"SELECT rowid FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH :search_match")
+        .bindparams(search_match=build_match_query(query))
+        .columns(sql_column('rowid', Integer))
+    )
+    return column.in_(matches)
@@ -0,0 +1,296 @@
+"""
+Server-side sessions in a single SQLite file.
+
+Replaces Flask-Session's filesystem backend, which kept one pickle file per
+session (anonymous visitors included), never cleaned up expired files and
+rewrote the file on every request.
+
+- Sessions live in one ``sessions`` table with an indexed ``expiry`` column.
+  A daemon thread in each worker deletes expired rows in small batches, so
+  the sweep never holds the write lock for long.
+- Payloads use Flask's tagged JSON (no pickle), with the keys written by
+  ``login()`` and Flask-Login shortened to one character.
+- A request that leaves the session unchanged does not write at all. The
+  expiry is pushed forward at most once per ``SESSION_TOUCH_INTERVAL``.
+- Rows are keyed by ``md5("session:" + sid)``, which is the file name the
+  filesystem backend used. Sessions imported with ``import_sessions.py``
+  therefore keep working, and the table never holds usable session ids.
+
+The store uses its own database file, in WAL mode, so session writes do not
+contend with application writes.
+"""
+
+import hashlib
+import logging
+import os
+import re
+import secrets
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, Optional, Tuple
+
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SecureCookieSession, SessionInterface
+
+logger = logging.getLogger(__name__)
+
+# Long keys written on every login -> one-character codes
+KEY_ALIASES = {
+    'ip': 'i',
+    'user_id': 'u',
+    'email': 'e',
+    'is_admin': 'a',
+    'login_time': 't',
+    '_user_id': 'U',
+    '_fresh': 'f',
+    '_id': 'I',
+    '_remember': 'r',
+    '_permanent': 'P',
+}
+_KEYS_BY_ALIAS = {alias: key for key, alias in KEY_ALIASES.items()}
+# Prefix for keys that would otherwise be mistaken for an alias
+_ESCAPE = '~'
+
+_SID_PATTERN = re.compile(r'^[A-Za-z0-9_-]{16,128}$')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    key BLOB PRIMARY KEY,
+    data BLOB NOT NULL,
+    expiry REAL NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS ix_sessions_expiry ON sessions (expiry);
+"""
+
+
+class SessionSerializer:
+    """Tagged JSON with short keys for the fields every logged-in session has."""
+
+    def __init__(self):
+        self._json = TaggedJSONSerializer()
+
+    def dumps(self, data: Dict) -> bytes:
+        packed = {}
+        for key, value in data.items():
+            if key in KEY_ALIASES:
+                key = KEY_ALIASES[key]
+            elif key in _KEYS_BY_ALIAS or key.startswith(_ESCAPE):
+                key = _ESCAPE + key
+            packed[key] = value
+        return self._json.dumps(packed).encode('utf-8')
+
+    def loads(self, payload: bytes) -> Dict:
+        data = {}
+        for key, value in self._json.loads(payload.decode('utf-8')).items():
+            if key in _KEYS_BY_ALIAS:
+                key = _KEYS_BY_ALIAS[key]
+            elif key.startswith(_ESCAPE):
+                key = key[len(_ESCAPE):]
+            data[key] = value
+        return data
+
+
+def storage_key(sid: str) -> bytes:
+    """Row key for ``sid``; matches the filesystem backend's file names."""
+    return hashlib.md5(f'session:{sid}'.encode('utf-8')).digest()
+
+
+class SQLiteSessionStore:
+    """The ``sessions`` table, with one connection per thread."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=5, isolation_level=None,
+                               check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        # WAL makes NORMAL crash-safe; only the last commits can be lost on power failure
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.executescript(SCHEMA)
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    def load(self, key: bytes, now: float) -> Optional[Tuple[bytes, float]]:
+        return self._connect().execute(
+            'SELECT data, expiry FROM sessions WHERE key = ? AND expiry > ?', (key, now)
+        ).fetchone()
+
+    def save(self, key: bytes, data: bytes, expiry: float) -> None:
+        self.save_many([(key, data, expiry)])
+
+    def save_many(self, rows: Iterable[Tuple[bytes, bytes, float]]) -> None:
+        conn = self._connect()
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.executemany(
+                'INSERT INTO sessions (key, data, expiry) VALUES (?, ?, ?) '
+                'ON CONFLICT (key) DO UPDATE SET data = excluded.data, expiry = excluded.expiry',
+                rows)
+
+    def delete(self, key: bytes) -> None:
+        self._connect().execute('DELETE FROM sessions WHERE key = ?', (key,))
+
+    def sweep(self, now: float, batch_size: int = 1000) -> int:
+        """Delete expired sessions ``batch_size`` rows per transaction."""
+        conn = self._connect()
+        deleted = 0
+        while True:
+            count = conn.execute(
+                'DELETE FROM sessions WHERE key IN '
+                '(SELECT key FROM sessions WHERE expiry <= ? LIMIT ?)', (now, batch_size)
+            ).rowcount
+            deleted += count
+            if count < batch_size:
+                return deleted
+
+    def count(self) -> int:
+        return self._connect().execute('SELECT COUNT(*) FROM sessions').fetchone()[0]
+
+
+class StoredSession(SecureCookieSession):
+    """A session dict that remembers the payload and expiry it was loaded with."""
+
+    def __init__(self, initial=None, sid: str = None, stored: Optional[bytes] = None,
+                 expiry: float = 0.0):
+        super().__init__(initial)
+        self.sid = sid
+        self.stored = stored
+        self.expiry = expiry
+        self.loaded_user_id = self.get('_user_id')
+
+    @property
+    def new(self) -> bool:
+        return self.stored is None
+
+
+class SQLiteSessionInterface(SessionInterface):
+    serializer = SessionSerializer()
+
+    def __init__(self, store: SQLiteSessionStore, touch_interval: float,
+                 sweep_interval: float, sweep_batch: int):
+        self.store = store
+        self.touch_interval = touch_interval
+        self.sweep_interval = sweep_interval
+        self.sweep_batch = sweep_batch
+        self._sweeper_pid = None
+        self._sweeper_lock = threading.Lock()
+
+    def _ensure_sweeper(self) -> None:
+        if self._sweeper_pid == os.getpid():
+            return
+        with self._sweeper_lock:
+            if self._sweeper_pid == os.getpid():
+                return
+            threading.Thread(target=self._sweep_forever, name='session-sweeper',
+                             daemon=True).start()
+            self._sweeper_pid = os.getpid()
+
+    def _sweep_forever(self) -> None:
+        while True:
+            try:
+                deleted = self.store.sweep(time.time(), self.sweep_batch)
+                if deleted:
+                    logger.info("Removed %d expired sessions", deleted)
+            except Exception:
+                logger.exception("Session sweep failed")
+            time.sleep(self.sweep_interval)
+
+    @staticmethod
+    def _new_session() -> StoredSession:
+        return StoredSession(sid=secrets.token_urlsafe(32))
+
+    def open_session(self, app, request) -> StoredSession:
+        self._ensure_sweeper()
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if not sid or not _SID_PATTERN.match(sid):
+            return self._new_session()
+        row = self.store.load(storage_key(sid), time.time())
+        if row is None:
+            # Never adopt an unknown id from the client
+            return self._new_session()
+        data, expiry = row
+        try:
+            initial = self.serializer.loads(data)
+        except ValueError:
+            logger.warning("Discarding unreadable session")
+            return self._new_session()
+        return StoredSession(initial, sid=sid, stored=data, expiry=expiry)
+
+    def save_session(self, app, session: StoredSession, response) -> None:
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if session.accessed:
+            response.vary.add('Cookie')
+
+        if not session:
+            if not session.new:
+                self.store.delete(storage_key(session.sid))
+                response.delete_cookie(name, domain=domain, path=path,
+                                       secure=self.get_cookie_secure(app),
+                                       samesite=self.get_cookie_samesite(app),
+                                       httponly=self.get_cookie_httponly(app))
+            return
+
+        if not session.new and session.get('_user_id') != session.loaded_user_id:
+            # Log in/out: issue a new id so a planted session id is useless
+            self.store.delete(storage_key(session.sid))
+            session.sid = secrets.token_urlsafe(32)
+            session.stored = None
+
+        now = time.time()
+        lifetime = app.permanent_session_lifetime.total_seconds()
+        data = self.serializer.dumps(dict(session))
+        # Only extend the expiry once per touch interval, not on every request
+        stale = session.expiry - now < lifetime - self.touch_interval
+        if data == session.stored and not stale:
+            return
+
+        self.store.save(storage_key(session.sid), data, now + lifetime)
+        response.set_cookie(name, session.sid,
+                            expires=self.get_expiration_time(app, session),
+                            httponly=self.get_cookie_httponly(app),
+                            domain=domain, path=path,
+                            secure=self.get_cookie_secure(app),
+                            samesite=self.get_cookie_samesite(app))
+
+
+class SessionStore:
+    """
+    Flask extension installing the SQLite session interface.
+
+    Config:
+        SESSION_STORE_PATH: SQLite file holding the sessions
+        SESSION_TOUCH_INTERVAL: Minimum seconds between expiry refreshes of an
+            unchanged session
+        SESSION_SWEEP_INTERVAL: Seconds between expired-session sweeps
+        SESSION_SWEEP_BATCH: Rows deleted per sweep transaction
+    """
+
+    def __init__(self, app=None):
+        self.store = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app) -> None:
+        app.config.setdefault('SESSION_STORE_PATH',
+                              os.path.join(app.instance_path, 'sessions.sqlite3'))
+        app.config.setdefault('SESSION_TOUCH_INTERVAL', 300)
+        app.config.setdefault('SESSION_SWEEP_INTERVAL', 300)
+        app.config.setdefault('SESSION_SWEEP_BATCH', 1000)
+        self.store = SQLiteSessionStore(app.config['SESSION_STORE_PATH'])
+        app.session_interface = SQLiteSessionInterface(
+            self.store,
+            touch_interval=float(app.config['SESSION_TOUCH_INTERVAL']),
+            sweep_interval=float(app.config['SESSION_SWEEP_INTERVAL']),
+            sweep_batch=int(app.config['SESSION_SWEEP_BATCH']))
+        app.extensions['session_store'] = self
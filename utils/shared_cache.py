@@ -0,0 +1,335 @@
+"""
+Flask-Caching backend shared by every worker on the host.
+
+The ``simple`` backend gives each gunicorn worker its own unbounded dict, so
+every worker misses on its own and recomputes the same values. This backend
+keeps entries in one SQLite file (WAL mode) that all workers read and write:
+
+- A value cached by one worker is a hit in all the others.
+- The total size of the entries is kept in ``cache_meta`` by triggers, in the
+  same transaction as each write. When a write takes it over
+  ``CACHE_MAX_BYTES``, expired entries are removed first and then the least
+  recently used ones. Reads refresh an entry's access time at most once per
+  ``CACHE_TOUCH_INTERVAL``, so a hot key does not write on every hit.
+- ``get_or_set()`` lets only one worker compute a missing value. The others
+  wait for it (up to ``CACHE_LOCK_TIMEOUT``) instead of all recomputing it.
+
+Values are pickled, like the other Flask-Caching backends.
+"""
+
+import logging
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+from flask_caching.backends.base import BaseCache
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS cache_entries (
+    key TEXT PRIMARY KEY,
+    value BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    expires REAL NOT NULL,
+    accessed REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_cache_entries_accessed ON cache_entries (accessed);
+CREATE INDEX IF NOT EXISTS ix_cache_entries_expires ON cache_entries (expires);
+CREATE TABLE IF NOT EXISTS cache_locks (
+    key TEXT PRIMARY KEY,
+    expires REAL NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS cache_meta (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+) WITHOUT ROWID;
+INSERT OR IGNORE INTO cache_meta (name, value) VALUES ('bytes', 0), ('evictions', 0);
+CREATE TRIGGER IF NOT EXISTS cache_entries_insert AFTER INSERT ON cache_entries BEGIN
+    UPDATE cache_meta SET value = value + NEW.size WHERE name = 'bytes';
+END;
+CREATE TRIGGER IF NOT EXISTS cache_entries_update AFTER UPDATE OF size ON cache_entries BEGIN
+    UPDATE cache_meta SET value = value + NEW.size - OLD.size WHERE name = 'bytes';
+END;
+CREATE TRIGGER IF NOT EXISTS cache_entries_delete AFTER DELETE ON cache_entries BEGIN
+    UPDATE cache_meta SET value = value - OLD.size WHERE name = 'bytes';
+END;
+"""
+
+_ENTRY_OVERHEAD = 64  # bytes of row and index bookkeeping counted per entry
+_WAIT_INTERVAL = 0.05
+
+_MISSING = object()
+
+
+class SQLiteCache(BaseCache):
+    """
+    Cache entries in a SQLite file shared by all processes on the host.
+
+    Use it with ``CACHE_TYPE = 'utils.shared_cache.SQLiteCache'``.
+
+    Config:
+        CACHE_SQLITE_PATH: SQLite file holding the cache
+            (default ``instance/cache.sqlite3``)
+        CACHE_MAX_BYTES: Total size of the cached values before the least
+            recently used are evicted
+        CACHE_TOUCH_INTERVAL: Minimum seconds between access-time updates
+            of an entry
+        CACHE_LOCK_TIMEOUT: Seconds ``get_or_set()`` waits for another
+            worker computing the same key before computing it itself
+    """
+
+    def __init__(self, path: str, max_bytes: int = 64 * 1024 * 1024,
+                 default_timeout: int = 300, touch_interval: float = 10,
+                 lock_timeout: float = 30, ignore_errors: bool = False):
+        super().__init__(default_timeout=default_timeout)
+        self.path = path
+        self.max_bytes = max_bytes
+        self.touch_interval = touch_interval
+        self.lock_timeout = lock_timeout
+        self.ignore_errors = ignore_errors
+        self._local = threading.local()
+        # Per-worker counters; sizes and evictions are read from the shared file
+        self.hits = 0
+        self.misses = 0
+        self.waits = 0
+
+    @classmethod
+    def factory(cls, app, config, args, kwargs):
+        path = config.get('CACHE_SQLITE_PATH') or os.path.join(app.instance_path, 'cache.sqlite3')
+        args.insert(0, path)
+        kwargs.update(
+            max_bytes=int(config.get('CACHE_MAX_BYTES', 64 * 1024 * 1024)),
+            touch_interval=float(config.get('CACHE_TOUCH_INTERVAL', 10)),
+            lock_timeout=float(config.get('CACHE_LOCK_TIMEOUT', 30)),
+            ignore_errors=config['CACHE_IGNORE_ERRORS'],
+        )
+        return cls(*args, **kwargs)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=5, isolation_level=None,
+                               check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        # A cache can afford to lose the last commits on power failure
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.executescript(SCHEMA)
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    def _expires(self, timeout: Optional[int], now: float) -> float:
+        timeout = self._normalize_timeout(timeout)
+        return now + timeout if timeout > 0 else 0
+
+    def _load(self, key: str) -> Any:
+        """The value under ``key``, or ``_MISSING``; does not count hits."""
+        conn = self._connect()
+        now = time.time()
+        row = conn.execute(
+            'SELECT value, accessed FROM cache_entries '
+            'WHERE key = ? AND (expires = 0 OR expires > ?)', (key, now)
+        ).fetchone()
+        if row is None:
+            return _MISSING
+        value, accessed = row
+        if now - accessed >= self.touch_interval:
+            conn.execute('UPDATE cache_entries SET accessed = ? WHERE key = ?', (now, key))
+        try:
+            return pickle.loads(value)
+        except Exception:
+            logger.warning("Discarding unreadable cache entry %s", key)
+            conn.execute('DELETE FROM cache_entries WHERE key = ?', (key,))
+            return _MISSING
+
+    def get(self, key: str) -> Any:
+        value = self._load(key)
+        if value is _MISSING:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return value
+
+    def has(self, key: str) -> bool:
+        return self._connect().execute(
+            'SELECT 1 FROM cache_entries WHERE key = ? AND (expires = 0 OR expires > ?)',
+            (key, time.time())
+        ).fetchone() is not None
+
+    def _write(self, key: str, value: Any, timeout: Optional[int], replace: bool) -> bool:
+        payload = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        size = len(payload) + len(key) + _ENTRY_OVERHEAD
+        if size > self.max_bytes:
+            return False
+        now = time.time()
+        conn = self._connect()
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            if replace:
+                conn.execute(
+                    'INSERT INTO cache_entries (key, value, size, expires, accessed) '
+                    'VALUES (?, ?, ?, ?, ?) ON CONFLICT (key) DO UPDATE SET '
+                    'value = excluded.value, size = excluded.size, '
+                    'expires = excluded.expires, accessed = excluded.accessed',
+                    (key, payload, size, self._expires(timeout, now), now))
+            else:
+                # An expired entry does not count as present
+                conn.execute('DELETE FROM cache_entries WHERE key = ? AND expires != 0 '
+                             'AND expires <= ?', (key, now))
+                if conn.execute(
+                        'INSERT OR IGNORE INTO cache_entries (key, value, size, expires, accessed) '
+                        'VALUES (?, ?, ?, ?, ?)',
+                        (key, payload, size, self._expires(timeout, now), now)).rowcount == 0:
+                    return False
+            self._evict(conn, now)
+        return True
+
+    def _evict(self, conn: sqlite3.Connection, now: float) -> None:
+        """Bring the total size back under ``max_bytes``: expired entries first, then LRU."""
+        if self._bytes(conn) <= self.max_bytes:
+            return
+        conn.execute('DELETE FROM cache_entries WHERE expires != 0 AND expires <= ?', (now,))
+        excess = self._bytes(conn) - self.max_bytes
+        if excess <= 0:
+            return
+        # Walk the access-time index only as far as needed to free the excess
+        victims = []
+        for key, size in conn.execute('SELECT key, size FROM cache_entries ORDER BY accessed'):
+            victims.append((key,))
+            excess -= size
+            if excess <= 0:
+                break
+        conn.executemany('DELETE FROM cache_entries WHERE key = ?', victims)
+        conn.execute("UPDATE cache_meta SET value = value + ? WHERE name = 'evictions'",
+                     (len(victims),))
+
+    @staticmethod
+    def _bytes(conn: sqlite3.Connection) -> int:
+        return conn.execute("SELECT value FROM cache_meta WHERE name = 'bytes'").fetchone()[0]
+
+    def set(self, key: str, value: Any, timeout: Optional[int] = None) -> bool:
+        return self._write(key, value, timeout, replace=True)
+
+    def add(self, key: str, value: Any, timeout: Optional[int] = None) -> bool:
+        return self._write(key, value, timeout, replace=False)
+
+    def delete(self, key: str) -> bool:
+        return self._connect().execute(
+            'DELETE FROM cache_entries WHERE key = ?', (key,)).rowcount > 0
+
+    def clear(self) -> bool:
+        conn = self._connect()
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute('DELETE FROM cache_entries')
+            conn.execute('DELETE FROM cache_locks')
+        return True
+
+    def inc(self, key: str, delta: int = 1) -> Optional[int]:
+        conn = self._connect()
+        now = time.time()
+        with conn:
+            # Read and write under the write lock, so no increment is lost
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute(
+                'SELECT value, expires FROM cache_entries '
+                'WHERE key = ? AND (expires = 0 OR expires > ?)', (key, now)
+            ).fetchone()
+            value = (pickle.loads(row[0]) if row else 0) + delta
+            payload = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+            conn.execute(
+                'INSERT INTO cache_entries (key, value, size, expires, accessed) '
+                'VALUES (?, ?, ?, ?, ?) ON CONFLICT (key) DO UPDATE SET '
+                'value = excluded.value, size = excluded.size, '
+                'expires = excluded.expires, accessed = excluded.accessed',
+                (key, payload, len(payload) + len(key) + _ENTRY_OVERHEAD,
+                 row[1] if row else self._expires(None, now), now))
+            self._evict(conn, now)
+        return value
+
+    def dec(self, key: str, delta: int = 1) -> Optional[int]:
+        return self.inc(key, -delta)
+
+    def _acquire(self, key: str) -> bool:
+        """Take the computing lease on ``key``, unless another worker holds a live one."""
+        now = time.time()
+        conn = self._connect()
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute('DELETE FROM cache_locks WHERE key = ? AND expires <= ?', (key, now))
+            return conn.execute(
+                'INSERT OR IGNORE INTO cache_locks (key, expires) VALUES (?, ?)',
+                (key, now + self.lock_timeout)).rowcount == 1
+
+    def _release(self, key: str) -> None:
+        self._connect().execute('DELETE FROM cache_locks WHERE key = ?', (key,))
+
+    def get_or_set(self, key: str, build: Callable[[], Any],
+                   timeout: Optional[int] = None) -> Any:
+        """
+        Return the value under ``key``, computing and storing it on a miss.
+
+        Only one worker computes a missing value; the others wait for it to
+        appear. If the computing worker fails or takes longer than
+        ``lock_timeout``, a waiting worker takes over.
+
+        Args:
+            key: Cache key
+            build: Computes the value
+            timeout: Seconds to keep the value (the default timeout if None)
+        """
+        value = self._load(key)
+        if value is not _MISSING:
+            self.hits += 1
+            return value
+        self.misses += 1
+        waited = False
+        while not self._acquire(key):
+            if not waited:
+                self.waits += 1
+                waited = True
+            time.sleep(_WAIT_INTERVAL)
+            value = self._load(key)
+            if value is not _MISSING:
+                return value
+        try:
+            # Another worker may have stored it between the miss and the lease
+            value = self._load(key)
+            if value is _MISSING:
+                value = build()
+                self.set(key, value, timeout)
+            return value
+        finally:
+            self._release(key)
+
+    def stats(self) -> Dict[str, int]:
+        """Hit/miss counters of this worker, and the shared entry count, size and evictions."""
+        conn = self._connect()
+        meta = dict(conn.execute('SELECT name, value FROM cache_meta'))
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'waits': self.waits,
+            'entries': conn.execute('SELECT COUNT(*) FROM cache_entries').fetchone()[0],
+            'bytes': meta['bytes'],
+            'max_bytes': self.max_bytes,
+            'evictions': meta['evictions'],
+        }
+
+
+def get_or_set(backend: BaseCache, key: str, build: Callable[[], Any],
+               timeout: Optional[int] = None) -> Any:
+    """``backend.get_or_set()``, or a plain get-then-set on backends without it."""
+    if isinstance(backend, SQLiteCache):
+        return backend.get_or_set(key, build, timeout)
+    value = backend.get(key)
+    if value is None:
+        value = build()
+        backend.set(key, value, timeout)
+    return value
@@ -0,0 +1,251 @@
+"""
+Compact vector signatures.
+
+The signature pad (``static/js/signature.js``) submits its strokes rather than
+a PNG of the canvas, as a ``data:application/x-signature-strokes;base64,...``
+URL. The binary format is:
+
+    b'SG'  version (1 byte)
+    width, height                      varint
+    stroke count                       varint
+    per stroke: point count            varint
+                per point: dx, dy      zigzag varint
+
+Points are whole canvas pixels, each relative to the previous point of the
+stroke (the first one to the origin). Consecutive points of a stroke are a
+few pixels apart, so most deltas take one byte, and a typical signature
+encodes to a few hundred bytes instead of the tens of KB of a PNG.
+
+Signatures are kept in the blob store like any other file. They are drawn as
+SVG (for the browser) or PNG (for email and anything else that cannot show
+SVG) on first request, and the render is stored next to the signature.
+"""
+
+import base64
+import binascii
+import struct
+import zlib
+from typing import List, Optional, Tuple
+
+from flask import url_for
+
+from utils.blob_store import InvalidBlob, is_data_url, is_ref
+
+CONTENT_TYPE = 'application/x-signature-strokes'
+MAGIC = b'SG'
+VERSION = 1
+
+MAX_SIZE = 4096
+MAX_STROKES = 1000
+MAX_POINTS = 50000
+MAX_LENGTH = 100000  # total pixels of ink, which bounds the cost of a PNG render
+
+PEN_WIDTH = 2
+
+Stroke = List[Tuple[int, int]]
+
+
+class InvalidSignature(InvalidBlob):
+    """Raised for stroke data that cannot be decoded."""
+
+
+class Signature:
+    """Strokes drawn on a ``width`` x ``height`` canvas."""
+
+    __slots__ = ('width', 'height', 'strokes')
+
+    def __init__(self, width: int, height: int, strokes: List[Stroke]):
+        self.width = width
+        self.height = height
+        self.strokes = strokes
+
+
+def _zigzag(n: int) -> int:
+    return (n << 1) ^ (n >> 63)
+
+
+def _unzigzag(n: int) -> int:
+    return (n >> 1) ^ -(n & 1)
+
+
+def _write_varint(out: bytearray, n: int) -> None:
+    while n >= 0x80:
+        out.append((n & 0x7f) | 0x80)
+        n >>= 7
+    out.append(n)
+
+
+def encode(signature: Signature) -> bytes:
+    """Encode ``signature`` in the binary format; the inverse of :func:`decode`."""
+    out = bytearray(MAGIC)
+    out.append(VERSION)
+    _write_varint(out, signature.width)
+    _write_varint(out, signature.height)
+    _write_varint(out, len(signature.strokes))
+    for stroke in signature.strokes:
+        _write_varint(out, len(stroke))
+        px = py = 0
+        for x, y in stroke:
+            _write_varint(out, _zigzag(x - px))
+            _write_varint(out, _zigzag(y - py))
+            px, py = x, y
+    return bytes(out)
+
+
+def decode(data: bytes) -> Signature:
+    """
+    Decode and validate stroke data.
+
+    Raises:
+        InvalidSignature: If the data is malformed or exceeds the size limits
+    """
+    if data[:2] != MAGIC or len(data) < 3:
+        raise InvalidSignature("Not signature stroke data")
+    if data[2] != VERSION:
+        raise InvalidSignature(f"Unsupported signature version {data[2]}")
+    pos = 3
+
+    def varint() -> int:
+        nonlocal pos
+        result = shift = 0
+        while True:
+            if pos >= len(data) or shift > 28:
+                raise InvalidSignature("Truncated signature data")
+            byte = data[pos]
+            pos += 1
+            result |= (byte & 0x7f) << shift
+            if byte < 0x80:
+                return result
+            shift += 7
+
+    width, height = varint(), varint()
+    if not (0 < width <= MAX_SIZE and 0 < height <= MAX_SIZE):
+        raise InvalidSignature(f"Invalid canvas size {width}x{height}")
+    count = varint()
+    if count > MAX_STROKES:
+        raise InvalidSignature(f"Too many strokes ({count})")
+    strokes, total, length = [], 0, 0
+    for _ in range(count):
+        points = varint()
+        total += points
+        if total > MAX_POINTS:
+            raise InvalidSignature("Too many points")
+        stroke, x, y = [], 0, 0
+        for _ in range(points):
+            dx, dy = _unzigzag(varint()), _unzigzag(varint())
+            if stroke:
+                length += max(abs(dx), abs(dy))
+            x, y = x + dx, y + dy
+            # The pointer may leave the canvas mid-stroke, but not by far
+            if not (-width <= x <= 2 * width and -height <= y <= 2 * height):
+                raise InvalidSignature(f"Point ({x}, {y}) far outside the canvas")
+            stroke.append((x, y))
+        if stroke:
+            strokes.append(stroke)
+    if length > MAX_LENGTH:
+        raise InvalidSignature("Strokes too long")
+    if pos != len(data):
+        raise InvalidSignature("Trailing bytes after signature data")
+    return Signature(width, height, strokes)
+
+
+def render_svg(data: bytes) -> bytes:
+    """Draw the strokes as an SVG document, one relative path per stroke."""
+    signature = decode(data)
+    paths = []
+    for stroke in signature.strokes:
+        (x, y), rest = stroke[0], stroke[1:]
+        # A single point still needs a (zero-length) segment for its round cap
+        moves = ' '.join(f"{bx - ax} {by - ay}" for (ax, ay), (bx, by) in zip(stroke, rest)) or '0 0'
+        paths.append(f"M{x} {y}l{moves}")
+    return (
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{signature.width}" '
+        f'height="{signature.height}" viewBox="0 0 {signature.width} {signature.height}">'
+        f'<path d="{"".join(paths)}" fill="none" stroke="#000" stroke-width="{PEN_WIDTH}" '
+        f'stroke-linecap="round" stroke-linejoin="round"/></svg>'
+    ).encode('ascii')
+
+
+def _png_chunk(kind: bytes, body: bytes) -> bytes:
+    return struct.pack('>I', len(body)) + kind + body + struct.pack('>I', zlib.crc32(kind + body))
+
+
+def render_png(data: bytes) -> bytes:
+    """
+    Draw the strokes as a black-on-transparent PNG.
+
+    Lines are drawn by stamping a pen-sized disc every half pixel along each
+    segment; plain Python is enough for a canvas of this size.
+    """
+    signature = decode(data)
+    width, height = signature.width, signature.height
+    alpha = bytearray(width * height)
+    radius = PEN_WIDTH / 2
+    reach = int(radius + 1)
+    disc = [(dx, dy) for dy in range(-reach, reach + 1) for dx in range(-reach, reach + 1)
+            if dx * dx + dy * dy <= radius * radius + 0.5]
+
+    def stamp(cx: float, cy: float) -> None:
+        ix, iy = round(cx), round(cy)
+        for dx, dy in disc:
+            x, y = ix + dx, iy + dy
+            if 0 <= x < width and 0 <= y < height:
+                alpha[y * width + x] = 255
+
+    for stroke in signature.strokes:
+        stamp(*stroke[0])
+        for (ax, ay), (bx, by) in zip(stroke, stroke[1:]):
+            steps = max(1, int(max(abs(bx - ax), abs(by - ay)) * 2))
+            for i in range(1, steps + 1):
+                stamp(ax + (bx - ax) * i / steps, ay + (by - ay) * i / steps)
+
+    # Grayscale + alpha: every pixel is black, only its opacity varies
+    raw = bytearray()
+    for y in range(height):
+        raw.append(0)  # no filter
+        row = alpha[y * width:(y + 1) * width]
+        pixels = bytearray(2 * width)
+        pixels[1::2] = row
+        raw += pixels
+    return (b'\x89PNG\r\n\x1a\n'
+            + _png_chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 4, 0, 0, 0))
+            + _png_chunk(b'IDAT', zlib.compress(bytes(raw), 9))
+            + _png_chunk(b'IEND', b''))
+
+
+RENDERERS = {
+    'svg': ('image/svg+xml', render_svg),
+    'png': ('image/png', render_png),
+}
+
+
+def is_signature(value) -> bool:
+    """True if ``value`` references stored stroke data."""
+    return is_ref(value) and value.endswith('.sig')
+
+
+def store_signature(store, value: Optional[str]) -> Optional[str]:
+    """
+    Store a submitted signature and return the value for the row.
+
+    Stroke data is validated before it is stored. PNG data URLs from older
+    pages and plain values are handled by :meth:`BlobStore.store_inline`.
+
+    Raises:
+        InvalidBlob: If the submitted data cannot be stored
+    """
+    if is_data_url(value) and value[5:].lower().startswith(CONTENT_TYPE + ';'):
+        try:
+            data = base64.b64decode(value.split(',', 1)[1], validate=True)
+        except (binascii.Error, ValueError) as e:
+            raise InvalidSignature(f"Invalid base64 payload: {e}") from e
+        decode(data)
+        return store.put(data, CONTENT_TYPE)
+    return store.store_inline(value)
+
+
+def signature_url(value: Optional[str], fmt: str = 'svg') -> Optional[str]:
+    """URL of the image of a stored signature, or None for empty or legacy inline values."""
+    if is_signature(value):
+        return url_for('signature_image', ref=value, fmt=fmt)
+    return url_for('blob', ref=value) if is_ref(value) else None
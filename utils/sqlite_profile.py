@@ -0,0 +1,272 @@
+"""
+Production settings for the SQLite database.
+
+With the default rollback journal, a reader blocks a committing writer and
+every gunicorn worker (and their background threads) competes for one file
+lock. Under load, "database is locked" errors then surface as 500s. This
+module:
+
+- sets pragmas on every new connection (``SQLITE_PRAGMAS``): WAL, so readers
+  never block the writer, ``synchronous=NORMAL``, a ``busy_timeout``, a
+  larger page cache, memory-mapped reads and in-memory temp tables;
+- serializes write transactions within a process: the first INSERT/UPDATE/
+  DELETE of a transaction waits on a lock that is released after the commit
+  or rollback. Threads of one worker then hand the database over directly
+  instead of polling SQLite's busy handler, which cuts tail latency;
+- retries statements that still fail with "database is locked" after the busy
+  timeout, with jittered exponential backoff (``SQLITE_WRITE_RETRIES``).
+  pysqlite only opens a transaction at the first INSERT/UPDATE/DELETE, so a
+  locked statement has not taken effect and can be safely re-run;
+- checkpoints the WAL from a background thread. One worker per database
+  holds a file lock and runs a PASSIVE checkpoint every
+  ``SQLITE_CHECKPOINT_INTERVAL`` seconds. It truncates the WAL once the file
+  grows past ``SQLITE_CHECKPOINT_TRUNCATE_MB``. ``wal_autocheckpoint`` stays
+  on as a backstop, at a higher threshold;
+- answers requests that still hit a locked database with a 503 and
+  ``Retry-After`` instead of a 500.
+
+Nothing is changed for other databases.
+"""
+
+import fcntl
+import logging
+import os
+import random
+import re
+import sqlite3
+import threading
+import time
+from typing import Dict
+
+from flask import jsonify, make_response, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import OperationalError
+
+logger = logging.getLogger(__name__)
+
+_WRITE = re.compile(r'\s*(INSERT|UPDATE|DELETE|REPLACE)\b', re.IGNORECASE)
+
+DEFAULT_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,           # ms
+    'cache_size': -32000,           # KiB, i.e. 32 MB per connection
+    'mmap_size': 256 * 1024 * 1024,
+    'temp_store': 'MEMORY',
+    'wal_autocheckpoint': 4000,     # pages; the background checkpointer normally runs first
+}
+
+
+def is_locked_error(exc: BaseException) -> bool:
+    """True for SQLite's "database is locked" / "database table is locked"."""
+    orig = getattr(exc, 'orig', exc)
+    return isinstance(orig, sqlite3.OperationalError) and 'locked' in str(orig)
+
+
+def install(engine: Engine, pragmas: Dict = None, retries: int = 5, retry_delay: float = 0.05) -> None:
+    """
+    Apply the pragmas, write serialization and locked-statement retry to a
+    SQLite ``engine``.
+
+    Args:
+        engine: Engine to configure; connections opened before this call are
+            not changed
+        pragmas: Pragmas to set on each connection (default ``DEFAULT_PRAGMAS``)
+        retries: Times a locked statement is re-run before the error is raised
+        retry_delay: Backoff before the first retry, doubled for each one
+    """
+    pragmas = DEFAULT_PRAGMAS if pragmas is None else pragmas
+
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in pragmas.items():
+                cursor.execute(f'PRAGMA {name}={value}')
+        finally:
+            cursor.close()
+
+    write_lock = threading.Lock()
+    lock_timeout = int(pragmas.get('busy_timeout', 5000)) / 1000
+    holders = set()  # ids of DBAPI connections whose write transaction holds write_lock
+
+    def serialize(cursor, statement):
+        # pysqlite opens the transaction at the first write; take the lock just before it
+        connection = cursor.connection
+        if connection.in_transaction or not _WRITE.match(statement):
+            return
+        if id(connection) not in holders and write_lock.acquire(timeout=lock_timeout):
+            holders.add(id(connection))
+
+    def release(connection):
+        # SQLAlchemy passes the pool's proxy; the cursor knows the raw connection
+        key = id(getattr(connection, 'dbapi_connection', connection))
+        if key in holders:
+            holders.discard(key)
+            write_lock.release()
+
+    def retry(execute, *args):
+        for attempt in range(retries + 1):
+            try:
+                execute(*args)
+                return True
+            except sqlite3.OperationalError as e:
+                if attempt == retries or 'locked' not in str(e):
+                    raise
+                delay = retry_delay * 2 ** attempt * random.uniform(0.5, 1.5)
+                logger.info("Database locked, retrying in %.0f ms", delay * 1000)
+                time.sleep(delay)
+
+    @event.listens_for(engine, 'do_execute')
+    def do_execute(cursor, statement, parameters, context):
+        serialize(cursor, statement)
+        return retry(cursor.execute, statement, parameters)
+
+    @event.listens_for(engine, 'do_execute_no_params')
+    def do_execute_no_params(cursor, statement, context):
+        serialize(cursor, statement)
+        return retry(cursor.execute, statement)
+
+    @event.listens_for(engine, 'do_executemany')
+    def do_executemany(cursor, statement, parameters, context):
+        serialize(cursor, statement)
+        return retry(cursor.executemany, statement, parameters)
+
+    # The lock is released once the DBAPI commit/rollback has finished, which
+    # ConnectionEvents (fired before it) cannot observe
+    dialect = engine.dialect
+    for name in ('do_commit', 'do_rollback'):
+        def finish(dbapi_connection, _end=getattr(dialect, name)):
+            try:
+                _end(dbapi_connection)
+            finally:
+                release(dbapi_connection)
+        setattr(dialect, name, finish)
+
+    @event.listens_for(engine, 'invalidate')
+    def invalidated(dbapi_connection, connection_record, exception):
+        release(dbapi_connection)
+
+    @event.listens_for(engine, 'close')
+    def closed(dbapi_connection, connection_record):
+        release(dbapi_connection)
+
+
+class WALCheckpointer:
+    """Background WAL checkpoints, run by whichever worker holds the lock file."""
+
+    def __init__(self, path: str, interval: float, truncate_bytes: int):
+        self.path = path
+        self.interval = interval
+        self.truncate_bytes = truncate_bytes
+        self._lock_fd = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+    def ensure_started(self) -> None:
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            # A lock inherited over fork is shared with the parent; take our own
+            self._lock_fd = None
+            threading.Thread(target=self._run, name='wal-checkpointer', daemon=True).start()
+            self._pid = os.getpid()
+
+    def _is_leader(self) -> bool:
+        if self._lock_fd is not None:
+            return True
+        fd = os.open(f'{self.path}-checkpoint.lock', os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        self._lock_fd = fd
+        return True
+
+    def _run(self) -> None:
+        while True:
+            time.sleep(self.interval)
+            try:
+                if self._is_leader():
+                    self.checkpoint()
+            except Exception:
+                logger.exception("WAL checkpoint failed")
+
+    def checkpoint(self) -> None:
+        try:
+            wal_size = os.path.getsize(f'{self.path}-wal')
+        except FileNotFoundError:
+            return
+        mode = 'TRUNCATE' if wal_size >= self.truncate_bytes else 'PASSIVE'
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            busy, frames, done = conn.execute(f'PRAGMA wal_checkpoint({mode})').fetchone()
+        finally:
+            conn.close()
+        logger.debug("WAL checkpoint (%s): %s of %s frames, busy=%s", mode, done, frames, busy)
+
+
+class SQLiteProfile:
+    """
+    Flask extension applying the production SQLite settings to ``db``.
+
+    Config:
+        SQLITE_PROFILE: Apply the settings (default True; ignored for other
+            databases)
+        SQLITE_PRAGMAS: Pragmas merged over ``DEFAULT_PRAGMAS``
+        SQLITE_WRITE_RETRIES: Retries of a statement that hit a locked database
+        SQLITE_RETRY_DELAY: Seconds before the first retry
+        SQLITE_CHECKPOINT_INTERVAL: Seconds between background checkpoints
+        SQLITE_CHECKPOINT_TRUNCATE_MB: WAL size at which checkpoints truncate it
+    """
+
+    def __init__(self, app=None, db=None):
+        self.checkpointer = None
+        if app is not None:
+            self.init_app(app, db)
+
+    def init_app(self, app, db) -> None:
+        app.config.setdefault('SQLITE_PROFILE', True)
+        app.config.setdefault('SQLITE_PRAGMAS', {})
+        app.config.setdefault('SQLITE_WRITE_RETRIES', 5)
+        app.config.setdefault('SQLITE_RETRY_DELAY', 0.05)
+        app.config.setdefault('SQLITE_CHECKPOINT_INTERVAL', 30)
+        app.config.setdefault('SQLITE_CHECKPOINT_TRUNCATE_MB', 64)
+        app.extensions['sqlite_profile'] = self
+        if not app.config['SQLITE_PROFILE']:
+            return
+        with app.app_context():
+            engine = db.engine
+        if engine.dialect.name != 'sqlite':
+            return
+
+        install(engine, dict(DEFAULT_PRAGMAS, **app.config['SQLITE_PRAGMAS']),
+                retries=int(app.config['SQLITE_WRITE_RETRIES']),
+                retry_delay=float(app.config['SQLITE_RETRY_DELAY']))
+        app.register_error_handler(OperationalError, self._handle_operational_error)
+
+        path = engine.url.database
+        if path and path != ':memory:' and not path.startswith('file:'):
+            self.checkpointer = WALCheckpointer(
+                path, interval=float(app.config['SQLITE_CHECKPOINT_INTERVAL']),
+                truncate_bytes=int(app.config['SQLITE_CHECKPOINT_TRUNCATE_MB']) * 1024 * 1024)
+            app.before_request(self.checkpointer.ensure_started)
+
+    @staticmethod
+    def _handle_operational_error(e):
+        if not is_locked_error(e):
+            raise e
+        logger.warning("Database still locked after retries: %s %s", request.method, request.path)
+        message = 'The server is busy, please try again in a moment.'
+        if request.is_json or request.accept_mimetypes.best_match(
+                ['text/html', 'application/json']) == 'application/json':
+            response = jsonify({'success': False, 'message': message})
+        else:
+            response = make_response(message)
+        response.status_code = 503
+        response.headers['Retry-After'] = '1'
+        return response
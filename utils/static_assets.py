@@ -0,0 +1,96 @@
+"""
+Fingerprinted static assets.
+
+``python build_static.py`` downloads the pinned front-end libraries into
+``static/vendor/``, then copies every file under ``static/`` to
+``static/dist/`` with a hash of its content in the name
+(``css/style.css`` -> ``dist/css/style.1a2b3c4d5e.css``), next to gzip
+(and, if the ``brotli`` package is installed, brotli) compressed copies.
+``static/dist/manifest.json`` maps each source path to its built path.
+
+With a manifest present, ``url_for('static', filename='css/style.css')``
+returns the fingerprinted URL. Its content never changes, so nginx serves
+``/static/dist/`` from disk with a year-long immutable cache and the
+precompressed files, and no static request reaches a Python worker.
+Without one (a development checkout that was never built), URLs point at
+the source files and :func:`vendor_url` falls back to the public CDN.
+"""
+
+import json
+import logging
+import os
+from typing import Dict
+
+from flask import url_for
+
+logger = logging.getLogger(__name__)
+
+DIST_DIR = 'dist'
+MANIFEST = 'manifest.json'
+
+# Vendored libraries: file under static/vendor/ -> (source URL, SRI hash of the file)
+VENDOR = {
+    'bootstrap.min.css': (
+        'https://cdn.jsdelivr.net/npm/bootstrap@5.1.3/dist/css/bootstrap.min.css',
+        'sha384-1BmE4kWBq78iYhFldvKuhfTAU6auU8tT94WrHftjDbrCEXSU1oBoqyl2QvZ6jIW3',
+    ),
+    'bootstrap.bundle.min.js': (
+        'https://cdn.jsdelivr.net/npm/bootstrap@5.1.3/dist/js/bootstrap.bundle.min.js',
+        'sha384-ka7Sk0Gln4gmtz2MlQnikT1wXgYsOg+OMhuP+IlRH9sENBO0LRn5q+8nbTov4+1p',
+    ),
+    'jquery.min.js': (
+        'https://code.jquery.com/jquery-3.6.0.min.js',
+        'sha256-/xUj+3OJU5yExlq6GSYGSHk7tPXikynS7ogEvDej/m4=',
+    ),
+}
+
+
+def load_manifest(static_folder: str) -> Dict[str, str]:
+    """Source path -> fingerprinted path, or an empty dict if the assets were not built."""
+    path = os.path.join(static_folder, DIST_DIR, MANIFEST)
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except ValueError:
+        logger.error("Ignoring unreadable static manifest %s; run build_static.py", path)
+        return {}
+
+
+class StaticAssets:
+    """
+    Flask extension resolving ``url_for('static', ...)`` through the manifest.
+
+    Config:
+        STATIC_MANIFEST: Use the fingerprinted files from
+            ``static/dist/manifest.json`` when present (default True)
+    """
+
+    def __init__(self, app=None):
+        self.manifest: Dict[str, str] = {}
+        self.static_folder = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app) -> None:
+        app.config.setdefault('STATIC_MANIFEST', True)
+        self.static_folder = app.static_folder
+        if app.config['STATIC_MANIFEST']:
+            self.manifest = load_manifest(app.static_folder)
+        if not self.manifest:
+            logger.info("No static manifest; serving unfingerprinted assets")
+        app.url_defaults(self._fingerprint)
+        app.add_template_global(self.vendor_url)
+        app.extensions['static_assets'] = self
+
+    def _fingerprint(self, endpoint, values) -> None:
+        if endpoint == 'static' and values.get('filename') in self.manifest:
+            values['filename'] = self.manifest[values['filename']]
+
+    def vendor_url(self, name: str) -> str:
+        """URL of a vendored library, or its CDN URL if it has not been downloaded."""
+        filename = f'vendor/{name}'
+        if filename in self.manifest or os.path.exists(os.path.join(self.static_folder, filename)):
+            return url_for('static', filename=filename)
+        return VENDOR[name][0]
@@ -0,0 +1,210 @@
+"""
+Per-process cache for ``login_manager.user_loader``.
+
+``check_session_security`` touches ``current_user`` on every request, so
+without a cache each request (static files included) costs a ``user`` table
+round-trip. Each worker instead keeps a small TTL/LRU cache of lightweight
+:class:`CachedUser` records.
+
+Invalidation is driven by a shared version counter: an 8-byte integer in an
+mmap'd file that every worker on the host maps. Any committed change to a
+``User`` row (admin toggles, deletions, password changes and resets) bumps
+the counter after commit, and each worker drops its whole cache as soon as
+it sees a new value. Reading the counter is a memory read, not a syscall.
+The TTL bounds staleness for changes made outside this host.
+"""
+
+import fcntl
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from flask_login import UserMixin
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+
+from models import db, User
+
+logger = logging.getLogger(__name__)
+
+_SESSION_FLAG = 'user_cache_dirty'
+
+
+class CachedUser(UserMixin):
+    """The subset of ``User`` that request handling needs from ``current_user``."""
+
+    def __init__(self, id: int, email: str, is_admin: bool, password_version: str):
+        self.id = id
+        self.email = email
+        self.is_admin = bool(is_admin)
+        self.password_version = password_version
+
+    def get_id(self):
+        return f'{self.id}:{self.password_version}'
+
+    def __repr__(self):
+        return f'<CachedUser {self.id} {self.email}>'
+
+
+class VersionCounter:
+    """A 64-bit counter shared between processes through an mmap'd file."""
+
+    COUNTER = struct.Struct('<Q')
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._pid = None
+        self._fd = None
+        self._map = None
+
+    def _open(self) -> None:
+        # Reopen after fork for the same reason as MmapRateLimiter: flock
+        # must see a separate open file description per worker
+        if self._pid == os.getpid():
+            return
+        if self._map is not None:
+            self._map.close()
+            os.close(self._fd)
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            if os.fstat(fd).st_size != self.COUNTER.size:
+                os.ftruncate(fd, 0)
+                os.ftruncate(fd, self.COUNTER.size)
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        self._fd = fd
+        self._map = mmap.mmap(fd, self.COUNTER.size)
+        self._pid = os.getpid()
+
+    def read(self) -> int:
+        if self._pid != os.getpid():
+            with self._lock:
+                self._open()
+        return self.COUNTER.unpack_from(self._map, 0)[0]
+
+    def bump(self) -> int:
+        with self._lock:
+            self._open()
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                value = self.COUNTER.unpack_from(self._map, 0)[0] + 1
+                self.COUNTER.pack_into(self._map, 0, value)
+                return value
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+
+class UserCache:
+    """
+    Flask extension caching ``CachedUser`` records per worker.
+
+    Config:
+        USER_CACHE_SIZE: Maximum number of users kept per worker
+        USER_CACHE_TTL: Seconds a record is trusted without a reload
+        USER_CACHE_VERSION_FILE: Path of the shared version counter
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.counter = None
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._version = None
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app) -> None:
+        app.config.setdefault('USER_CACHE_SIZE', 1024)
+        app.config.setdefault('USER_CACHE_TTL', 300)
+        app.config.setdefault('USER_CACHE_VERSION_FILE',
+                              os.path.join(app.instance_path, 'user_cache.version'))
+        self.app = app
+        self.counter = VersionCounter(app.config['USER_CACHE_VERSION_FILE'])
+        app.extensions['user_cache'] = self
+
+        @event.listens_for(Session, 'after_flush')
+        def _note_user_writes(session, flush_context):
+            changed = list(session.new) + list(session.deleted) + [
+                obj for obj in session.dirty if session.is_modified(obj)]
+            if any(isinstance(obj, User) for obj in changed):
+                session.info[_SESSION_FLAG] = True
+
+        @event.listens_for(Session, 'do_orm_execute')
+        def _note_bulk_user_writes(orm_execute_state):
+            if not (orm_execute_state.is_update or orm_execute_state.is_delete):
+                return
+            mapper = orm_execute_state.bind_mapper
+            if mapper is not None and mapper.class_ is User:
+                orm_execute_state.session.info[_SESSION_FLAG] = True
+
+        @event.listens_for(Session, 'after_commit')
+        def _invalidate_after_commit(session):
+            if session.info.pop(_SESSION_FLAG, False):
+                self.invalidate()
+
+        @event.listens_for(Session, 'after_rollback')
+        def _forget_after_rollback(session):
+            session.info.pop(_SESSION_FLAG, None)
+
+    def invalidate(self) -> None:
+        """Drop cached users in every worker on this host."""
+        self.counter.bump()
+
+    def get(self, user_id: int) -> Optional[CachedUser]:
+        """Return the cached record for ``user_id``, loading it on a miss."""
+        version = self.counter.read()
+        now = time.monotonic()
+        with self._lock:
+            if version != self._version:
+                if self._entries:
+                    self.invalidations += 1
+                self._entries.clear()
+                self._version = version
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[1] > now:
+                self._entries.move_to_end(user_id)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+
+        user = self._load(user_id)
+        if user is None:
+            return None
+        with self._lock:
+            # A bump during the load means the row may already be stale
+            if self._version == version == self.counter.read():
+                self._entries[user_id] = (user, now + float(self.app.config['USER_CACHE_TTL']))
+                self._entries.move_to_end(user_id)
+                while len(self._entries) > int(self.app.config['USER_CACHE_SIZE']):
+                    self._entries.popitem(last=False)
+        return user
+
+    @staticmethod
+    def _load(user_id: int) -> Optional[CachedUser]:
+        row = db.session.execute(
+            select(User.id, User.email, User.is_admin, User.password_hash)
+            .where(User.id == user_id)
+        ).first()
+        if row is None:
+            return None
+        return CachedUser(row.id, row.email, row.is_admin,
+                          User.password_version_for(row.password_hash))
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'invalidations': self.invalidations,
+            'size': len(self._entries),
+        }
@@ -0,0 +1,172 @@
+"""
+Cheap data-version stamps.
+
+Each scope (``registrations``, ``users``, and ``forms:<user id>`` for one
+parent's registrations) has a row in ``data_versions`` holding a counter. The
+counter is incremented in the same transaction as any change to the scope's
+tables, so reading it is a single primary-key lookup that tells caches whether
+anything changed without touching the data itself.
+
+Changes are detected from ORM flushes and from bulk ``Query.update()`` /
+``Query.delete()`` calls and executemany UPDATEs, which bypass the flush.
+"""
+
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from flask import g, has_app_context
+from sqlalchemy import event, inspect, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+from sqlalchemy.sql import operators, visitors
+from sqlalchemy.sql.elements import BinaryExpression, BindParameter
+
+from models import db, DataVersion, FormData, User
+
+REGISTRATIONS = 'registrations'
+USERS = 'users'
+
+_BATCH_SIZE = 500
+
+# Mapped class -> scopes whose version must change when it is written
+SCOPES_BY_MODEL = {
+    FormData: (REGISTRATIONS,),
+    User: (USERS, REGISTRATIONS),  # registrations show the owner's email
+}
+
+
+def user_forms(user_id: int) -> str:
+    """Scope of one user's registrations."""
+    return f'forms:{user_id}'
+
+
+def _scopes_for(objects: Iterable) -> Set[str]:
+    scopes = set()
+    for obj in objects:
+        scopes.update(SCOPES_BY_MODEL.get(type(obj), ()))
+        if isinstance(obj, FormData):
+            # The owner, and the previous owner if it changed
+            history = inspect(obj).attrs.user_id.history
+            owners = {obj.user_id, *history.deleted}
+            scopes.update(user_forms(user_id) for user_id in owners if user_id is not None)
+    return scopes
+
+
+def bump(connection, scopes: Iterable[str]) -> None:
+    """Increment the version of each scope, creating missing rows."""
+    table = DataVersion.__table__
+    insert = postgresql.insert if connection.dialect.name == 'postgresql' else sqlite.insert
+    stmt = insert(table)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.scope],
+        set_={'version': table.c.version + 1, 'updated_at': stmt.excluded.updated_at},
+    )
+    # One executemany, in a fixed order so concurrent writers cannot deadlock
+    now = datetime.utcnow()
+    rows = [{'scope': scope, 'version': 1, 'updated_at': now} for scope in sorted(scopes)]
+    if rows:
+        connection.execute(stmt, rows)
+        if has_app_context():
+            # Versions this request read earlier are out of date
+            g.pop('_data_versions', None)
+
+
+Stamp = Tuple[int, Optional[datetime]]
+
+
+def current_stamps(scopes: Iterable[str], session=None) -> Dict[str, Stamp]:
+    """Return ``{scope: (version, updated_at)}``; scopes never written report ``(0, None)``."""
+    session = session or db.session
+    scopes = list(scopes)
+    rows = session.execute(
+        select(DataVersion.scope, DataVersion.version, DataVersion.updated_at)
+        .where(DataVersion.scope.in_(scopes))
+    )
+    stamps = dict.fromkeys(scopes, (0, None))
+    stamps.update({scope: (version, updated_at) for scope, version, updated_at in rows})
+    return stamps
+
+
+def request_stamps(scopes: Iterable[str]) -> Dict[str, Stamp]:
+    """:func:`current_stamps`, read once per request for all the callers that need them."""
+    known = g.setdefault('_data_versions', {})
+    scopes = list(scopes)
+    missing = [scope for scope in scopes if scope not in known]
+    if missing:
+        known.update(current_stamps(missing))
+    return {scope: known[scope] for scope in scopes}
+
+
+def current_versions(scopes: Iterable[str], session=None) -> Dict[str, int]:
+    """Return ``{scope: version}``; scopes never written report 0."""
+    return {scope: version for scope, (version, _) in current_stamps(scopes, session).items()}
+
+
+def current_version(scope: str, session=None) -> int:
+    return current_versions([scope], session)[scope]
+
+
+@event.listens_for(Session, 'after_flush')
+def _bump_after_flush(session, flush_context):
+    scopes = _scopes_for(session.new) | _scopes_for(session.deleted)
+    scopes |= _scopes_for(obj for obj in session.dirty if session.is_modified(obj))
+    if scopes:
+        bump(session.connection(), scopes)
+
+
+def _id_parameter(statement, id_column) -> str:
+    """Name of the parameter an executemany UPDATE/DELETE matches ``id_column`` against."""
+    if statement.whereclause is not None:
+        for element in visitors.iterate(statement.whereclause):
+            if (isinstance(element, BinaryExpression) and element.operator is operators.eq
+                    and id_column.shares_lineage(element.left)
+                    and isinstance(element.right, BindParameter)):
+                return element.right.key
+    return id_column.key  # ORM bulk UPDATE by primary key
+
+
+def bulk_write_ids(orm_execute_state, connection) -> List:
+    """
+    Primary keys of the rows a bulk UPDATE/DELETE is about to write.
+
+    Works for ``Query.update()``/``Query.delete()`` (the rows matching the
+    WHERE clause, read with one query) and for executemany statements (one
+    id per parameter set). Call it before the statement runs.
+    """
+    id_column = orm_execute_state.bind_mapper.primary_key[0]
+    if isinstance(orm_execute_state.parameters, list):
+        key = _id_parameter(orm_execute_state.statement, id_column)
+        return [params[key] for params in orm_execute_state.parameters]
+    query = select(id_column)
+    if orm_execute_state.statement.whereclause is not None:
+        query = query.where(orm_execute_state.statement.whereclause)
+    return list(connection.execute(query).scalars())
+
+
+def _bulk_write_owners(orm_execute_state, connection) -> Set[int]:
+    """Users whose registrations a bulk UPDATE/DELETE of ``FormData`` is about to write."""
+    owners = select(FormData.user_id).distinct()
+    if not isinstance(orm_execute_state.parameters, list):
+        if orm_execute_state.statement.whereclause is not None:
+            owners = owners.where(orm_execute_state.statement.whereclause)
+        return set(connection.execute(owners).scalars())
+    ids = bulk_write_ids(orm_execute_state, connection)
+    found = set()
+    for start in range(0, len(ids), _BATCH_SIZE):
+        found.update(connection.execute(
+            owners.where(FormData.id.in_(ids[start:start + _BATCH_SIZE]))).scalars())
+    return found
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _bump_on_bulk_write(orm_execute_state):
+    if not (orm_execute_state.is_update or orm_execute_state.is_delete):
+        return
+    mapper = orm_execute_state.bind_mapper
+    if mapper is None or mapper.class_ not in SCOPES_BY_MODEL:
+        return
+    connection = orm_execute_state.session.connection()
+    scopes = set(SCOPES_BY_MODEL[mapper.class_])
+    if mapper.class_ is FormData:
+        scopes.update(user_forms(user_id) for user_id in _bulk_write_owners(orm_execute_state, connection))
+    bump(connection, scopes)